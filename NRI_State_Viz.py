@@ -7,573 +7,660 @@ Created on Sat Dec 10 11:39:38 2022
 """
 
 #data processing and manipulatation packages
+import io
 import pandas as pd
 import numpy as np
-from urllib.request import urlopen
-import json
 
-#visualization packages
-import plotly.express as px
-import plotly 
+#cached local data loading and precomputed aggregates
+from nri_data import load_nri, load_tracts, tracts_available, tracts_digest
+from nri_raster import load_tract_raster
+from nri_stats import load_statistics, correlation_table
+from nri_scenario import load_scenarios
+from nri_rank import load_rankings, rank_column, ranking_table
+from nri_lookup import load_profiles
+from nri_hotspot import load_hotspots
+from nri_cube import load_cube, NATIONAL, PERIL_NAMES, PERIL_BY_NAME, TOTAL_COLUMNS
+from nri_geo import load_geometry
+from nri_mapview import map_chart, figure_chart
+from nri_figcache import figure_cache
+from nri_sections import section
+from nri_registry import depends, refresh, refresh_geometry
+from nri_metrics import rerun, timed
+
+#headless filtering, ranges and figure builders
+from nri_core import (NO_GEOMETRY, RISK_RANGE, SCATTER_COLUMNS, SCATTER_FRAME_COLUMNS, SCATTER_LABELS, X_VALUE, MAP_PERILS, EXPOSURE_VARIABLES, RISK_VARIABLES,
+                      PERIL_RANGE_SHARE, Y_RANGE_SHARE, X_RANGE_SHARE, state_views, state_view, state_counties, peril_frame,
+                      tract_values, tract_range, tract_map_figure, add_hotspot_layer, scenario_state_figure, scenario_distribution_figure,
+                      scatter_frame, exposure_bounds, peril_bound, loss_overview_figure, county_map_figure,
+                      peril_bar_figure, peril_map_figure, exposure_scatter_figure, risk_scatter_figure)
 
 #dashboard package
 import streamlit as st
 
-#Writing dashboard title 
-st.title("Evaluating Natural Disaster and Climate Risk in California, Florida, New York, and Texas")
 
-#Adding text describing issue 
-st.write('Natural disasters present a fundamental risk to housing and economic security in the U.S. In 2021 alone natural disasters cost the U.S $145 Billion. In an effort to improve data surrounding natural disasters, the Federal Emergency Management Agency released the National Risk Index (NRI) which provides comprehensive county level data on natural disaster risks.')
+#a new release of the data or the geometry only recomputes what its changed states and columns feed
+with timed('refresh'):
+    refresh()
+    refresh_geometry()
 
-st.write('This dashboard uses NRI data to analyze and visualize climate risk in four states: California, Florida, New York and Texas. These states represent the four most populous states in the country and the four states with over 2 trillion dollars in building value. Additionally, California, Texas, and Florida represent the three states with the highest expected annual loss due to climate change. Analyzing these states allows us to see the risk profile of four distinct regions in the country.')
+#importing county geometry, read once per process from the vendored json and
+#partitioned by state with simplified variants per zoom
+with timed('load_geometry'):
+    geometry = load_geometry()
 
-st.write('This tool is intended for federal, state, and local policy makers, who may use it to gain a better understanding of geospatial risk in their state. However, it can be used by anyone, for example a perspective property buyer seeking to understand the climate risk associated with their future properties.')
+#importing data, read once per process from the bundled csv (STCOFIPS is renamed to FIPS, stored as int codes)
+with timed('load_nri'):
+    NRI = load_nri()
 
+#state x peril x loss-type sums and per-state quantiles, built once per dataset version
+with timed('load_cube'):
+    cube = load_cube()
 
-#imporing json 
-with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-    county = json.load(response)
-    
-#importing data from github
-NRI=pd.read_csv('https://raw.githubusercontent.com/ellisobrien/State_Climate_Risk_Comp/main/NRI_State_Dat.csv', dtype={"STCOFIPS": str})
 
-#renaming county fips code
-NRI.rename(columns={'STCOFIPS':'FIPS'}, inplace=True)
+#page sections and the widgets each one depends on; a section's compute steps are
+#memoized on those widgets, so an interaction only recomputes the sections reading it
+overview = section('page')
+section1 = section('section 1', depends_on=('State_Name1', 'resolution'))
+section2 = section('section 2', depends_on=('State_Name2', 'variable1', 'Map_Range3', 'rank_scope', 'rank_loss', 'rank_count'))
+section3 = section('section 3', depends_on=('y_value', 'Map_Range4', 'Map_Range5', 'y_value2', 'Map_Range6'))
+section4 = section('section 4', depends_on=('scenario_state', 'scenario_peril', 'frequency_change', 'exposure_change', 'uncertainty'))
+#uploaded portfolios are memoized by content, keep only a few
+section5 = section('section 5', depends_on=('latitude', 'longitude', 'portfolio'), maxsize=16)
 
 
+##############################################################################
+#figure builders
+##############################################################################
+
+#cached wrappers binding the core figure builders to this process's data, pure functions
+#of their inputs so every session shares the cached figure
+#(@depends declares the state and columns each reads, so a new data release keeps the rest)
+@figure_cache.cached
+@depends(state='state', national=('hotspots',))
+def county_map_1(state, input_var, map_leg, z, center, input_desc, hotspots=False):
+    #map_chart sends the polygons from the shared geometry store, the figure only holds colors
+    fig = county_map_figure(state_counties(NRI, state), NO_GEOMETRY, input_var, map_leg, z, center, input_desc)
+    #significant clusters of the mapped variable, computed across state lines
+    return add_hotspot_layer(fig, load_hotspots().overlay(input_var, state)) if hotspots else fig
+
+
+@figure_cache.cached
+@depends(state='state', national=('hotspots',))
+def county_map_2(state, input_var, map_leg, z, center, hotspots=False):
+    fig = peril_map_figure(peril_frame(NRI, state), NO_GEOMETRY, input_var, map_leg, z, center)
+    return add_hotspot_layer(fig, load_hotspots().overlay(PERIL_BY_NAME[input_var] + '_EALT', state)) if hotspots else fig
+
+
+#census tract version of county_map_1, rasterized server-side into one image; map_leg=None
+#caps the range at the state's tract quantile. the cache key only follows the county data,
+#so tracts is the tract sources' digest and a new tract release misses the cache
+@figure_cache.cached
+@depends(state='state')
+def tract_map(state, tracts, input_var, map_leg, z, center, input_desc):
+    values = tract_values(load_tracts(), state, input_var)
+    map_leg = map_leg or tract_range(values)
+    image, bounds = load_tract_raster().image(cube.state_fips(state), z, values, map_leg)
+    return tract_map_figure(image, bounds, map_leg, z, center, input_desc)
+
+
+@figure_cache.cached
+@depends(columns=SCATTER_FRAME_COLUMNS)
+def scatter_plot(y_value, y_range, x_range):
+    return exposure_scatter_figure(scatter_data(), y_value, y_range, x_range)
+
+
+@figure_cache.cached
+@depends(columns=SCATTER_FRAME_COLUMNS)
+def scatter_plot2(y_value, map_range):
+    return risk_scatter_figure(scatter_data(), y_value, map_range)
 
 
 ##############################################################################
 #section 1
 ##############################################################################
-#section header
-st.header('Overview of Loss by State and County Risk')
 
-#section desrciption
-st.write("This section provides a high level understanding of loss and risk for each state analyzed.")
+#center, zoom and color range of every state in the data, fitted to its counties' bounds
+#and loss quantiles once per dataset version
+@overview.step
+def views():
+    return state_views(cube, geometry)
+
+
+#making bar graph of state level loss, read from the precomputed state x peril cube
+@section1.step
+@depends(columns=TOTAL_COLUMNS.values())
+def loss_overview():
+    return loss_overview_figure(cube)
+
+
+#zoom, center and map range of the selected state
+@section1.step
+@depends(state='State_Name1', columns=['EAL_VALT'])
+def state_map_view(State_Name1):
+    (x, y), zoom, Map_Range2 = state_view(views(), State_Name1)
+    return x, y, Map_Range2, zoom
+
+
+@section1.render
+def section_1():
+    #section header
+    st.header('Overview of Loss by State and County Risk')
+
+    #section desrciption
+    st.write("This section provides a high level understanding of loss and risk for each state analyzed.")
+
+    #displaying viz
+    figure_chart(loss_overview(), key='figure_1')
+
+    #adding cpation
+    st.caption('Buildings are the primary driver of loss from natural disasters. While agricultural loss is not as financially damaging, food systems could be strained as climate change intensifies. In this dataset population is defined as the injury or loss of life from natural disasters converted to dollar terms. It is interesting that California leads in building and agricultural loss, but Texas has the largest population loss by a significant margin.')
+
+    #adding space
+    st.text("")
+
+    st.text("")
+
+    st.text("")
+
+    st.text("")
+
+    #Adding header
+    st.subheader('Maps of Loss and Risk')
 
+    #Providng context
+    st.write('Select a state from the drop down below to view county level loss and risk maps for the state you select.')
 
+    #initiating dropdown
+    State_Name1=st.selectbox(label="Select State to View",
+    options=tuple(views().index))
 
-#selecting key states for scatter plot
-nri_plot_1=NRI[['STATEABBRV', 'EAL_VALB', "EAL_VALA", "EAL_VALPE"]]
+    #tract resolution is offered when the tract table and geometry are configured
+    resolution = 'County'
+    if tracts_available():
+        resolution = st.radio('Map resolution', ('County', 'Census tract'))
 
-#summinng features
-nri_plot_1=nri_plot_1.groupby('STATEABBRV').sum()
+    #clusters of high or low values spanning neighboring counties, county resolution only
+    hotspots1 = resolution == 'County' and st.checkbox('Show Hotspots', key='hotspots1')
+    if hotspots1:
+        st.caption('Hotspots are counties where both the county and its neighbors, including neighbors across state lines, have significantly high values; cold spots have significantly low ones. Outliers differ significantly from their neighbors. Significance is p < 0.05 from 999 random reshufflings of county values (local Moran\'s I); hover a marker for its Getis-Ord Gi* z-score.')
+
+    #writing text
+    st.write('Figure 2 shows annual expected loss by county for the state you select. Figure 3 shows the composite risk score (composite risk score is described below figure 3). Hover your cursor over a county on the map to see the specific loss/risk for that county. Hover information in figure 2 also shows vulnerability and reslience ratings as provided by FEMA. Descriptions and definitions of loss, risk, vulnerability, and reslience can be accessed from this webpage: https://hazards.fema.gov/nri/')
+    title_text = "**" + State_Name1 + "**"
+
+    #spacing
+    st.text("")
+
+    st.text("")
+
+    x, y, Map_Range2, zoom = state_map_view(State_Name1)
+
+    #state fips for picking the state's counties out of the geometry store
+    state_fips1 = cube.state_fips(State_Name1)
+
+    #writing map title
+    st.write('**Figure 2: Annual Expected Loss by County for**', title_text)
+    st.caption('Highly Populated Coastal Areas Tend to Have the Highest Expected Losses')
+
+
+    #Enter Variables to Map here
+    variable_to_map_NRI2='EAL_VALT'
+
+    #Enter Variable Description
+    NRI_description2='Annual Expected Loss'
+
+    #running function, geometry goes to the browser once per session and reruns only send colors and range
+    if resolution == 'Census tract':
+        fig1 = tract_map(State_Name1, tracts_digest(), variable_to_map_NRI2, None, zoom, (x, y), NRI_description2)
+        figure_chart(fig1, key='tract_' + variable_to_map_NRI2)
+    else:
+        fig1 = county_map_1(State_Name1, variable_to_map_NRI2, Map_Range2, zoom, (x, y), NRI_description2, hotspots1)
+        map_chart(fig1, geometry, state_fips1, zoom, key='map_' + variable_to_map_NRI2)
+
+    #writing caption
+    st.caption('Losses are heavily influenced by two factors: peril frequency/intensity and population. Population is highly correlated with loss since there tends to be more infrastructure and exposure in highly populated areas. For example, while Miami-Dade County and Los Angeles County are not inherently higher risk than their neighboring counties, their losses are much higher due to population.')
+
+    st.caption('_Please note that the loss range changes for each state in the above figure so that higher and lower loss counties can be differentiated between within a state._')
+
+    #spacing format
+    st.text("")
+
+    st.text("")
+
+    st.text("")
+
+    #title and caption for figure 3
+    st.write('**Figure 3: Composite Risk Score by County for**', title_text)
+    st.caption('_Risk Score Takes Into Account Composite Risk From All Perils_')
+
+    #Enter Variables to Map here
+    variable_to_map_NRI1='RISK_SCORE'
+
+    #Enter Variable Description
+    NRI_description1='Composite Risk Score'
+
+    #setting map range
+    Map_Range1=RISK_RANGE
+    #running mapping function
+    if resolution == 'Census tract':
+        fig1 = tract_map(State_Name1, tracts_digest(), variable_to_map_NRI1, Map_Range1, zoom, (x, y), NRI_description1)
+        figure_chart(fig1, key='tract_' + variable_to_map_NRI1)
+    else:
+        fig1 = county_map_1(State_Name1, variable_to_map_NRI1, Map_Range1, zoom, (x, y), NRI_description1, hotspots1)
+        map_chart(fig1, geometry, state_fips1, zoom, key='map_' + variable_to_map_NRI1)
+
+    st.caption('Risk Score takes into account risk from all 18 Perils in the risk index, as well as social vulnerability and community relience. While it is still highly correlated with expected loss in this map we start to see more rural, less populated areas with higher risk scores relative to their expected loss.')
+
+
+##############################################################################
+#section 2
+##############################################################################
 
-#making state a coumumn
-nri_plot_1.reset_index(inplace=True)
+#making bargraph of loss by peril for the selected state, read from the precomputed cube
+@section2.step
+@depends(state='State_Name2')
+def peril_overview(State_Name2):
+    return peril_bar_figure(cube, State_Name2)
 
-#sorting data for plot
-nri_plot_1=nri_plot_1.sort_values(by=['EAL_VALB'], ascending=False)
 
-#renaming columns
-nri_plot_1.rename(columns={'EAL_VALB': 'Building Loss',
-                         'EAL_VALA': 'Agricultural Loss',
-                         'EAL_VALPE': 'Population Loss'},
-                                           inplace=True)
+#zoom and postion of the selected state
+@section2.step
+@depends(state='State_Name2', columns=())
+def peril_map_view(State_Name2):
+    (x2, y2), zoom, _ = state_view(views(), State_Name2)
+    return x2, y2, zoom
 
-#making bar graph
-fig0 = px.bar(nri_plot_1, x="STATEABBRV", 
-             y=['Building Loss', 'Agricultural Loss', 'Population Loss'], 
-             labels={"value": "Annual Estimated Loss ($)", 'STATEABBRV':'State', "variable": "Loss Breakdown"},
-             color_discrete_map={"Building Loss": "silver", "Agricultural Loss": "green", 'Population Loss':'black'},
-             template="simple_white",
-             height=400)
-fig0.update_layout(title_text = '<b>Figure 1: State Level Loss Broken Down by Loss Type </b> <br><sup> California and Texas Lead All States in Loss </sup>')
 
-#displaying viz
-st.plotly_chart(fig0)
+#setting slider range from the cube's precomputed state maximum
+@section2.step
+@depends(state='State_Name2')
+def peril_slider_max(State_Name2, variable1):
+    return peril_bound(cube, State_Name2, variable1)
 
-#adding cpation
-st.caption('Buildings are the primary driver of loss from natural disasters. While agricultural loss is not as financially damaging, food systems could be strained as climate change intensifies. In this dataset population is defined as the injury or loss of life from natural disasters converted to dollar terms. It is interesting that California leads in building and agricultural loss, but Texas has the largest population loss by a significant margin.')
 
-#adding space
-st.text("")
+#top counties for the selected peril, sliced from the precomputed ranking index
+@section2.step
+def peril_ranking(State_Name2, variable1, rank_scope, rank_loss, rank_count):
+    column = rank_column(variable1, rank_loss.lower())
+    state = NATIONAL if rank_scope == 'All States' else State_Name2
+    ranked = load_rankings().top(column, rank_count, state)
+    return ranking_table(ranked, column, rank_loss + ' Loss ($)')
 
-st.text("")
 
-st.text("")
+@section2.render
+def section_2():
+    #spacing
+    st.text("")
 
-st.text("")
+    st.text("")
 
-#Adding header
-st.subheader('Maps of Loss and Risk')
+    st.text("")
 
-#Providng context
-st.write('Select a state from the drop down below to view county level loss and risk maps for the state you select.') 
- 
-#initiating dropdown
-State_Name1=st.selectbox(label="Select State to View",
-options=('CA', 'FL', 'NY', 'TX' ))
+    #writing section hearder
+    st.header('Analysis of Peril-Specific Loss by State ')
+    st.write('Section one was intended to provide a high level overview of climate risk. This section identifies the primary perils for each state.')
 
-#writing text
-st.write('Figure 2 shows annual expected loss by county for the state you select. Figure 3 shows the composite risk score (composite risk score is described below figure 3). Hover your cursor over a county on the map to see the specific loss/risk for that county. Hover information in figure 2 also shows vulnerability and reslience ratings as provided by FEMA. Descriptions and definitions of loss, risk, vulnerability, and reslience can be accessed from this webpage: https://hazards.fema.gov/nri/')
-title_text = "**" + State_Name1 + "**"
+    #spacing
+    st.text("")
 
-#spacing
-st.text("")
+    st.text("")
 
-st.text("")
 
+    #dropdown directions
+    st.write('Select a state from the dropdown below to see which perils drive losses in the state.')
 
-#setting zoom and map range based on state name 
-if State_Name1 == 'CA':
-    x=38.1063
-    y=-120.7367
-    Map_Range2=(0,500000000)
-    zoom=4.5
-    
-elif State_Name1 == 'FL':
-    x= 27.36895
-    y=-82.30029
-    Map_Range2=(0,100000000)
-    zoom=5
+    #setting drop down menu
+    State_Name2=st.selectbox(label="Select State",
+    options=tuple(views().index))
 
-elif State_Name1 == 'NY':
-    x= 42.9058
-    y=-75.0933
-    Map_Range2=(0,30000000)
-    zoom=5
-    
-elif State_Name1 == 'TX':
-    x=31.35394
-    y=-99.25277
-    Map_Range2=(0,50000000)
-    zoom=4.5
+    #formatting state name for title
+    title_text2 = "**" + State_Name2 + "**"
 
+    #state fips for picking the state's counties out of the geometry store
+    state_fips2 = cube.state_fips(State_Name2)
 
-#filtering based on state name
-NRI_MAP1=NRI[NRI.STATEABBRV == State_Name1]
+    #displaying bargraph
+    figure_chart(peril_overview(State_Name2), key='figure_4')
+    #displaying caption
+    st.caption('Earthquake is the leading cause of loss in California, inland flooding is the leading cause of loss in New York, hurricane is the leading cause of loss in Texas and Florida. Different regions, climates, and geographies contrinbute to very different dominant perils across states.')
 
+    #spacing
+    st.text("")
 
-#initilizing mapping function 
-def county_map_1(input_var, map_leg, z, input_desc):
-    fig1 = px.choropleth_mapbox(NRI_MAP1, geojson=county, locations='FIPS', color=input_var,
-                                   color_continuous_scale="balance",
-                                   range_color=map_leg,
-                                   mapbox_style="carto-positron",
-                                   zoom=z, center = {"lat": x, "lon": y},
-                                   opacity=0.7,
-                                   hover_name="COUNTY", hover_data=["SOVI_RATNG", "RESL_RATNG"],
-                                   labels={input_var: input_desc, 'STCOFIPS':'FIPS', 'SOVI_RATNG':'Social Vulnerability', 'RESL_RATNG':'Resilience'}
-                                  )
-    fig1.update_layout(margin={"r":0,"t":0,"l":0,"b":0}, geo_scope='usa')
-    st.plotly_chart(fig1)
+    st.text("")
 
+    st.text("")
 
-#writing map title 
-st.write('**Figure 2: Annual Expected Loss by County for**', title_text)
-st.caption('Highly Populated Coastal Areas Tend to Have the Highest Expected Losses')
+    st.text("")
 
+    st.text("")
+    #Section subheader
+    st.subheader('Map of Peril Specific Losses')
+    #directions
+    st.write('Select a peril from the dropdown below to see the perils county level losses for your selected state. You can also adjust the slider below to alter the map range to see more or less differentiation betwen counties.')
 
-#Enter Variables to Map here 
-variable_to_map_NRI2='EAL_VALT'
+    #map dropdown
+    variable1=st.selectbox(label="Peril to View",
+    options=MAP_PERILS)
 
-#Enter Variable Description 
-NRI_description2='Annual Expected Loss'
+    #formatting title text
+    title_text3 = "**" + variable1 + "**"
 
-#running function 
-county_map_1(variable_to_map_NRI2, Map_Range2, zoom, NRI_description2)
+    x2, y2, zoom = peril_map_view(State_Name2)
 
-#writing caption
-st.caption('Losses are heavily influenced by two factors: peril frequency/intensity and population. Population is highly correlated with loss since there tends to be more infrastructure and exposure in highly populated areas. For example, while Miami-Dade County and Los Angeles County are not inherently higher risk than their neighboring counties, their losses are much higher due to population.')
+    pyup4 = peril_slider_max(State_Name2, variable1)
 
-st.caption('_Please note that the loss range changes for each state in the above figure so that higher and lower loss counties can be differentiated between within a state._')
+    #setting
+    Map_Range3 = st.slider(
+        'Edit Map Range (Map range values are in Dollars)',
+        0.0, pyup4, pyup4*PERIL_RANGE_SHARE, step = 10000.0)
 
-#spacing format
-st.text("")
+    st.write('**Figure 5: County Level**', title_text3, '**Expected Loss for**', title_text2)
+    st.caption('Geographic Region Determine Peril Vulnerability by State')
 
-st.text("")
+    #showing fiugre, geometry goes to the browser once per session
+    hotspots2 = st.checkbox('Show Hotspots', key='hotspots2')
 
-st.text("")
+    fig3 = county_map_2(State_Name2, variable1, (0, Map_Range3 ), zoom, (x2, y2), hotspots2)
+    map_chart(fig3, geometry, state_fips2, zoom, key='peril_map')
+    st.caption('Most states are only threatened by a few perils with virtually no risk from other types of disasters. For example, while California has the highest annual expected loss in the country it has virtually no hurricane risk due to cold waters in the Pacific Ocean.')
 
-#title and caption for figure 3
-st.write('**Figure 3: Composite Risk Score by County for**', title_text)
-st.caption('_Risk Score Takes Into Account Composite Risk From All Perils_')
+    st.text("")
 
-#Enter Variables to Map here 
-variable_to_map_NRI1='RISK_SCORE'
+    #county rankings for the mapped peril
+    st.write('**Counties with the Highest**', title_text3, '**Expected Loss**')
+    st.write('Rank counties by the peril above, in your selected state or across all states. Click a column header to re-sort the table.')
+    rank_scope = st.radio('Rank Counties In', ('Selected State', 'All States'))
+    #only the loss types the peril has columns for, drought has no building loss for example
+    rank_loss = st.selectbox(label="Loss Type", options=tuple(l.title() for l in sorted(load_rankings().loss_types(variable1), key=lambda l: l != 'total')))
+    rank_count = st.slider('Number of Counties', 5, 100, 20, step=5)
+    st.dataframe(peril_ranking(State_Name2, variable1, rank_scope, rank_loss, rank_count))
 
-#Enter Variable Description 
-NRI_description1='Composite Risk Score'
 
-#setting map range 
-Map_Range1=(0,50)
-#running mapping function
-county_map_1(variable_to_map_NRI1, Map_Range1, zoom, NRI_description1)
+    st.text("")
 
-st.caption('Risk Score takes into account risk from all 18 Perils in the risk index, as well as social vulnerability and community relience. While it is still highly correlated with expected loss in this map we start to see more rural, less populated areas with higher risk scores relative to their expected loss.')
+    st.text("")
 
+    st.text("")
 
-#writing map title 2
 
 ##############################################################################
-#section 2
+#section 3
 ##############################################################################
-
-#spacing
-st.text("")
-
-st.text("")
-
-st.text("")
-
-#writing section hearder
-st.header('Analysis of Peril-Specific Loss by State ')
-st.write('Section one was intended to provide a high level overview of climate risk. This section identifies the primary perils for each state.')
-
-#spacing 
-st.text("")
-
-st.text("")
-
-
-#dropdown directions
-st.write('Select a state from the dropdown below to see which perils drive losses in the state.')
-
-#setting drop down menu
-State_Name2=st.selectbox(label="Select State",
-options=('CA', 'FL', 'NY', 'TX' ))
-
-#formatting state name for title
-title_text2 = "**" + State_Name2 + "**"
-
-#filtering text based on state name
-NRI_Map2=NRI[NRI.STATEABBRV == State_Name2]
-
-#filling NA
-NRI_Map2 = NRI_Map2.fillna(0)
-
-#selecting columns for map
-NRI_Map2=NRI_Map2[['FIPS', 'COUNTY', 'AVLN_EALT',
-'CFLD_EALT',
-'CWAV_EALT',
-'DRGT_EALT',
-'ERQK_EALT',
-'ISTM_EALT',
-'HAIL_EALT',
-'HWAV_EALT',
-'HRCN_EALT',
-'LTNG_EALT',
-'LNDS_EALT',
-'RFLD_EALT',
-'SWND_EALT',
-'TSUN_EALT',
-'TRND_EALT',
-'WFIR_EALT',
-'VLCN_EALT',
-'WNTW_EALT']]
-
-#renaming columns 
-NRI_Map2.rename(columns={'AVLN_EALT': 'Avalanche',
-                   'CFLD_EALT': 'Coastal Flooding',
-                   'CWAV_EALT': 'Cold Wave',
-                   'DRGT_EALT': 'Drought',
-                   'ERQK_EALT': 'Earthquake',
-                   'HAIL_EALT': 'Hail',
-                   'ISTM_EALT': 'Ice Storm',
-                   'HWAV_EALT': 'Heat Wave',
-                   'HRCN_EALT': 'Hurricane',
-                   'LTNG_EALT': 'Lightning',
-                   'LNDS_EALT': 'Landslide',
-                   'RFLD_EALT': 'Riverine Flooding',
-                   'SWND_EALT': 'Strong Wind',
-                   'TRND_EALT': 'Tornado',
-                   'TSUN_EALT': 'Tsunami',
-                   'WFIR_EALT': 'Wildfire',
-                   'VLCN_EALT': "Volcanic Activity",
-                   'WNTW_EALT': 'Winter Weather',
-                    
-                    
-                  },    inplace=True) 
-
-#setting new map
-NRI_Map3=NRI_Map2[['Avalanche',
-                   'Coastal Flooding',
-                   'Cold Wave',
-                   'Drought',
-                   'Earthquake',
-                   'Hail',
-                   'Ice Storm',
-                   'Heat Wave',
-                   'Hurricane',
-                   'Lightning',
-                   'Landslide',
-                   'Riverine Flooding',
-                   'Strong Wind',
-                   'Tornado',
-                   'Tsunami',
-                   'Wildfire',
-                   "Volcanic Activity",
-                   'Winter Weather']]
-
-#summing values
-NRI_Map3=NRI_Map3.sum()
-#converting to data frame
-NRI_Map3=NRI_Map3.to_frame() 
-#renaming columns 
-NRI_Map3.reset_index(inplace=True)
-NRI_Map3.rename(columns={0: 'Expected Annual Loss'},
-          inplace=True)
-
-
-#SORTING for bar graph
-NRI_Map3=NRI_Map3.sort_values(by=['Expected Annual Loss'], ascending=False)
-
-
-#making bargraph
-fig2 = px.bar(NRI_Map3, x='index', y='Expected Annual Loss',
-                 labels={"index": "<b> Peril </b>", 'Expected Annual Loss': '<b>Expected Annual Loss ($)</b>' },
-                template="simple_white"
-            )
-fig2.update_layout(title_text = '<b>Figure 4: Loss by Peril For Selected State </b> <br><sup> Risk Profiles are Very Different Across States </sup>')
-fig2.update_traces(marker_color='DarkRed')
-
-#displaying bargraph
-st.plotly_chart(fig2)
-#displaying caption
-st.caption('Earthquake is the leading cause of loss in California, inland flooding is the leading cause of loss in New York, hurricane is the leading cause of loss in Texas and Florida. Different regions, climates, and geographies contrinbute to very different dominant perils across states.')
-
-#spacing
-st.text("")
-
-st.text("")
-
-st.text("")
-
-st.text("")
-
-st.text("")
-#Section subheader
-st.subheader('Map of Peril Specific Losses')
-#directions
-st.write('Select a peril from the dropdown below to see the perils county level losses for your selected state. You can also adjust the slider below to alter the map range to see more or less differentiation betwen counties.')
-
-#map dropdown
-variable1=st.selectbox(label="Peril to View",
-options=('Coastal Flooding',
-                   'Cold Wave',
-                   'Drought',
-                   'Earthquake',
-                   'Hail',
-                   'Ice Storm',
-                   'Heat Wave',
-                   'Hurricane',
-                   'Lightning',
-                   'Landslide',
-                   'Riverine Flooding',
-                   'Strong Wind',
-                   'Tornado',
-                   'Wildfire',
-                   'Winter Weather'))
-
-#formatting title text 
-title_text3 = "**" + variable1 + "**"
-
-
-
-#setting zoom and postion based on state selection
-if State_Name2 == 'CA':
-    x2=38.1063
-    y2=-120.7367
-    zoom=4.5
-    
-elif State_Name2 == 'FL':
-    x2= 27.36895
-    y2=-82.30029
-    zoom=5
-
-
-elif State_Name2 == 'NY':
-    x2= 42.9058
-    y2=-75.0933
-    zoom=5
-    
-elif State_Name2 == 'TX':
-    x2=31.35394
-    y2=-99.25277
-    zoom=4.5
-
-#defining mapping function
-def county_map_2(input_var, map_leg, z):
-    fig3 = px.choropleth_mapbox(NRI_Map2, geojson=county, locations='FIPS', color=input_var,
-                                   color_continuous_scale="balance",
-                                   range_color=map_leg,
-                                   mapbox_style="carto-positron",
-                                   zoom=z, center = {"lat": x2, "lon": y2},
-                                   opacity=0.7,
-                                   hover_name="COUNTY",
-                                   labels={'STCOFIPS':'FIPS'}
-                                  )
-    fig3.update_layout(margin={"r":0,"t":0,"l":0,"b":0}, geo_scope='usa')
-    #showing fiugre 
-    st.plotly_chart(fig3)
-
-
-#set
-upper_bound_draft4=NRI_Map2[[variable1]].max()
-up4=upper_bound_draft4[0]
-pyup4 = up4.item()
+
+#county frame with display labels for the scatter plots, built once per dataset version
+@section3.step
+@depends(columns=SCATTER_FRAME_COLUMNS)
+def scatter_data():
+    return scatter_frame(NRI)
+
+
+#setting slider ranges from the cube's precomputed national maximum
+@section3.step
+@depends(columns=SCATTER_LABELS)
+def exposure_slider_max(y_value):
+    return exposure_bounds(cube, y_value, NATIONAL)
+
+
+#correlation and log-log fit of loss with the selected metric, bootstrapped once per dataset version
+@section3.step
+def exposure_statistics(y_value):
+    return correlation_table(load_statistics(), SCATTER_COLUMNS[y_value], y_value)
+
+
+@section3.step
+def risk_statistics(y_value2):
+    return correlation_table(load_statistics(), SCATTER_COLUMNS[y_value2], y_value2)
+
+
+@section3.render
+def section_3():
+    st.header('County Level Correlations with Loss')
+
+    st.write("This section provides an overview of the correlations between expected loss and key exposure and risk metrics. Exposure (i.e., building value, population) and risk (i.e., risk score and social vulnerability) dictate losses so it is useful to see corelations between loss and each of these factors. Each point on the below charts represents a county. It is perhaps less useful to examine low loss counties on these graphs but they are useful for indentifying high risk/high loss outliers.")
+
+    st.text("")
+
+    st.text("")
+
+    st.text("")
+
+    #settingsection
+    st.write('**Examining Relationship Between Loss and Exposure**')
+    st.write('Select an exposure metric from the drop down below to see how it is correlated with loss. Additionally, you can adjust the slider to alter the y or x axis. The slider slides from the minimum and maximum possible value for each axis.')
+    #Enter Y Variable and Description
+    y_value=st.selectbox(label="Select Variable",
+    options=EXPOSURE_VARIABLES)
+
+    pyup5, pyup6 = exposure_slider_max(y_value)
+
+    #inputting slideer
+    Map_Range4 = st.slider(
+        'Edit Y-Axis',
+        0.0, pyup5, pyup5*Y_RANGE_SHARE, step = 100000.0)
+
+    #implementing slider
+    Map_Range5 = st.slider(
+        'Edit X-Axis, Expected Loss',
+        0.0, pyup6, pyup6*X_RANGE_SHARE, step = 100000.0)
+
+    #running function
+    figure_chart(scatter_plot(y_value, (0, Map_Range4), (0, Map_Range5)), key='figure_6')
+
+    #data caption
+    st.caption('Building Value and Population tend to be highly correlated with loss. But this pattern is not as strong across all states. In New York for example, there are many high loss high population counties that have low relative loss.')
+
+    #statistics behind figure 6
+    st.write('**Table 1: Correlation of Expected Loss with**', "**" + y_value + "**")
+    st.dataframe(exposure_statistics(y_value))
+    st.caption('Loss elasticity is the slope of a log-log fit: the % change in expected loss for a 1% change in the metric. Intervals are 95% bootstrap intervals over counties.')
+    #text spacing
+    st.text("")
+
+    st.text("")
+
+    st.text("")
+
+    #setting subheading
+    st.write('**Examining Relationship Between Loss and Risk Metrics**')
+    st.write('')
+    #select box for dropdown 2
+    y_value2=st.selectbox(label="Select Risk Variable",
+    options=RISK_VARIABLES)
 
 
-#setting 
-Map_Range3 = st.slider(
-    'Edit Map Range (Map range values are in Dollars)',
-    0.0, pyup4, pyup4*.5, step = 10000.0)
-
-st.write('**Figure 5: County Level**', title_text3, '**Expected Loss for**', title_text2)
-st.caption('Geographic Region Determine Peril Vulnerability by State')
-
-county_map_2(variable1, (0, Map_Range3 ), zoom)
-st.caption('Most states are only threatened by a few perils with virtually no risk from other types of disasters. For example, while California has the highest annual expected loss in the country it has virtually no hurricane risk due to cold waters in the Pacific Ocean.')
-
-
-st.text("")
-
-st.text("")
-
-st.text("")
+    #setting slider range
+    pyup7 = cube.max(NATIONAL, SCATTER_COLUMNS[X_VALUE])
+
+    #inputting slider
+    Map_Range6 = st.slider(
+        'Edit X-Axis, Expected Loss',
+        0.0, pyup7, pyup7*X_RANGE_SHARE, step = 100000.00, key=9)
+
+    #running function
+    figure_chart(scatter_plot2(y_value2, (0, Map_Range6)), key='figure_7')
+
+    #writing caption
+    st.caption('According to FEMA, risk score and social vulnerability should be highly correlated with loss, while community resilience should be negativley correlated with loss. This chart shows a strong positive correlation between risk and loss, but the relationship between vulnerability and resilience is weaker.')
+
+    #statistics behind figure 7
+    st.write('**Table 2: Correlation of Expected Loss with**', "**" + y_value2 + "**")
+    st.dataframe(risk_statistics(y_value2))
+
 
 ##############################################################################
-#section 3
+#section 4
 ##############################################################################
-st.header('County Level Correlations with Loss')
 
-st.write("This section provides an overview of the correlations between expected loss and key exposure and risk metrics. Exposure (i.e., building value, population) and risk (i.e., risk score and social vulnerability) dictate losses so it is useful to see corelations between loss and each of these factors. Each point on the below charts represents a county. It is perhaps less useful to examine low loss counties on these graphs but they are useful for indentifying high risk/high loss outliers.")
+#label of the scenario applying to every state
+ALL_STATES = 'All states'
+
+
+#multipliers of the chosen scenario: peril frequency and building exposure changes in one or all states
+@section4.step
+def scenario_multipliers(scenario_state, scenario_peril, frequency_change, exposure_change):
+    engine = load_scenarios()
+    states = None if scenario_state == ALL_STATES else scenario_state
+    return (engine.multipliers(frequency={scenario_peril: 1 + frequency_change / 100}, states=states) *
+            engine.multipliers(exposure={'building': 1 + exposure_change / 100}, states=states))
+
+
+@section4.step
+def scenario_states(scenario_state, scenario_peril, frequency_change, exposure_change):
+    engine = load_scenarios()
+    M = scenario_multipliers(scenario_state, scenario_peril, frequency_change, exposure_change)
+    return scenario_state_figure(engine.state_loss(engine.multipliers()), engine.state_loss(M))
+
+
+#monte carlo draws around the scenario, one batched evaluation of every draw
+@section4.step
+def scenario_outcomes(scenario_state, scenario_peril, frequency_change, exposure_change, uncertainty):
+    engine = load_scenarios()
+    M = scenario_multipliers(scenario_state, scenario_peril, frequency_change, exposure_change)
+    totals, _ = engine.monte_carlo(engine.sample(M, uncertainty / 100), counties=False)
+    baseline = engine.state_loss(engine.multipliers())
+    if scenario_state != ALL_STATES:
+        totals, baseline = totals[scenario_state], baseline[scenario_state]
+    else:
+        totals, baseline = totals.sum(axis=1), baseline.sum()
+    fig = scenario_distribution_figure(totals, baseline, scenario_state)
+    return fig, totals.quantile([0.05, 0.5, 0.95]).to_numpy()
 
-st.text("")
 
-st.text("")
+@section4.render
+def section_4():
+    st.text("")
 
-st.text("")
+    st.text("")
 
-NRI_Scatter=NRI[['COUNTY','STATEABBRV', 'BUILDVALUE', 'POPULATION', 'AGRIVALUE', 'RISK_SCORE', 'SOVI_SCORE', 'RESL_SCORE', 'EAL_VALT']]
+    st.text("")
 
-NRI_Scatter.rename(columns={'STATEABBRV': 'State',
-                    'BUILDVALUE': 'Building Value ($)',
-                   'POPULATION': 'Population',
-                   'AGRIVALUE': 'Agricultural Value ($)',
-                   'RISK_SCORE': 'Risk Score',
-                   'SOVI_SCORE': 'Social Vulnerability',
-                   'RESL_SCORE': 'Community Resilience',
-                   'EAL_VALT': 'Expected Annual Loss'
-                  },    inplace=True) 
+    st.header('What-If Scenarios')
 
+    st.write('This section recomputes expected loss under a scenario. Choose a peril and how much more (or less) often it strikes, and how much building exposure grows, in one state or all of them. Expected loss for each peril is exposure times annual frequency times loss ratio, so the scenario scales each county\'s loss for that peril accordingly.')
 
-#Enter X variable and Description 
-x_value='Expected Annual Loss'
-x_description='Annual Expected Loss by County ($)'
+    scenario_state=st.selectbox(label="Scenario State",
+    options=(ALL_STATES,) + tuple(views().index))
 
-#settingsection 
-st.write('**Examining Relationship Between Loss and Exposure**')
-st.write('Select an exposure metric from the drop down below to see how it is correlated with loss. Additionally, you can adjust the slider to alter the y or x axis. The slider slides from the minimum and maximum possible value for each axis.')
-#Enter Y Variable and Description
-y_value=st.selectbox(label="Select Variable",
-options=("Building Value ($)",
-'Population',
-'Agricultural Value ($)'))
+    scenario_peril=st.selectbox(label="Scenario Peril",
+    options=tuple(PERIL_NAMES.values()), index=list(PERIL_NAMES).index('HRCN'))
 
+    frequency_change = st.slider('Change in Peril Frequency (%)', -50, 100, 30, step=5)
 
-#converting values to floats
-NRI_Scatter["Population"] = NRI_Scatter["Population"].astype(float)
-NRI_Scatter["Agricultural Value ($)"] = NRI_Scatter["Agricultural Value ($)"].astype(float)
+    exposure_change = st.slider('Change in Building Exposure (%)', -20, 50, 10, step=5)
 
-#setting slider range
-upper_bound_draft5=NRI_Scatter[[y_value]].max()
-up5=upper_bound_draft5[0]
-pyup5 = up5.item()
+    figure_chart(scenario_states(scenario_state, scenario_peril, frequency_change, exposure_change), key='figure_8')
 
-#inputting slideer
-Map_Range4 = st.slider(
-    'Edit Y-Axis',
-    0.0, pyup5, pyup5*.5, step = 100000.0)
+    st.text("")
 
-#setting slider range
-upper_bound_draft6=NRI_Scatter[[x_value]].max()
-up6=upper_bound_draft6[0]
-pyup6 = up6.item()
+    #monte carlo spread
+    st.write('Scenario multipliers are never known exactly. The slider below sets their uncertainty; the scenario is redrawn 2,000 times with multipliers varying by that much around the chosen values.')
+    uncertainty = st.slider('Uncertainty in Multipliers (%)', 0, 50, 10, step=5)
 
-#implementing slider
-Map_Range5 = st.slider(
-    'Edit X-Axis, Expected Loss',
-    0.0, pyup6, pyup6*.2, step = 100000.0)
+    fig, (p5, p50, p95) = scenario_outcomes(scenario_state, scenario_peril, frequency_change, exposure_change, uncertainty)
+    figure_chart(fig, key='figure_9')
+    st.caption('Median scenario loss $%.1fM, 90%% of draws between $%.1fM and $%.1fM.' % (p50 / 1e6, p5 / 1e6, p95 / 1e6))
 
 
-#defining function 
-def scatter_plot(x_value, y_value, y_range, x_range):
-    fig4 = px.scatter(NRI_Scatter, x=x_value, y=y_value,
-                     color='State',
-                     size_max=15,
-                     hover_name="COUNTY",
-                     labels={
-                     x_value:x_description,
-                    
-                 },  template="simple_white")
-    fig4.update_layout(title_text = '<b>Figure 6: Relationship between Expected Loss and Exposure </b> <br><sup> All Types of Exposure are Highly Correlated with Loss </sup>', transition_duration=500,  xaxis_range=x_range, yaxis_range=y_range)
-    st.plotly_chart(fig4)    
+##############################################################################
+#section 5
+##############################################################################
+
+#county risk profile of one location
+@section5.step
+def location_profile(latitude, longitude):
+    found = load_profiles().profile(latitude, longitude)
+    if found is None:
+        return None
+    row, perils = found
+    perils = perils[perils > 0].head(5).round(0).rename('Annual Expected Loss ($)').rename_axis('Peril').to_frame()
+    return row, perils
+
+
+#portfolio screening: every uploaded coordinate located in one pass
+@section5.step
+def portfolio_profiles(portfolio):
+    try:
+        return load_profiles().batch(pd.read_csv(io.BytesIO(portfolio))), None
+    except ValueError as err:
+        return None, str(err)
+
 
+#rows of a screened portfolio shown on the page, the download has all of them
+PORTFOLIO_PREVIEW = 1000
 
 
-#running function 
-scatter_plot(x_value, y_value, (0, Map_Range4), (0, Map_Range5))
+@section5.render
+def section_5():
+    st.text("")
 
-#data caption 
-st.caption('Building Value and Population tend to be highly correlated with loss. But this pattern is not as strong across all states. In New York for example, there are many high loss high population counties that have low relative loss.')
-#text spacing 
-st.text("")
+    st.text("")
 
-st.text("")
+    st.text("")
 
-st.text("")
+    st.header('Risk Profile of a Location')
 
-#setting subheading
-st.write('**Examining Relationship Between Loss and Risk Metrics**')
-st.write('')
-#select box for dropdown 2
-y_value2=st.selectbox(label="Select Risk Variable",
-options=('Risk Score',
-'Social Vulnerability',
-'Community Resilience'))
+    st.write('Enter the coordinates of a property to see the risk profile of its county.')
 
+    latitude = st.number_input('Latitude', -90.0, 90.0, 29.76, step=0.01, format='%.5f')
 
-#setting x value
-x_value2='Expected Annual Loss'
+    longitude = st.number_input('Longitude', -180.0, 180.0, -95.37, step=0.01, format='%.5f')
 
-#setting slider range 
-upper_bound_draft7=NRI_Scatter[[x_value2]].max()
-up7=upper_bound_draft7[0]
+    found = location_profile(latitude, longitude)
+    if found is None:
+        st.write('No county in the data contains this location.')
+    else:
+        row, perils = found
+        st.write('**' + str(row['COUNTY']) + ' County, ' + str(row['STATEABBRV']) + '**')
+        st.write('Risk Score: **%.1f**' % row['RISK_SCORE'], ' Annual Expected Loss: **$%.1fM**' % (row['EAL_VALT'] / 1e6))
+        st.dataframe(perils)
+
+    st.text("")
+
+    #batch lookup
+    st.subheader('Screen a Portfolio')
+    st.write('Upload a CSV with latitude and longitude columns to add each property\'s county risk profile.')
+    upload = st.file_uploader('Property Coordinates (CSV)', type='csv')
+    if upload is not None:
+        table, error = portfolio_profiles(upload.getvalue())
+        if error:
+            st.error(error)
+        else:
+            located = table['NRI_FIPS'].notna().sum()
+            st.caption('%d of %d properties located in a county.' % (located, len(table)))
+            st.dataframe(table.head(PORTFOLIO_PREVIEW))
+            st.download_button('Download Risk Profiles', table.to_csv(index=False).encode(), 'portfolio_risk.csv', 'text/csv')
+
+
+##############################################################################
+#page
+##############################################################################
 
-pyup7 = up7.item()
+def page():
+    #Writing dashboard title
+    st.title("Evaluating Natural Disaster and Climate Risk in California, Florida, New York, and Texas")
 
-#inputting slider 
-Map_Range6 = st.slider(
-    'Edit X-Axis, Expected Loss',
-    0.0, pyup7, pyup7*.2, step = 100000.00, key=9)
+    #Adding text describing issue
+    st.write('Natural disasters present a fundamental risk to housing and economic security in the U.S. In 2021 alone natural disasters cost the U.S $145 Billion. In an effort to improve data surrounding natural disasters, the Federal Emergency Management Agency released the National Risk Index (NRI) which provides comprehensive county level data on natural disaster risks.')
 
+    st.write('This dashboard uses NRI data to analyze and visualize climate risk in four states: California, Florida, New York and Texas. These states represent the four most populous states in the country and the four states with over 2 trillion dollars in building value. Additionally, California, Texas, and Florida represent the three states with the highest expected annual loss due to climate change. Analyzing these states allows us to see the risk profile of four distinct regions in the country.')
 
+    st.write('This tool is intended for federal, state, and local policy makers, who may use it to gain a better understanding of geospatial risk in their state. However, it can be used by anyone, for example a perspective property buyer seeking to understand the climate risk associated with their future properties.')
 
-#defining function 
-def scatter_plot2(x_value, y_value, map_range):
-    fig5 = px.scatter(NRI_Scatter, x=x_value, y=y_value,
-                     color='State',
-                     size_max=15,
-                     hover_name="COUNTY",
-                     labels={
-                     x_value:x_description,
-                    
-                 },  template="simple_white")
-    fig5.update_layout(title_text = '<b>Figure 7: Relationship between Expected Loss and Exposure </b> <br><sup> Risk and Loss are Highly Correlated </sup>', transition_duration=500,  xaxis_range=map_range)
-    st.plotly_chart(fig5)
+    section_1()
 
-#running function
-scatter_plot2(x_value2, y_value2, (0, Map_Range6))
+    section_2()
 
-#writing caption
-st.caption('According to FEMA, risk score and social vulnerability should be highly correlated with loss, while community resilience should be negativley correlated with loss. This chart shows a strong positive correlation between risk and loss, but the relationship between vulnerability and resilience is weaker.')
+    section_3()
 
+    section_4()
 
-#Adding in authors contact 
-st.markdown('_For questions and support contact Ellis Obrien: eso18@georgetown.edu_')
+    section_5()
 
+    #Adding in authors contact
+    st.markdown('_For questions and support contact Ellis Obrien: eso18@georgetown.edu_')
 
 
+#rendering the page, timed per rerun when NRI_METRICS is set
+with rerun():
+    page()
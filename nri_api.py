@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local HTTP query API over the same NRI data and aggregates as the dashboard.
+
+    python nri_api.py [--port 8600] [--host localhost] [--source NRI_State_Dat.csv]
+
+Endpoints (GET, JSON by default):
+
+    /states                     loss by state and loss type
+    /perils?state=TX            loss by peril and loss type, nationally without state
+    /counties/48201             one county's row
+    /counties?state=TX&column=HRCN_EALT&min=1e6&sort=-HRCN_EALT&limit=100&columns=COUNTY,HRCN_EALT
+                                filtered county rows; fips=48201,48113 selects counties by code
+
+format=arrow (or Accept: application/vnd.apache.arrow.stream) returns an
+Arrow IPC stream instead, for bulk pulls. County lists are filtered with
+array masks and encoded in one call, so a request for thousands of counties
+costs about the same as one for ten.
+
+Responses carry an ETag derived from the dataset digest and the normalized
+request, so a matching If-None-Match is answered 304 before any work is
+done, and the ETag changes when the data does. Encoded (and gzipped, when
+the client accepts it) bodies are kept in a small LRU keyed by ETag.
+Queries run on a thread pool, off the event loop. The data is loaded
+through nri_data, so a server next to nri_build.py --store output shares
+the mapped table with the dashboard processes.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import tornado.ioloop
+import tornado.web
+
+from nri_cube import LOSS_TYPES, NATIONAL, PERIL_NAMES, load_cube
+from nri_data import digest_memo, load_nri, source_digest
+from nri_registry import refresh
+
+
+DEFAULT_PORT = 8600
+
+JSON_TYPE = 'application/json'
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+
+#bodies smaller than this are sent uncompressed
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+#encoded responses kept per server
+CACHE_SIZE = 256
+
+
+def state_losses(cube):
+    """Loss per state (rows) and loss type (columns), all perils."""
+    totals = cube.values[:, -1, :]
+    frame = pd.DataFrame(totals, columns=LOSS_TYPES)
+    frame.insert(0, 'STATEFIPS', cube.fips)
+    frame.insert(0, 'STATEABBRV', cube.states)
+    return frame
+
+
+def peril_losses(cube, state=NATIONAL):
+    """Loss per peril and loss type of one state or the nation, perils named."""
+    frame = cube.peril_breakdown(state).reset_index()
+    frame.insert(1, 'name', frame['peril'].map(PERIL_NAMES).fillna('All Perils'))
+    return frame
+
+
+class CountyTable:
+    """NRI rows of one dataset version with a FIPS index, for vectorized county queries."""
+
+    def __init__(self, NRI):
+        self.NRI = NRI
+        self.index = pd.Index(NRI['FIPS'].to_numpy())
+
+    def rows(self, fips):
+        """Rows of a list of FIPS codes, in request order, unknown codes left out."""
+        at = self.index.get_indexer(np.asarray(fips, dtype='int64'))
+        return self.NRI.take(at[at >= 0])
+
+    def query(self, fips=None, state=None, column=None, lo=None, hi=None, sort=None, limit=None, columns=None):
+        """Filtered, sorted and projected county rows.
+
+        column/lo/hi keep counties whose column value lies in [lo, hi]; sort is a
+        column name, descending with a leading '-'.
+        """
+        for name in [column, sort and sort.lstrip('-')] + list(columns or []):
+            if name and name not in self.NRI.columns:
+                raise KeyError(name)
+        NRI = self.rows(fips) if fips is not None else self.NRI
+        keep = np.ones(len(NRI), dtype=bool)
+        if state is not None:
+            keep &= (NRI['STATEABBRV'] == state).to_numpy()
+        if column is not None:
+            values = NRI[column].to_numpy(dtype='float64')
+            if lo is not None:
+                keep &= values >= lo
+            if hi is not None:
+                keep &= values <= hi
+        NRI = NRI[keep]
+        if sort:
+            NRI = NRI.sort_values(sort.lstrip('-'), ascending=not sort.startswith('-'), kind='stable')
+        if limit is not None:
+            NRI = NRI.head(limit)
+        if columns:
+            NRI = NRI[list(dict.fromkeys(['FIPS'] + list(columns)))]
+        return NRI
+
+
+def _json_values(series):
+    #JSON text of every value of a column, missing values as null
+    values = series.to_numpy()
+    if values.dtype.kind == 'f':
+        #numpy prints the shortest repr reading back to the stored value, float32 at float32 precision
+        text = values.astype(str).astype(object)
+        text[~np.isfinite(values)] = 'null'
+        return text
+    if values.dtype.kind == 'b':
+        return np.where(values, 'true', 'false').astype(object)
+    if values.dtype.kind in 'iu':
+        return values.astype(str).astype(object)
+    return np.array(['null' if pd.isna(v) else json.dumps(v.item() if isinstance(v, np.generic) else v)
+                     for v in values], dtype=object)
+
+
+def json_records(frame):
+    """A frame as a JSON array of row objects, each number as the shortest text of its stored value.
+
+    to_json writes ten fixed decimals, which prints float64 values past
+    their precision (557755.94 as 557755.9399999999) and float32 values
+    with their binary error (1234.56 as 1234.5600585938).
+    """
+    keys = [json.dumps(str(c)) + ':' for c in frame.columns]
+    columns = [_json_values(frame[c]) for c in frame.columns]
+    return '[%s]' % ','.join('{%s}' % ','.join([k + v for k, v in zip(keys, row)]) for row in zip(*columns))
+
+
+def encode(frame, fmt, record=False):
+    """(body bytes, content type) of a frame as JSON records (one object when record) or an Arrow stream."""
+    if fmt == 'arrow':
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), ARROW_TYPE
+    body = json_records(frame)
+    return (body[1:-1] if record else body).encode(), JSON_TYPE
+
+
+class ResponseCache:
+    """LRU of encoded responses by ETag."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                self._entries.move_to_end(etag)
+            return entry
+
+    def put(self, etag, entry):
+        with self._lock:
+            self._entries[etag] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+
+_tables = digest_memo()
+
+
+def load_county_table(source=None):
+    """County table of an NRI source, built once per dataset version."""
+    return _tables.get(source_digest(source), lambda: CountyTable(load_nri(source)))
+
+
+class QueryHandler(tornado.web.RequestHandler):
+    """Base of the endpoints: ETag check, cached encoding, gzip, JSON errors."""
+
+    def initialize(self, source, cache):
+        self.source = source
+        self.cache = cache
+
+    def query(self, *args):
+        """(frame, one JSON object instead of a list) of the request, run on the thread pool."""
+        raise NotImplementedError
+
+    def _format(self):
+        fmt = self.get_query_argument('format', None)
+        if fmt is None:
+            fmt = 'arrow' if ARROW_TYPE in self.request.headers.get('Accept', '') else 'json'
+        if fmt not in ('json', 'arrow'):
+            raise tornado.web.HTTPError(400, reason='format must be json or arrow')
+        return fmt
+
+    def _etag(self, fmt, args):
+        #the dataset version plus everything the response depends on, query arguments in a fixed order
+        arguments = sorted((k, v) for k, vs in self.request.query_arguments.items() if k != 'format' for v in vs)
+        key = repr((type(self).__name__, args, arguments, fmt)).encode()
+        return '"%s"' % hashlib.sha1(source_digest(self.source).encode() + key).hexdigest()
+
+    def _encode(self, fmt, args):
+        #a new release updates the cube from the previous one instead of rebuilding it
+        refresh(self.source)
+        frame, record = self.query(*args)
+        body, content_type = encode(frame, fmt, record)
+        compressed = gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_BYTES else None
+        return body, compressed, content_type
+
+    async def get(self, *args):
+        fmt = self._format()
+        etag = self._etag(fmt, args)
+        self.set_header('ETag', etag)
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('Vary', 'Accept, Accept-Encoding')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        entry = self.cache.get(etag)
+        if entry is None:
+            loop = tornado.ioloop.IOLoop.current()
+            entry = self.cache.put(etag, await loop.run_in_executor(None, self._encode, fmt, args))
+        body, compressed, content_type = entry
+        self.set_header('Content-Type', content_type)
+        if compressed is not None and 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.set_header('Content-Encoding', 'gzip')
+            body = compressed
+        self.finish(body)
+
+    def write_error(self, status_code, **kwargs):
+        self.clear_header('ETag')
+        self.set_header('Content-Type', JSON_TYPE)
+        self.finish(json.dumps({'error': self._reason}))
+
+    def argument(self, name, parse=str):
+        value = self.get_query_argument(name, None)
+        if value is None or value == '':
+            return None
+        try:
+            return parse(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='bad %s: %s' % (name, value))
+
+
+def _names(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def _codes(value):
+    return [int(v) for v in _names(value)]
+
+
+def _count(value):
+    count = int(value)
+    if count < 1:
+        raise ValueError(value)
+    return count
+
+
+class StatesHandler(QueryHandler):
+    def query(self):
+        return state_losses(load_cube(self.source)), False
+
+
+class PerilsHandler(QueryHandler):
+    def query(self):
+        cube = load_cube(self.source)
+        state = (self.argument('state') or NATIONAL).upper()
+        if state != NATIONAL and state not in cube.states:
+            raise tornado.web.HTTPError(404, reason='unknown state %s' % state)
+        return peril_losses(cube, state), False
+
+
+class CountyHandler(QueryHandler):
+    def query(self, fips):
+        rows = load_county_table(self.source).rows([int(fips)])
+        if not len(rows):
+            raise tornado.web.HTTPError(404, reason='unknown county %s' % fips)
+        return rows, True
+
+
+class CountiesHandler(QueryHandler):
+    def query(self):
+        state = self.argument('state')
+        try:
+            return load_county_table(self.source).query(
+                fips=self.argument('fips', _codes), state=state and state.upper(), column=self.argument('column'),
+                lo=self.argument('min', float), hi=self.argument('max', float), sort=self.argument('sort'),
+                limit=self.argument('limit', _count), columns=self.argument('columns', _names)), False
+        except KeyError as e:
+            raise tornado.web.HTTPError(400, reason='unknown column %s' % e.args[0])
+
+
+def make_app(source=None, cache_size=CACHE_SIZE):
+    """Tornado application serving the query endpoints for one NRI source."""
+    settings = {'source': source, 'cache': ResponseCache(cache_size)}
+    return tornado.web.Application([
+        (r'/states', StatesHandler, settings),
+        (r'/perils', PerilsHandler, settings),
+        (r'/counties/([0-9]+)', CountyHandler, settings),
+        (r'/counties', CountiesHandler, settings),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the NRI aggregates and county rows over HTTP.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--host', default='localhost', help='address to bind')
+    parser.add_argument('--source', default=None, help='NRI csv or parquet (default: the dashboard data)')
+    args = parser.parse_args(argv)
+
+    #load before listening so the first request does not pay for it
+    load_county_table(args.source)
+    load_cube(args.source)
+    make_app(args.source).listen(args.port, args.host)
+    print('serving NRI queries on http://%s:%d' % (args.host, args.port), flush=True)
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the headless compute core on the bundled data and scaled copies.
+
+    python nri_bench.py [--scales 1 10 100] [--repeat 5] [--state TX] [--json]
+
+Times every stage of a dashboard render through nri_core: loading (csv and
+parquet), the per-state filter, peril aggregation, figure building and
+figure-to-JSON serialization. Scale k concatenates k copies of the bundled
+counties with shifted FIPS codes (and k copies of their polygons), so the
+per-state stages see k times as many counties. Compare runs across commits
+to catch regressions, or extrapolate the timings to size hardware.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+import nri_core
+from nri_build import build_parquet
+from nri_cube import AggregateCube
+from nri_data import NRI_PATH, clear_cache, fips_str, load_nri
+from nri_geo import load_geometry
+
+
+#FIPS offset between synthetic copies, larger than any real county code
+FIPS_STRIDE = 100000
+
+
+def scaled_csv(source, scale, directory):
+    """Writes `scale` copies of an NRI csv with distinct FIPS codes and returns its path."""
+    raw = pd.read_csv(source)
+    copies = []
+    for i in range(scale):
+        copy = raw.copy()
+        copy['STCOFIPS'] = copy['STCOFIPS'] + i * FIPS_STRIDE
+        copies.append(copy)
+    path = os.path.join(directory, 'nri_x%d.csv' % scale)
+    pd.concat(copies, ignore_index=True).to_csv(path, index=False)
+    return path
+
+
+def scaled_geojson(collection, scale):
+    """FeatureCollection with every feature repeated `scale` times under the shifted FIPS ids."""
+    features = [dict(f, id=fips_str(int(f['id']) + i * FIPS_STRIDE)[()])
+                for i in range(scale) for f in collection['features']]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def timed(func, repeat):
+    """(result, seconds per run) of `func` run `repeat` times."""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - start)
+    return result, runs
+
+
+def bench_scale(source, scale, state, repeat, directory):
+    """Stage timings for one scale, as a list of result dicts."""
+    #scale 1 is copied too, so a parquet build next to the source is not picked up instead
+    csv_path = scaled_csv(source, scale, directory)
+    parquet_path = build_parquet(csv_path, os.path.join(directory, 'nri_x%d_build.parquet' % scale))
+    results = []
+
+    def record(stage, func, rows):
+        value, runs = timed(func, repeat)
+        results.append({'scale': scale, 'stage': stage, 'rows': rows,
+                        'median_ms': statistics.median(runs) * 1e3, 'min_ms': min(runs) * 1e3})
+        return value
+
+    def cold_load(path):
+        clear_cache()
+        return load_nri(path)
+
+    NRI = record('load csv', lambda: cold_load(csv_path), None)
+    results[-1]['rows'] = len(NRI)
+    NRI = record('load parquet', lambda: cold_load(parquet_path), len(NRI))
+
+    counties = record('state filter', lambda: nri_core.state_counties(NRI, state), len(NRI))
+    cube = record('peril cube', lambda: AggregateCube(NRI), len(NRI))
+    frame = record('peril frame', lambda: nri_core.peril_frame(NRI, state), len(counties))
+    scatter = record('scatter frame', lambda: nri_core.scatter_frame(NRI), len(NRI))
+
+    #the state's polygons simplified for the map zoom, as the dashboard ships them
+    views = record('state views', lambda: nri_core.state_views(cube, load_geometry()), len(cube.states))
+    (lat, lon), zoom, loss_range = nri_core.state_view(views, state)
+    geojson = scaled_geojson(load_geometry().for_zoom(cube.state_fips(state), zoom), scale)
+    figures = {
+        'overview bar': lambda: nri_core.loss_overview_figure(cube),
+        'loss map': lambda: nri_core.county_map_figure(counties, geojson, 'EAL_VALT', loss_range,
+                                                       zoom, (lat, lon), 'Annual Expected Loss'),
+        'peril bar': lambda: nri_core.peril_bar_figure(cube, state),
+        'peril map': lambda: nri_core.peril_map_figure(frame, geojson, 'Hurricane', (0, 1e6), zoom, (lat, lon)),
+        'exposure scatter': lambda: nri_core.exposure_scatter_figure(scatter, 'Population', None, None),
+        'risk scatter': lambda: nri_core.risk_scatter_figure(scatter, 'Risk Score', None),
+    }
+    for name, build in figures.items():
+        fig = record('build ' + name, build, len(counties) if 'map' in name else len(NRI))
+        record('serialize ' + name, lambda: nri_core.figure_json(fig), len(nri_core.figure_json(fig)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the NRI compute core on bundled and scaled data.')
+    parser.add_argument('source', nargs='?', default=NRI_PATH, help='NRI csv to scale from')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='county multipliers')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per stage')
+    parser.add_argument('--state', default='TX', help='state abbreviation for the per-state stages')
+    parser.add_argument('--json', action='store_true', help='print results as json for comparing runs')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            results.extend(bench_scale(args.source, scale, args.state, args.repeat, directory))
+    clear_cache()
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+        return
+    print('%6s  %-26s %10s %11s %11s' % ('scale', 'stage', 'rows/bytes', 'median ms', 'min ms'))
+    for r in results:
+        print('%5dx  %-26s %10s %11.2f %11.2f' % (r['scale'], r['stage'], '' if r['rows'] is None else r['rows'],
+                                                  r['median_ms'], r['min_ms']))
+
+
+if __name__ == '__main__':
+    main()
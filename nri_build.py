@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Preprocessing step converting an NRI county csv into a typed Parquet file.
+
+    python nri_build.py [NRI_State_Dat.csv] [-o NRI_State_Dat.parquet] [--store]
+
+The output keeps every column typed with the nri_data schema and records
+the sha256 of the source csv in the file metadata, so nri_data can use it as
+the dataset version without hashing the parquet body. nri_data picks the build up
+automatically when it sits next to the csv and is newer than it.
+
+It also copies plotly.js from the plotly package into mapview_frontend/,
+so the dashboard's maps load it locally instead of from the plotly CDN.
+
+--store also writes the memory-mapped stores (see nri_store) of the
+dashboard columns and of the county GeoJSON's map variants, which every
+server process on the host then shares instead of parsing its own copy.
+"""
+
+import argparse
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from nri_data import (COUNTY_GEOJSON_PATH, DASHBOARD_COLUMNS, NRI_PATH, SOURCE_DIGEST_KEY, load_counties, load_nri,
+                      memory_report, nri_dtype, source_digest)
+from nri_geo import TOLERANCES, GeometryStore
+from nri_mapview import build_frontend
+from nri_store import store_path, write_geometry_store, write_table_store
+
+
+def build_parquet(source=NRI_PATH, output=None):
+    """Writes the typed parquet build of `source` and returns its path."""
+    output = output or os.path.splitext(source)[0] + '.parquet'
+
+    with open(source, 'rb') as fh:
+        digest = hashlib.sha256(fh.read()).hexdigest()
+
+    #parsing once with the same schema the dashboard loader uses
+    header = pd.read_csv(source, nrows=0).columns
+    NRI = pd.read_csv(source, dtype={c: nri_dtype(c) for c in header})
+
+    table = pa.Table.from_pandas(NRI, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_DIGEST_KEY] = digest.encode()
+    table = table.replace_schema_metadata(metadata)
+
+    #one row group per ~64k counties/tracts keeps projected reads selective
+    pq.write_table(table, output, compression='zstd', row_group_size=65536)
+    return output
+
+
+def build_store(source=NRI_PATH, geojson=COUNTY_GEOJSON_PATH):
+    """Writes the table store of `source` and the geometry store of `geojson`, returns their paths."""
+    #parsed from the csv itself, never from an older store or parquet build
+    with open(source, 'rb') as fh:
+        digest = hashlib.sha256(fh.read()).hexdigest()
+    NRI = pd.read_csv(source, usecols=lambda c: c in DASHBOARD_COLUMNS,
+                      dtype={c: nri_dtype(c) for c in DASHBOARD_COLUMNS})
+    table = write_table_store(NRI, store_path(source), digest, DASHBOARD_COLUMNS)
+
+    geometry = GeometryStore(load_counties(geojson), source_digest(geojson))
+    return table, write_geometry_store(geometry, TOLERANCES, store_path(geojson), geometry.digest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert an NRI county csv into a typed Parquet file.')
+    parser.add_argument('source', nargs='?', default=NRI_PATH, help='NRI csv to convert')
+    parser.add_argument('-o', '--output', help='parquet path, defaults to the csv path with a .parquet suffix')
+    parser.add_argument('--store', action='store_true', help='also write the memory-mapped table and geometry stores')
+    args = parser.parse_args(argv)
+
+    if args.store:
+        for path in build_store(args.source):
+            print('wrote %s (%d bytes)' % (path, sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))))
+
+    output = build_parquet(args.source, args.output)
+    print('wrote %s (%d bytes)' % (output, os.path.getsize(output)))
+    frontend = build_frontend()
+    print('wrote %s (%d bytes)' % (frontend, os.path.getsize(frontend)))
+
+    #in-memory footprint per county, for sizing sessions as the data grows
+    for label, columns in (('dashboard columns', DASHBOARD_COLUMNS), ('all columns', None)):
+        report = memory_report(load_nri(output, columns=columns))
+        print('%s: %d counties, %d bytes, %.0f bytes per county'
+              % (label, report['rows'], report['total_bytes'], report['bytes_per_county']))
+
+
+if __name__ == '__main__':
+    main()
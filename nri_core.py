@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless compute core of the NRI dashboard.
+
+Every data shaping step of NRI_State_Viz.py (filtering, aggregation, ranges
+and figure building) as pure functions of their inputs, with no Streamlit
+import, so they can be imported, timed (nri_bench.py) and reused by other
+front ends. The dashboard wraps them with its caches; nothing here caches.
+"""
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from nri_cube import PERIL_BY_NAME, PERIL_NAMES
+from nri_data import fips_str
+from nri_geo import TILE_SIZE
+
+
+#map viewport the zoom is fitted to in pixels: streamlit's default column width and the map height
+VIEWPORT = (700, 450)
+
+#fitted zooms leave this much margin around the state, and are rounded down to ZOOM_STEP
+FIT_PADDING = 0.9
+ZOOM_STEP = 0.5
+ZOOM_LIMITS = (1.0, 10.0)
+
+#Figure 2 color ranges are capped at this quantile of the state's county losses,
+#so a single outlier county does not wash out the rest of the state
+RANGE_QUANTILE = 0.98
+
+#center and zoom of states without geometry: the lower 48
+FALLBACK_VIEW = ((39.83, -98.58), 3.0)
+
+#geojson of maps whose polygons are filled in by the client (nri_mapview, nri_export), so the
+#figure does not hold its own copy
+NO_GEOMETRY = {'type': 'FeatureCollection', 'features': []}
+
+#composite risk score range of Figure 3
+RISK_RANGE = (0, 50)
+
+#peril loss columns of the Figure 5 map, in their original order
+PERIL_MAP_COLUMNS = ['AVLN_EALT', 'CFLD_EALT', 'CWAV_EALT', 'DRGT_EALT', 'ERQK_EALT', 'ISTM_EALT',
+                     'HAIL_EALT', 'HWAV_EALT', 'HRCN_EALT', 'LTNG_EALT', 'LNDS_EALT', 'RFLD_EALT',
+                     'SWND_EALT', 'TSUN_EALT', 'TRND_EALT', 'WFIR_EALT', 'VLCN_EALT', 'WNTW_EALT']
+
+#perils offered for the Figure 5 map (those with loss in the dashboard's states)
+MAP_PERILS = ('Coastal Flooding', 'Cold Wave', 'Drought', 'Earthquake', 'Hail', 'Ice Storm', 'Heat Wave',
+              'Hurricane', 'Lightning', 'Landslide', 'Riverine Flooding', 'Strong Wind', 'Tornado', 'Wildfire',
+              'Winter Weather')
+
+#y variables of Figures 6 and 7
+EXPOSURE_VARIABLES = ('Building Value ($)', 'Population', 'Agricultural Value ($)')
+RISK_VARIABLES = ('Risk Score', 'Social Vulnerability', 'Community Resilience')
+
+#default map and axis ranges as fractions of the slider maximum
+PERIL_RANGE_SHARE = 0.5
+Y_RANGE_SHARE = 0.5
+X_RANGE_SHARE = 0.2
+
+#display labels of the scatter plot columns
+SCATTER_LABELS = {'STATEABBRV': 'State',
+                  'BUILDVALUE': 'Building Value ($)',
+                  'POPULATION': 'Population',
+                  'AGRIVALUE': 'Agricultural Value ($)',
+                  'RISK_SCORE': 'Risk Score',
+                  'SOVI_SCORE': 'Social Vulnerability',
+                  'RESL_SCORE': 'Community Resilience',
+                  'EAL_VALT': 'Expected Annual Loss'}
+
+#columns scatter_frame reads, the county name is the hover text
+SCATTER_FRAME_COLUMNS = ['COUNTY'] + list(SCATTER_LABELS)
+
+#label -> source column, for looking up precomputed ranges
+SCATTER_COLUMNS = {label: column for column, label in SCATTER_LABELS.items()}
+
+#x axis shared by both scatter plots
+X_VALUE = 'Expected Annual Loss'
+X_DESCRIPTION = 'Annual Expected Loss by County ($)'
+
+#marker colors of the hotspot layer, by nri_hotspot cluster label
+HOTSPOT_COLORS = {'Hot Spot': 'darkred', 'Cold Spot': 'navy',
+                  'High-Low Outlier': 'darkorange', 'Low-High Outlier': 'deepskyblue'}
+
+#scatter plots switch from svg to webgl markers above WEBGL_POINTS points, and to server-side
+#density bins (restricted to the axis ranges) above DENSITY_POINTS
+WEBGL_POINTS = 1000
+DENSITY_POINTS = 20000
+DENSITY_BINS = 200
+
+#density plots still draw points in bins holding at most OUTLIER_BIN_COUNT points, the
+#MAX_OUTLIERS highest-loss of them, so isolated high-loss counties stay visible and hoverable
+OUTLIER_BIN_COUNT = 2
+MAX_OUTLIERS = 2000
+
+
+##############################################################################
+#filtering and aggregation
+##############################################################################
+
+def _mercator(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _nice_ceil(values):
+    #rounded up to two significant digits, so legends read 430M rather than 423,269,856
+    values = np.maximum(np.asarray(values, dtype='float64'), 1.0)
+    step = 10.0 ** (np.floor(np.log10(values)) - 1)
+    return np.ceil(np.round(values / step, 6)) * step
+
+
+def state_views(cube, geometry):
+    """Map center, zoom and Figure 2 loss range of every state in the cube.
+
+    One vectorized pass over the geometry store's state bounds and the cube's
+    loss quantiles; a frame indexed by state with lat, lon, zoom and loss_max.
+    """
+    bounds = geometry.bounds().reindex(cube.fips)
+    west, south, east, north = (bounds[c].to_numpy() for c in ('west', 'south', 'east', 'north'))
+    width, height = VIEWPORT
+
+    #largest zoom at which the box fits the viewport, in longitude and in mercator y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zoom_x = np.log2(width * 360.0 / (TILE_SIZE * np.maximum(east - west, 1e-6)))
+        zoom_y = np.log2(height * 2 * np.pi / (TILE_SIZE * np.maximum(_mercator(north) - _mercator(south), 1e-6)))
+    zoom = np.floor((np.minimum(zoom_x, zoom_y) + np.log2(FIT_PADDING)) / ZOOM_STEP) * ZOOM_STEP
+    zoom = np.clip(zoom, *ZOOM_LIMITS)
+
+    lat = np.degrees(2 * np.arctan(np.exp((_mercator(north) + _mercator(south)) / 2)) - np.pi / 2)
+    lon = np.mod((west + east) / 2 + 180.0, 360.0) - 180.0
+
+    missing = np.isnan(west)
+    views = pd.DataFrame({'lat': np.where(missing, FALLBACK_VIEW[0][0], lat),
+                          'lon': np.where(missing, FALLBACK_VIEW[0][1], lon),
+                          'zoom': np.where(missing, FALLBACK_VIEW[1], zoom),
+                          'loss_max': _nice_ceil(cube.quantiles('EAL_VALT', RANGE_QUANTILE))},
+                         index=pd.Index(cube.states, name='STATEABBRV'))
+    return views
+
+
+def state_view(views, state):
+    """Map center (lat, lon), zoom and Figure 2 loss range of a state from state_views."""
+    view = views.loc[state]
+    return (round(float(view.lat), 5), round(float(view.lon), 5)), float(view.zoom), (0, float(view.loss_max))
+
+
+def state_counties(NRI, state):
+    """Counties of one state."""
+    return NRI[NRI.STATEABBRV == state]
+
+
+def peril_frame(NRI, state):
+    """Figure 5 frame: a state's per-peril county losses, named by peril, missing as zero."""
+    frame = state_counties(NRI, state)[['FIPS', 'COUNTY'] + PERIL_MAP_COLUMNS]
+    #filling NA after selecting, the rating and state columns are categorical
+    frame = frame.fillna(0)
+    return frame.rename(columns={c: PERIL_NAMES[c[:-5]] for c in PERIL_MAP_COLUMNS})
+
+
+def scatter_frame(NRI):
+    """Figure 6/7 frame: every county's exposure, risk and loss under display labels."""
+    frame = NRI[SCATTER_FRAME_COLUMNS]
+    return frame.rename(columns=SCATTER_LABELS)
+
+
+def tract_values(tracts, state, variable):
+    """A state's tract values of one variable as a Series indexed by tract FIPS."""
+    counties = state_counties(tracts, state)
+    return counties.set_index('TRACTFIPS')[variable].astype('float64')
+
+
+def tract_range(values):
+    """Color range of tract values capped at RANGE_QUANTILE, like the county maps."""
+    values = values.dropna()
+    return (0, float(_nice_ceil(values.quantile(RANGE_QUANTILE) if len(values) else 0)))
+
+
+def exposure_bounds(cube, y_value, state):
+    """Slider maxima (y, x) of Figure 6 from the cube, state may be nri_cube.NATIONAL."""
+    return cube.max(state, SCATTER_COLUMNS[y_value]), cube.max(state, SCATTER_COLUMNS[X_VALUE])
+
+
+def peril_bound(cube, state, peril):
+    """Slider maximum of Figure 5, peril given by display name or code."""
+    return cube.max(state, PERIL_BY_NAME.get(peril, peril) + '_EALT')
+
+
+##############################################################################
+#figures
+##############################################################################
+
+def loss_overview_figure(cube):
+    """Figure 1: state level loss broken down by loss type."""
+    fig = px.bar(cube.state_breakdown(), x="STATEABBRV",
+                 y=['Building Loss', 'Agricultural Loss', 'Population Loss'],
+                 labels={"value": "Annual Estimated Loss ($)", 'STATEABBRV': 'State', "variable": "Loss Breakdown"},
+                 color_discrete_map={"Building Loss": "silver", "Agricultural Loss": "green", 'Population Loss': 'black'},
+                 template="simple_white",
+                 height=400)
+    fig.update_layout(title_text='<b>Figure 1: State Level Loss Broken Down by Loss Type </b> <br><sup> California and Texas Lead All States in Loss </sup>')
+    return fig
+
+
+def county_map_figure(counties, geojson, input_var, map_leg, z, center, input_desc):
+    """Figures 2/3: choropleth of one variable over a state's counties."""
+    fig = px.choropleth_mapbox(counties, geojson=geojson, locations=fips_str(counties.FIPS), color=input_var,
+                               color_continuous_scale="balance",
+                               range_color=map_leg,
+                               mapbox_style="carto-positron",
+                               zoom=z, center={"lat": center[0], "lon": center[1]},
+                               opacity=0.7,
+                               hover_name="COUNTY", hover_data=["SOVI_RATNG", "RESL_RATNG"],
+                               labels={input_var: input_desc, 'STCOFIPS': 'FIPS', 'SOVI_RATNG': 'Social Vulnerability', 'RESL_RATNG': 'Resilience'})
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, geo_scope='usa')
+    return fig
+
+
+def tract_map_figure(image, bounds, map_leg, z, center, input_desc):
+    """Figures 2/3 at tract resolution: a rasterized choropleth (nri_raster) as a mapbox image layer.
+
+    The colorbar comes from an invisible two point trace spanning `map_leg`.
+    """
+    west, south, east, north = bounds
+    fig = go.Figure(go.Scattermapbox(lat=[center[0]] * 2, lon=[center[1]] * 2, mode='markers', hoverinfo='skip',
+                                     marker={'color': list(map_leg), 'colorscale': 'balance', 'cmin': map_leg[0],
+                                             'cmax': map_leg[1], 'opacity': 0, 'showscale': True,
+                                             'colorbar': {'title': {'text': input_desc}}}))
+    fig.update_layout(mapbox={'style': 'carto-positron', 'zoom': z, 'center': {"lat": center[0], "lon": center[1]},
+                              'layers': [{'sourcetype': 'image', 'source': image,
+                                          'coordinates': [[west, north], [east, north], [east, south], [west, south]]}]},
+                      margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    return fig
+
+
+def peril_bar_figure(cube, state):
+    """Figure 4: a state's loss by peril."""
+    fig = px.bar(cube.peril_losses(state), x='index', y='Expected Annual Loss',
+                 labels={"index": "<b> Peril </b>", 'Expected Annual Loss': '<b>Expected Annual Loss ($)</b>'},
+                 template="simple_white")
+    fig.update_layout(title_text='<b>Figure 4: Loss by Peril For Selected State </b> <br><sup> Risk Profiles are Very Different Across States </sup>')
+    fig.update_traces(marker_color='DarkRed')
+    return fig
+
+
+def peril_map_figure(frame, geojson, input_var, map_leg, z, center):
+    """Figure 5: choropleth of one peril's loss over a peril_frame."""
+    fig = px.choropleth_mapbox(frame, geojson=geojson, locations=fips_str(frame.FIPS), color=input_var,
+                               color_continuous_scale="balance",
+                               range_color=map_leg,
+                               mapbox_style="carto-positron",
+                               zoom=z, center={"lat": center[0], "lon": center[1]},
+                               opacity=0.7,
+                               hover_name="COUNTY",
+                               labels={'STCOFIPS': 'FIPS'})
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, geo_scope='usa')
+    return fig
+
+
+def add_hotspot_layer(fig, hotspots):
+    """Adds the significant clusters of nri_hotspot.HotspotIndex.overlay over a choropleth map, in place."""
+    for label, color in HOTSPOT_COLORS.items():
+        found = hotspots[hotspots['cluster'] == label]
+        if not len(found):
+            continue
+        text = (found['COUNTY'].astype(str) + ', ' + found['STATEABBRV'].astype(str) + '<br>' + label +
+                ' (Gi* z = ' + found['gi_z'].round(2).astype(str) + ', p = ' + found['p_sim'].round(3).astype(str) + ')')
+        fig.add_trace(go.Scattermapbox(lat=found['lat'].round(5), lon=found['lon'].round(5), mode='markers',
+                                       name=label, text=text, hoverinfo='text',
+                                       marker={'size': 10, 'color': color, 'opacity': 0.9}))
+    fig.update_layout(showlegend=True, legend={'orientation': 'h', 'x': 0.01, 'y': 0.01, 'xanchor': 'left',
+                                               'yanchor': 'bottom', 'bgcolor': 'rgba(255,255,255,0.7)'})
+    return fig
+
+
+def scatter_mode(points):
+    """'svg', 'webgl' or 'density' rendering for a scatter of `points` points."""
+    if points > DENSITY_POINTS:
+        return 'density'
+    return 'webgl' if points > WEBGL_POINTS else 'svg'
+
+
+def _axis_range(values, axis_range):
+    if axis_range is not None:
+        return float(axis_range[0]), float(axis_range[1])
+    finite = values[np.isfinite(values)]
+    return (float(finite.min()), float(finite.max())) if len(finite) else (0.0, 1.0)
+
+
+def density_scatter_figure(frame, x_value, y_value, x_range=None, y_range=None):
+    """2D histogram of the points inside the axis ranges, with sparse-bin points kept as markers."""
+    x = frame[x_value].to_numpy(dtype='float64')
+    y = frame[y_value].to_numpy(dtype='float64')
+    (x0, x1), (y0, y1) = _axis_range(x, x_range), _axis_range(y, y_range)
+    inside = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+
+    counts, x_edges, y_edges = np.histogram2d(x[inside], y[inside], bins=DENSITY_BINS, range=[(x0, x1), (y0, y1)])
+
+    #bin of every point inside, points on the upper edge go in the last bin like histogram2d
+    ix = np.minimum(((x[inside] - x0) / ((x1 - x0) or 1.0) * DENSITY_BINS).astype('int64'), DENSITY_BINS - 1)
+    iy = np.minimum(((y[inside] - y0) / ((y1 - y0) or 1.0) * DENSITY_BINS).astype('int64'), DENSITY_BINS - 1)
+    sparse = inside[counts[ix, iy] <= OUTLIER_BIN_COUNT]
+    outliers = sparse[np.argsort(-x[sparse], kind='stable')[:MAX_OUTLIERS]]
+
+    #empty bins are left out so the background shows through
+    z = np.where(counts > 0, counts, np.nan).T
+    fig = go.Figure(go.Heatmap(x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2, z=z,
+                               colorscale='Blues', zmin=0, zmax=float(np.nanpercentile(z, 99)) if inside.size else 1,
+                               colorbar={'title': {'text': 'Counties'}}, name='Density',
+                               hovertemplate='%{z} counties<extra></extra>'))
+    labels = frame['COUNTY'].astype(str).to_numpy()[outliers]
+    if 'State' in frame:
+        labels = np.char.add(np.char.add(labels.astype(str), ', '), frame['State'].astype(str).to_numpy()[outliers])
+    fig.add_trace(go.Scattergl(x=x[outliers], y=y[outliers], mode='markers', name='Outliers', text=labels,
+                               marker={'color': 'DarkRed', 'size': 5},
+                               hovertemplate='<b>%{text}</b><br>%{x}<br>%{y}<extra></extra>'))
+    fig.update_layout(template='simple_white', showlegend=False,
+                      xaxis_title=X_DESCRIPTION if x_value == X_VALUE else x_value, yaxis_title=y_value)
+    return fig
+
+
+def _scatter(frame, y_value, x_range=None, y_range=None):
+    mode = scatter_mode(len(frame))
+    if mode == 'density':
+        return density_scatter_figure(frame, X_VALUE, y_value, x_range, y_range)
+    return px.scatter(frame, x=X_VALUE, y=y_value,
+                      color='State',
+                      size_max=15,
+                      hover_name="COUNTY",
+                      labels={X_VALUE: X_DESCRIPTION},
+                      template="simple_white",
+                      render_mode=mode)
+
+
+def exposure_scatter_figure(frame, y_value, y_range, x_range):
+    """Figure 6: loss against an exposure metric over a scatter_frame."""
+    fig = _scatter(frame, y_value, x_range, y_range)
+    fig.update_layout(title_text='<b>Figure 6: Relationship between Expected Loss and Exposure </b> <br><sup> All Types of Exposure are Highly Correlated with Loss </sup>', transition_duration=500, xaxis_range=x_range, yaxis_range=y_range)
+    return fig
+
+
+def risk_scatter_figure(frame, y_value, x_range):
+    """Figure 7: loss against a risk metric over a scatter_frame."""
+    fig = _scatter(frame, y_value, x_range)
+    fig.update_layout(title_text='<b>Figure 7: Relationship between Expected Loss and Exposure </b> <br><sup> Risk and Loss are Highly Correlated </sup>', transition_duration=500, xaxis_range=x_range)
+    return fig
+
+
+def scenario_state_figure(baseline, scenario):
+    """Figure 8: expected annual loss per state before and after a scenario (Series indexed by state)."""
+    frame = pd.DataFrame({'State': baseline.index, 'Baseline': baseline.to_numpy(), 'Scenario': scenario.to_numpy()})
+    fig = px.bar(frame, x='State', y=['Baseline', 'Scenario'], barmode='group',
+                 labels={"value": "Annual Expected Loss ($)", "variable": ""},
+                 color_discrete_map={'Baseline': 'silver', 'Scenario': 'DarkRed'},
+                 template="simple_white")
+    fig.update_layout(title_text='<b>Figure 8: Expected Annual Loss Under the Scenario </b> <br><sup> Baseline and Scenario Loss by State </sup>')
+    return fig
+
+
+def scenario_distribution_figure(totals, baseline, label):
+    """Figure 9: Monte Carlo distribution of a scenario's total loss, with the baseline marked."""
+    #binned here so the chart carries 60 bars, not every draw
+    counts, edges = np.histogram(np.asarray(totals, dtype='float64'), bins=60)
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges)))
+    fig.update_layout(template="simple_white", bargap=0, xaxis_title='Annual Expected Loss ($), ' + label)
+    fig.add_vline(x=baseline, line_dash='dash', line_color='black', annotation_text='Baseline')
+    fig.update_traces(marker_color='DarkRed')
+    fig.update_layout(title_text='<b>Figure 9: Range of Scenario Outcomes for ' + label + ' </b> <br><sup> Loss Across Monte Carlo Draws of the Scenario Multipliers </sup>',
+                      yaxis_title='Draws')
+    return fig
+
+
+def figure_json(fig):
+    """A figure serialized the way it is sent to the browser."""
+    return pio.to_json(fig, validate=False)
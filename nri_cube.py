@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Precomputed state x peril x loss-type aggregate cube for the NRI dashboard.
+
+Figure 1 and Figure 4 used to groupby/sum the full county frame on every
+rerun. The cube sums every peril and loss type per state once per dataset
+version, and also keeps per-state quantiles of the mapped and plotted
+variables so slider bounds are lookups instead of column scans. A new
+release of the data is folded in by recomputing only the states it changed.
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+from nri_data import PERIL_CODES, digest_memo, load_nri, source_digest
+
+
+#display names used by the dashboard, in the Figure 4 order
+PERIL_NAMES = {'AVLN': 'Avalanche',
+               'CFLD': 'Coastal Flooding',
+               'CWAV': 'Cold Wave',
+               'DRGT': 'Drought',
+               'ERQK': 'Earthquake',
+               'HAIL': 'Hail',
+               'ISTM': 'Ice Storm',
+               'HWAV': 'Heat Wave',
+               'HRCN': 'Hurricane',
+               'LTNG': 'Lightning',
+               'LNDS': 'Landslide',
+               'RFLD': 'Riverine Flooding',
+               'SWND': 'Strong Wind',
+               'TRND': 'Tornado',
+               'TSUN': 'Tsunami',
+               'WFIR': 'Wildfire',
+               'VLCN': 'Volcanic Activity',
+               'WNTW': 'Winter Weather'}
+
+#display name -> peril code
+PERIL_BY_NAME = {name: code for code, name in PERIL_NAMES.items()}
+
+#peril axis: the 18 perils then the all-peril EAL_VAL* totals
+ALL_PERILS = 'ALL'
+PERILS = PERIL_CODES + [ALL_PERILS]
+
+#loss-type axis and the county columns behind it
+LOSS_TYPES = ['building', 'population', 'agriculture', 'total']
+PERIL_SUFFIXES = {'building': 'EALB', 'population': 'EALPE', 'agriculture': 'EALA', 'total': 'EALT'}
+TOTAL_COLUMNS = {'building': 'EAL_VALB', 'population': 'EAL_VALPE', 'agriculture': 'EAL_VALA', 'total': 'EAL_VALT'}
+
+#variables with precomputed per-state quantiles
+STAT_VARIABLES = ([p + '_EALT' for p in PERIL_CODES] +
+                  ['EAL_VALT', 'BUILDVALUE', 'POPULATION', 'AGRIVALUE', 'RISK_SCORE', 'SOVI_SCORE', 'RESL_SCORE'])
+QUANTILES = (0.0, 0.5, 0.9, 0.98, 0.99, 1.0)
+
+#state key of the national row in the quantile table
+NATIONAL = 'ALL'
+
+
+def _column(NRI, name):
+    #county values as float64 with missing perils/losses counted as zero
+    if name not in NRI.columns:
+        return np.zeros(len(NRI))
+    return np.nan_to_num(NRI[name].to_numpy(dtype='float64'))
+
+
+def _loss_matrix(NRI):
+    #county x (peril, loss type) losses in the order of the cube's values
+    columns = [p + '_' + PERIL_SUFFIXES[l] for p in PERIL_CODES for l in LOSS_TYPES]
+    columns += [TOTAL_COLUMNS[l] for l in LOSS_TYPES]
+    return np.stack([_column(NRI, c) for c in columns], axis=1)
+
+
+def _stat_matrix(NRI, variables):
+    return np.stack([_column(NRI, v) for v in variables], axis=1)
+
+
+class AggregateCube:
+    """State x peril x loss-type sums plus per-state variable quantiles.
+
+    values[s, p, l] is the summed expected annual loss of state s, peril p
+    (PERILS, the last entry being all perils) and loss type l (LOSS_TYPES).
+    stats[s, v, q] holds quantile QUANTILES[q] of STAT_VARIABLES[v] for state
+    s, with the last row covering the whole nation.
+    """
+
+    def __init__(self, NRI):
+        self.states, first, inverse = np.unique(NRI['STATEABBRV'].astype(str).to_numpy(),
+                                                return_index=True, return_inverse=True)
+        self.fips = NRI['STATEFIPS'].to_numpy()[first].astype(int)
+        self.perils = PERILS
+        self.loss_types = LOSS_TYPES
+        self.variables = STAT_VARIABLES
+        self.quantile_levels = QUANTILES
+        self._state_pos = {s: i for i, s in enumerate(self.states)}
+        self._state_pos[NATIONAL] = len(self.states)
+        self._peril_pos = {p: i for i, p in enumerate(self.perils)}
+        self._peril_pos.update({PERIL_NAMES[p]: i for i, p in enumerate(PERIL_CODES)})
+        self._loss_pos = {l: i for i, l in enumerate(self.loss_types)}
+        self._var_pos = {v: i for i, v in enumerate(self.variables)}
+
+        #county x (peril, loss type) matrix, summed into states in one pass
+        sums = np.zeros((len(self.states), len(self.perils) * len(self.loss_types)))
+        np.add.at(sums, inverse, _loss_matrix(NRI))
+        self.values = sums.reshape(len(self.states), len(self.perils), len(self.loss_types))
+
+        #per-state and national quantiles; missing values count as zero like the maps' fillna(0)
+        variables = _stat_matrix(NRI, self.variables)
+        self.stats = np.zeros((len(self.states) + 1, len(self.variables), len(self.quantile_levels)))
+        for s in range(len(self.states)):
+            self.stats[s] = np.quantile(variables[inverse == s], self.quantile_levels, axis=0).T
+        if len(variables):
+            self.stats[-1] = np.quantile(variables, self.quantile_levels, axis=0).T
+
+    def updated(self, NRI, states, columns=None):
+        """Cube of a new release of the data that only differs in `states` and `columns`.
+
+        Sums and quantiles of the other states are carried over; national
+        quantiles are recomputed for the changed columns only (None: all).
+        A release adding or dropping states gets a full rebuild.
+        """
+        names, inverse = np.unique(NRI['STATEABBRV'].astype(str).to_numpy(), return_inverse=True)
+        if not np.array_equal(names, self.states):
+            return AggregateCube(NRI)
+        cube = copy.copy(self)
+        cube.values, cube.stats = self.values.copy(), self.stats.copy()
+        rows = sorted(self._state_pos[s] for s in states if s in self._state_pos and s != NATIONAL)
+        if rows:
+            changed = np.isin(inverse, rows)
+            sums = np.zeros((len(self.states), len(self.perils) * len(self.loss_types)))
+            np.add.at(sums, inverse[changed], _loss_matrix(NRI[changed]))
+            cube.values[rows] = sums[rows].reshape(len(rows), len(self.perils), len(self.loss_types))
+            variables = _stat_matrix(NRI[changed], self.variables)
+            for s in rows:
+                cube.stats[s] = np.quantile(variables[inverse[changed] == s], self.quantile_levels, axis=0).T
+
+            national = [v for v, name in enumerate(self.variables) if columns is None or name in columns]
+            if national:
+                variables = _stat_matrix(NRI, [self.variables[v] for v in national])
+                cube.stats[-1, national] = np.quantile(variables, self.quantile_levels, axis=0).T
+        return cube
+
+    def state_fips(self, state):
+        """Numeric state FIPS code of a state abbreviation."""
+        return int(self.fips[self._state_pos[state]])
+
+    def loss(self, state, peril=ALL_PERILS, loss_type='total'):
+        """Summed loss for one state, peril (code or display name) and loss type."""
+        return float(self.values[self._state_pos[state], self._peril_pos[peril], self._loss_pos[loss_type]])
+
+    def quantile(self, state, variable, q):
+        """Precomputed quantile `q` (one of QUANTILES) of a variable, state may be NATIONAL."""
+        return float(self.stats[self._state_pos[state], self._var_pos[variable], self.quantile_levels.index(q)])
+
+    def quantiles(self, variable, q):
+        """Precomputed quantile `q` of a variable for every state, a Series indexed by state."""
+        return pd.Series(self.stats[:-1, self._var_pos[variable], self.quantile_levels.index(q)], index=self.states)
+
+    def max(self, state, variable):
+        """Largest county value of a variable in a state (or NATIONAL)."""
+        return self.quantile(state, variable, 1.0)
+
+    def state_breakdown(self):
+        """Figure 1 frame: building/agricultural/population loss per state, sorted by building loss."""
+        totals = self.values[:, -1, :]
+        frame = pd.DataFrame({'STATEABBRV': self.states,
+                              'Building Loss': totals[:, self._loss_pos['building']],
+                              'Agricultural Loss': totals[:, self._loss_pos['agriculture']],
+                              'Population Loss': totals[:, self._loss_pos['population']]})
+        return frame.sort_values(by=['Building Loss'], ascending=False)
+
+    def peril_losses(self, state, loss_type='total'):
+        """Figure 4 frame: loss per peril for one state, sorted descending."""
+        losses = self.values[self._state_pos[state], :-1, self._loss_pos[loss_type]]
+        frame = pd.DataFrame({'index': [PERIL_NAMES[p] for p in PERIL_CODES],
+                              'Expected Annual Loss': losses})
+        return frame.sort_values(by=['Expected Annual Loss'], ascending=False)
+
+    def peril_breakdown(self, state=NATIONAL):
+        """Loss per peril (rows, all perils last) and loss type (columns) for one state or NATIONAL."""
+        values = self.values.sum(axis=0) if state == NATIONAL else self.values[self._state_pos[state]]
+        return pd.DataFrame(values, index=pd.Index(self.perils, name='peril'), columns=self.loss_types)
+
+
+_cubes = digest_memo()
+
+
+def load_cube(source=None):
+    """Aggregate cube of an NRI source, built once per dataset version."""
+    return _cubes.get(source_digest(source), lambda: AggregateCube(load_nri(source)))
+
+
+def update_cube(previous, states, columns=None, source=None):
+    """Cube of the current version of an NRI source, updated from the cube of version `previous`.
+
+    Only `states` (and the national quantiles of `columns`) are recomputed;
+    without a cube for `previous` this is load_cube.
+    """
+    old = _cubes.peek(previous)
+    return _cubes.get(source_digest(source), lambda: old.updated(load_nri(source), states, columns) if old is not None
+                      else AggregateCube(load_nri(source)))
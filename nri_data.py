@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Data loading layer for the NRI dashboard.
+
+The county NRI table and the county GeoJSON are read once per process and
+kept in a process-wide cache keyed by the sha256 of the source bytes, so
+Streamlit reruns never go back to disk or to the network. The bundled
+NRI_State_Dat.csv and geojson-counties-fips.json are the default sources;
+set NRI_DATA_PATH / NRI_GEOJSON_PATH to point at other files or URLs.
+
+When a Parquet build of the csv exists next to it (see nri_build.py) it is
+used instead, and only the projected columns are read. A memory-mapped
+store build (nri_store, nri_build.py --store) is preferred over both.
+
+Columns are loaded through a fixed schema: float64 for dollar losses and
+exposures, float32 for scores, frequencies and percentiles, categoricals
+for ratings and state labels, small integers for ids and FIPS
+as int32 codes (fips_str formats them back into 5 digit GeoJSON ids).
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from nri_store import COLUMNS_FILE, is_store, read_table_store, store_covers, store_digest, store_path
+
+
+#directory holding the bundled data files
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#default sources, local so the dashboard works air-gapped; any of them may be an http(s) url instead
+NRI_PATH = os.environ.get('NRI_DATA_PATH', os.path.join(DATA_DIR, 'NRI_State_Dat.csv'))
+COUNTY_GEOJSON_PATH = os.environ.get('NRI_GEOJSON_PATH', os.path.join(DATA_DIR, 'geojson-counties-fips.json'))
+
+#census tract NRI table and tract GeoJSON, not bundled; the tract map mode is off unless both are set
+TRACT_PATH = os.environ.get('NRI_TRACT_DATA_PATH')
+TRACT_GEOJSON_PATH = os.environ.get('NRI_TRACT_GEOJSON_PATH')
+
+
+#columns the dashboard reads, everything else stays on disk
+PERIL_CODES = ['AVLN', 'CFLD', 'CWAV', 'DRGT', 'ERQK', 'HAIL', 'HWAV', 'HRCN', 'ISTM',
+               'LNDS', 'LTNG', 'RFLD', 'SWND', 'TRND', 'TSUN', 'VLCN', 'WFIR', 'WNTW']
+
+#peril loss columns by loss type, not every peril carries every type (e.g. no AVLN_EALA)
+PERIL_LOSS_SUFFIXES = ['EALB', 'EALPE', 'EALA', 'EALT']
+
+DASHBOARD_COLUMNS = (['STATE', 'STATEABBRV', 'STATEFIPS', 'COUNTY', 'COUNTYTYPE', 'COUNTYFIPS', 'STCOFIPS',
+                      'POPULATION', 'BUILDVALUE', 'AGRIVALUE',
+                      'RISK_SCORE', 'SOVI_SCORE', 'SOVI_RATNG', 'RESL_SCORE', 'RESL_RATNG',
+                      'EAL_VALT', 'EAL_VALB', 'EAL_VALP', 'EAL_VALPE', 'EAL_VALA'] +
+                     [p + '_' + suffix for p in PERIL_CODES for suffix in PERIL_LOSS_SUFFIXES])
+
+#columns the tract map mode reads from the tract table
+TRACT_COLUMNS = ['STATEABBRV', 'STATEFIPS', 'COUNTY', 'TRACTFIPS', 'POPULATION', 'BUILDVALUE',
+                 'RISK_SCORE', 'SOVI_SCORE', 'RESL_SCORE', 'EAL_VALT']
+
+#low cardinality labels, every rating column (*_RATNG and the peril *_HLRR/*_EALR/*_RISKR) is added to these
+CATEGORY_COLUMNS = ['STATE', 'STATEABBRV', 'COUNTYTYPE', 'NRI_VER']
+RATING_SUFFIXES = ('_RATNG', '_HLRR', '_EALR', '_RISKR')
+
+#integer columns and the narrowest type that holds them
+INTEGER_COLUMNS = {'OID_': 'int32', 'STATEFIPS': 'int8', 'COUNTYFIPS': 'int16',
+                   'STCOFIPS': 'int32', 'TRACTFIPS': 'int64', 'POPULATION': 'int32'}
+
+#dollar values, losses and exposures stay float64: float32 steps by whole dollars past $16.8M
+#(2**24) and building values reach the billions; EAL_VAL* and the peril *_EAL*/*_EXP* columns
+DOUBLE_COLUMNS = ['BUILDVALUE', 'AGRIVALUE']
+DOUBLE_SUFFIXES = ('_VALT', '_VALB', '_VALP', '_VALPE', '_VALA', '_EALB', '_EALP', '_EALPE', '_EALA', '_EALT',
+                   '_EXPB', '_EXPP', '_EXPPE', '_EXPA', '_EXPT')
+
+#free text columns kept as python strings
+STRING_COLUMNS = ['NRI_ID', 'COUNTY']
+
+#key written into the parquet metadata holding the sha256 of the source csv
+SOURCE_DIGEST_KEY = b'nri_source_sha256'
+
+
+_lock = threading.Lock()
+
+#source -> (stamp, digest); the stamp is (mtime, size) for files and None for urls
+_digests = {}
+
+#(kind, digest, columns) -> parsed object
+_parsed = {}
+
+
+def _is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def _is_parquet(source):
+    return source.endswith('.parquet')
+
+
+def fresh_store(source, name):
+    """Store directory next to a local source when it holds an up to date `name`, else None."""
+    if _is_url(source) or is_store(source):
+        return None
+    built = os.path.join(store_path(source), name)
+    if os.path.exists(built) and os.stat(built).st_mtime_ns >= os.stat(source).st_mtime_ns:
+        return store_path(source)
+    return None
+
+
+def _resolve(source, columns):
+    #prefers an up to date store holding every projected column (None: all), then an up to date
+    #parquet build, sitting next to a local csv
+    if _is_url(source) or _is_parquet(source) or is_store(source):
+        return source
+    store = fresh_store(source, COLUMNS_FILE)
+    if store and store_covers(store, columns):
+        return store
+    built = os.path.splitext(source)[0] + '.parquet'
+    if os.path.exists(built) and os.stat(built).st_mtime_ns >= os.stat(source).st_mtime_ns:
+        return built
+    return source
+
+
+def _stamp(source):
+    if _is_url(source):
+        return None
+    if is_store(source):
+        #a store is rewritten file by file, the directory's own mtime does not change
+        return tuple((st.st_mtime_ns, st.st_size) for st in
+                     (os.stat(os.path.join(source, name)) for name in sorted(os.listdir(source))))
+    st = os.stat(source)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_bytes(source):
+    if _is_url(source):
+        with urlopen(source) as response:
+            return response.read()
+    with open(source, 'rb') as fh:
+        return fh.read()
+
+
+def _parquet_digest(source):
+    #the build step records the csv hash, so the parquet body is never read just to hash it
+    metadata = pq.read_schema(source).metadata or {}
+    if SOURCE_DIGEST_KEY in metadata:
+        return metadata[SOURCE_DIGEST_KEY].decode()
+    return hashlib.sha256(_read_bytes(source)).hexdigest()
+
+
+def _load(kind, source, columns, parse):
+    #returns the parsed object for source, reading and parsing at most once per content hash
+    with _lock:
+        stamp = _stamp(source)
+        known = _digests.get(source)
+        if known is not None and known[0] == stamp and (kind, known[1], columns) in _parsed:
+            return _parsed[(kind, known[1], columns)]
+
+        if _is_parquet(source) or is_store(source):
+            raw = source
+            digest = _parquet_digest(source) if _is_parquet(source) else store_digest(source)
+        else:
+            raw = _read_bytes(source)
+            digest = hashlib.sha256(raw).hexdigest()
+        _digests[source] = (stamp, digest)
+
+        key = (kind, digest, columns)
+        if key not in _parsed:
+            _parsed[key] = parse(raw, columns)
+        return _parsed[key]
+
+
+def source_digest(source=None):
+    """Content hash of a source (the NRI table by default), used as its version."""
+    #every build records the digest of its source, so whichever one is picked versions it
+    source = _resolve(source or NRI_PATH, ())
+    with _lock:
+        stamp = _stamp(source)
+        known = _digests.get(source)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        if is_store(source):
+            digest = store_digest(source)
+        elif _is_parquet(source):
+            digest = _parquet_digest(source)
+        else:
+            digest = hashlib.sha256(_read_bytes(source)).hexdigest()
+        _digests[source] = (stamp, digest)
+        return digest
+
+
+def nri_dtype(column):
+    """Schema dtype of an NRI column, float32 unless listed otherwise."""
+    if column in CATEGORY_COLUMNS or column.endswith(RATING_SUFFIXES):
+        return 'category'
+    if column in INTEGER_COLUMNS:
+        return INTEGER_COLUMNS[column]
+    if column in STRING_COLUMNS:
+        return object
+    if column in DOUBLE_COLUMNS or column.endswith(DOUBLE_SUFFIXES):
+        return 'float64'
+    return 'float32'
+
+
+def apply_schema(NRI):
+    """Casts a raw NRI frame to the schema dtypes."""
+    return NRI.astype({c: nri_dtype(c) for c in NRI.columns if c != 'FIPS'})
+
+
+def fips_str(codes):
+    """Formats int FIPS codes as the 5 digit ids used by the county GeoJSON.
+
+    Longer codes (e.g. tract FIPS) are kept whole rather than truncated.
+    """
+    return np.char.zfill(np.asarray(codes).astype(str), 5)
+
+
+def memory_report(NRI):
+    """Bytes held by a loaded frame, in total, per county and per column."""
+    by_column = NRI.memory_usage(index=True, deep=True)
+    total = int(by_column.sum())
+    return {'rows': len(NRI),
+            'total_bytes': total,
+            'bytes_per_county': total / max(len(NRI), 1),
+            'by_column': by_column.sort_values(ascending=False)}
+
+
+def _parse_nri(raw, columns):
+    if isinstance(raw, str) and is_store(raw):
+        #already typed by the build, renaming in place keeps the mapped block
+        NRI = read_table_store(raw, columns)
+        NRI.rename(columns={'STCOFIPS': 'FIPS'}, inplace=True)
+        return NRI
+    if isinstance(raw, str):
+        names = pq.read_schema(raw).names
+        NRI = pd.read_parquet(raw, columns=None if columns is None else [c for c in names if c in columns])
+    else:
+        header = pd.read_csv(io.BytesIO(raw), nrows=0).columns
+        names = header if columns is None else [c for c in header if c in columns]
+        NRI = pd.read_csv(io.BytesIO(raw), usecols=names, dtype={c: nri_dtype(c) for c in names})
+    #renaming county fips code
+    NRI.rename(columns={'STCOFIPS': 'FIPS'}, inplace=True)
+    return apply_schema(NRI)
+
+
+def _parse_geojson(raw, columns):
+    return json.loads(raw)
+
+
+def load_nri(source=None, columns=DASHBOARD_COLUMNS):
+    """County NRI table with STCOFIPS renamed to FIPS.
+
+    Only `columns` are read (pass None for all 365), projected columns missing
+    from the source are skipped. The frame is shared by every session in the
+    process, treat it as read-only.
+    """
+    columns = None if columns is None else tuple(columns)
+    return _load('nri', _resolve(source or NRI_PATH, columns), columns, _parse_nri)
+
+
+def load_counties(source=None):
+    """County GeoJSON FeatureCollection keyed by 5 digit FIPS ids.
+
+    The dict is shared by every session in the process, treat it as read-only.
+    """
+    return _load('geojson', source or COUNTY_GEOJSON_PATH, None, _parse_geojson)
+
+
+def load_tracts(source=None, columns=TRACT_COLUMNS):
+    """Census tract NRI table, loaded and cached like load_nri."""
+    source = source or TRACT_PATH
+    if source is None:
+        raise ValueError('no tract table configured, set NRI_TRACT_DATA_PATH')
+    columns = None if columns is None else tuple(columns)
+    return _load('nri', _resolve(source, columns), columns, _parse_nri)
+
+
+def tracts_available():
+    """True when both the tract table and the tract GeoJSON are configured."""
+    return bool(TRACT_PATH and TRACT_GEOJSON_PATH)
+
+
+def tracts_digest():
+    """Version of the configured tract table and tract GeoJSON together, for keying results built from them."""
+    return source_digest(TRACT_PATH) + source_digest(TRACT_GEOJSON_PATH)
+
+
+class DigestMemo:
+    """Values built once per source version, shared by every session in the process.
+
+    Keys are a digest, or a tuple holding one or more digests and any build
+    parameters; evict() drops every value built from a superseded digest.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.RLock()
+
+    def get(self, key, build):
+        """The value of key, calling build() for it on first use."""
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = build()
+            return self._values[key]
+
+    def peek(self, key):
+        with self._lock:
+            return self._values.get(key)
+
+    def evict(self, digests):
+        with self._lock:
+            for key in [k for k in self._values if _holds(k, digests)]:
+                del self._values[key]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def _holds(key, digests):
+    return any(part in digests for part in (key if isinstance(key, tuple) else (key,)))
+
+
+#every memo made by digest_memo, evicted and cleared together with the parsed sources
+_memos = []
+
+
+def digest_memo():
+    """A new process-wide DigestMemo, evicted by evict() and cleared by clear_cache()."""
+    memo = DigestMemo()
+    with _lock:
+        _memos.append(memo)
+    return memo
+
+
+def evict(digests):
+    """Drops the parsed sources and every memoized value of superseded source versions."""
+    digests = set(digests)
+    with _lock:
+        for key in [k for k in _parsed if _holds(k, digests)]:
+            del _parsed[key]
+        for source in [s for s, (_, d) in _digests.items() if d in digests]:
+            del _digests[source]
+        memos = list(_memos)
+    for memo in memos:
+        memo.evict(digests)
+
+
+def clear_cache():
+    """Drop every cached source, the next load reads from the sources again."""
+    with _lock:
+        _digests.clear()
+        _parsed.clear()
+        memos = list(_memos)
+    for memo in memos:
+        memo.clear()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Static HTML export of every view the dashboard can show.
+
+    python nri_export.py [out_dir] [--workers N] [--states CA TX]
+
+Renders Figure 1, Figures 2/3 and 4 per state, Figure 5 per state and peril
+and Figures 6/7 per variable (at the dashboard's default ranges) into a
+self-contained bundle that any static host can serve:
+
+    out_dir/index.html          links to every page
+    out_dir/plotly.min.js       shared by every page
+    out_dir/geometry/<ST>.js    a state's county polygons, shared by its maps
+    out_dir/figures/*.html      one page per figure
+
+Pages are rendered on a process pool; each worker loads the data, cube and
+geometry once in its initializer and then only builds and writes figures.
+"""
+
+import argparse
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly
+
+import nri_core
+from nri_core import (EXPOSURE_VARIABLES, MAP_PERILS, NO_GEOMETRY, PERIL_RANGE_SHARE, RISK_RANGE, RISK_VARIABLES,
+                      X_RANGE_SHARE, Y_RANGE_SHARE)
+from nri_cube import NATIONAL, load_cube
+from nri_data import load_nri
+from nri_geo import load_geometry
+
+
+DEFAULT_OUT = 'nri_report'
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="../plotly.min.js"></script>
+{geometry}</head>
+<body style="font-family: sans-serif; max-width: 1000px; margin: auto;">
+<p><a href="../index.html">All figures</a></p>
+<h3>{title}</h3>
+<div id="chart"></div>
+<script>
+var spec = {spec};
+spec.data.forEach(function (trace) {{
+  if (trace.type === 'choroplethmapbox') {{ trace.geojson = NRI_GEOMETRY; }}
+}});
+Plotly.newPlot('chart', spec.data, spec.layout, {{responsive: true}});
+</script>
+</body>
+</html>
+'''
+
+
+def slug(text):
+    """File name part of a label: 'Agricultural Value ($)' -> 'agricultural-value'."""
+    return '-'.join(''.join(c if c.isalnum() else ' ' for c in text.lower()).split())
+
+
+def tasks(states):
+    """(file name, title, figure kind, args) of every page, states first so maps spread over workers."""
+    out = [('figure_1.html', 'Figure 1: Annual Expected Loss by State', 'overview', ())]
+    for state in states:
+        out += [('figure_2_%s.html' % state, 'Figure 2: Annual Expected Loss by County for %s' % state,
+                 'loss_map', (state,)),
+                ('figure_3_%s.html' % state, 'Figure 3: Composite Risk Score by County for %s' % state,
+                 'risk_map', (state,)),
+                ('figure_4_%s.html' % state, 'Figure 4: Loss by Peril for %s' % state, 'peril_bar', (state,))]
+        out += [('figure_5_%s_%s.html' % (state, slug(peril)),
+                 'Figure 5: County Level %s Expected Loss for %s' % (peril, state), 'peril_map', (state, peril))
+                for peril in MAP_PERILS]
+    out += [('figure_6_%s.html' % slug(y), 'Figure 6: Expected Loss and %s' % y, 'exposure_scatter', (y,))
+            for y in EXPOSURE_VARIABLES]
+    out += [('figure_7_%s.html' % slug(y), 'Figure 7: Expected Loss and %s' % y, 'risk_scatter', (y,))
+            for y in RISK_VARIABLES]
+    return out
+
+
+#per worker process state, filled by _init
+_worker = {}
+
+
+def _init(out_dir):
+    NRI = load_nri()
+    cube = load_cube()
+    geometry = load_geometry()
+    _worker.update(out_dir=out_dir, NRI=NRI, cube=cube,
+                   views=nri_core.state_views(cube, geometry), scatter=nri_core.scatter_frame(NRI))
+
+
+def build(kind, args):
+    """The figure of one page, at the dashboard's default ranges."""
+    NRI, cube, views = _worker['NRI'], _worker['cube'], _worker['views']
+    if kind == 'overview':
+        return nri_core.loss_overview_figure(cube)
+    if kind == 'peril_bar':
+        return nri_core.peril_bar_figure(cube, args[0])
+    if kind in ('exposure_scatter', 'risk_scatter'):
+        y_max, x_max = nri_core.exposure_bounds(cube, args[0], NATIONAL)
+        if kind == 'risk_scatter':
+            return nri_core.risk_scatter_figure(_worker['scatter'], args[0], (0, x_max * X_RANGE_SHARE))
+        return nri_core.exposure_scatter_figure(_worker['scatter'], args[0], (0, y_max * Y_RANGE_SHARE),
+                                                (0, x_max * X_RANGE_SHARE))
+
+    state = args[0]
+    (lat, lon), zoom, loss_range = nri_core.state_view(views, state)
+    #the page fills in the polygons from geometry/<state>.js
+    if kind == 'loss_map':
+        return nri_core.county_map_figure(nri_core.state_counties(NRI, state), NO_GEOMETRY, 'EAL_VALT', loss_range,
+                                          zoom, (lat, lon), 'Annual Expected Loss')
+    if kind == 'risk_map':
+        return nri_core.county_map_figure(nri_core.state_counties(NRI, state), NO_GEOMETRY, 'RISK_SCORE', RISK_RANGE,
+                                          zoom, (lat, lon), 'Composite Risk Score')
+    peril = args[1]
+    peril_max = nri_core.peril_bound(cube, state, peril)
+    return nri_core.peril_map_figure(nri_core.peril_frame(NRI, state), NO_GEOMETRY, peril,
+                                     (0, peril_max * PERIL_RANGE_SHARE), zoom, (lat, lon))
+
+
+def render(task):
+    """Builds and writes one page, returns (file name, bytes written)."""
+    name, title, kind, args = task
+    spec = build(kind, args).to_dict()
+    maps = any(t.get('type') == 'choroplethmapbox' for t in spec['data'])
+    for trace in spec['data']:
+        trace.pop('geojson', None)
+    spec_json = json.dumps(spec, cls=plotly.utils.PlotlyJSONEncoder, separators=(',', ':'))
+    geometry = '<script src="../geometry/%s.js"></script>\n' % args[0] if maps else ''
+    page = PAGE.format(title=html.escape(title), geometry=geometry, spec=spec_json.replace('</', '<\\/'))
+    data = page.encode('utf-8')
+    with open(os.path.join(_worker['out_dir'], 'figures', name), 'wb') as fh:
+        fh.write(data)
+    return name, len(data)
+
+
+def write_shared(out_dir, states):
+    """plotly.js and each state's map geometry (simplified for its map zoom), written once."""
+    os.makedirs(os.path.join(out_dir, 'figures'), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, 'geometry'), exist_ok=True)
+    with open(os.path.join(out_dir, 'plotly.min.js'), 'w', encoding='utf-8') as fh:
+        fh.write(plotly.offline.get_plotlyjs())
+    cube, geometry = load_cube(), load_geometry()
+    views = nri_core.state_views(cube, geometry)
+    for state in states:
+        _, zoom, _ = nri_core.state_view(views, state)
+        with open(os.path.join(out_dir, 'geometry', state + '.js'), 'wb') as fh:
+            fh.write(b'var NRI_GEOMETRY = ' + geometry.encoded(cube.state_fips(state), zoom) + b';\n')
+
+
+def write_index(out_dir, pages):
+    """index.html linking every page under its section."""
+    groups = {}
+    for name, title, kind, args in pages:
+        group = 'Overview' if kind == 'overview' else args[0] if kind in ('loss_map', 'risk_map', 'peril_bar',
+                                                                           'peril_map') else 'Correlations with Loss'
+        groups.setdefault(group, []).append('<li><a href="figures/%s">%s</a></li>' % (name, html.escape(title)))
+    body = ''.join('<h2>%s</h2>\n<ul>\n%s\n</ul>\n' % (html.escape(group), '\n'.join(links))
+                   for group, links in groups.items())
+    with open(os.path.join(out_dir, 'index.html'), 'w', encoding='utf-8') as fh:
+        fh.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>National Risk Index Figures</title>\n'
+                 '</head>\n<body style="font-family: sans-serif; max-width: 1000px; margin: auto;">\n'
+                 '<h1>Natural Disaster and Climate Risk by State</h1>\n%s</body>\n</html>\n' % body)
+
+
+def export(out_dir=DEFAULT_OUT, states=None, workers=None):
+    """Renders the bundle into out_dir, returns the (file name, bytes) of every page."""
+    states = list(states or load_cube().states)
+    pages = tasks(states)
+    write_shared(out_dir, states)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(out_dir,)) as pool:
+        written = list(pool.map(render, pages, chunksize=4))
+    write_index(out_dir, pages)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render every dashboard view into a static HTML bundle.')
+    parser.add_argument('out_dir', nargs='?', default=DEFAULT_OUT, help='bundle directory')
+    parser.add_argument('--workers', type=int, default=None, help='render processes (default: one per cpu)')
+    parser.add_argument('--states', nargs='+', help='state abbreviations to export (default: every state)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    written = export(args.out_dir, args.states, args.workers)
+    print('wrote %d pages (%.1f MB) to %s in %.1f s' % (len(written), sum(n for _, n in written) / 2 ** 20,
+                                                        args.out_dir, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Process-wide memoized figure cache with a memory cap and LRU eviction.
+
+The dashboard's figure builders are pure functions of their inputs (state,
+variable, range, zoom, ...) and of the dataset version, so every session
+in the process can share the figures they return. Set NRI_FIGURE_CACHE_MB
+to change the cap (default 256 MB, 0 disables caching).
+"""
+
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from nri_data import source_digest
+from nri_metrics import instrument
+
+
+#default memory cap in megabytes
+DEFAULT_CAP_MB = 256
+
+
+#bytes counted for a number, None or bool and for each container entry
+SCALAR_BYTES = 8
+
+
+def _nbytes(value):
+    #numpy arrays by nbytes, strings by length; object arrays (county names) hold strings
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return sum(_nbytes(v) for v in value.ravel())
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(k) + _nbytes(v) for k, v in value.items()) + SCALAR_BYTES * len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value) + SCALAR_BYTES * len(value)
+    return SCALAR_BYTES
+
+
+def figure_size(fig):
+    """Estimated bytes held by a figure, the measure the cache's cap bounds.
+
+    Counts the property tree from fig.to_plotly_json(): numpy arrays by
+    nbytes, strings by length, and SCALAR_BYTES per other value and per
+    container entry. On the dashboard's figures this lands within about 25%
+    of the JSON size, above it for large float arrays, whose doubles JSON
+    often writes in fewer than 8 characters. Python object overhead is not
+    counted. It is a few times cheaper than serializing the figure on every
+    put.
+    """
+    return _nbytes(fig.to_plotly_json())
+
+
+class FigureCache:
+    """LRU cache of built figures bounded by their summed size in bytes.
+
+    Cached figures are shared between sessions, treat them as read-only.
+    """
+
+    def __init__(self, max_bytes, sizeof=figure_size, version=source_digest):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, fig):
+        size = self.sizeof(fig)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (fig, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Drops every entry, or only the keys for which predicate(key) is true."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate is None or predicate(k)]:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def migrate(self, old_version, new_version, stale):
+        """Carries the entries of one dataset version over to the next, dropping those stale(key) flags.
+
+        Returns the number of (kept, dropped) entries.
+        """
+        kept = dropped = 0
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == old_version]:
+                fig, size = self._entries.pop(key)
+                newkey = (key[0], new_version) + key[2:]
+                #a session may have rebuilt it for the new version before the refresh, that one is kept
+                if newkey in self._entries or stale(key):
+                    self.bytes -= size
+                    dropped += 1
+                else:
+                    self._entries[newkey] = (fig, size)
+                    kept += 1
+        return kept, dropped
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def cached(self, func):
+        """Decorator memoizing a figure builder on its arguments and the dataset version.
+
+        Keys are (builder name, dataset version, args, sorted kwargs), so all
+        arguments must be hashable (pass ranges and centers as tuples).
+        """
+        @instrument
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__qualname__, self.version(), args, tuple(sorted(kwargs.items())))
+            fig = self.get(key)
+            if fig is None:
+                fig = func(*args, **kwargs)
+                self.put(key, fig)
+            return fig
+        return wrapper
+
+
+#shared by every session of the server process
+figure_cache = FigureCache(int(float(os.environ.get('NRI_FIGURE_CACHE_MB', DEFAULT_CAP_MB)) * 2 ** 20))
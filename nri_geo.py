@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+County geometry store for the NRI choropleths.
+
+The national county GeoJSON is partitioned by state FIPS once per process,
+so a state map only ships its own counties. Each state partition is also
+kept at several simplification tolerances; the variant is picked from the
+map zoom so polygons carry no more detail than the screen can show.
+
+With a geometry store built next to the GeoJSON (nri_build.py --store),
+the serialized variants and state bounds are read from its memory map and
+the GeoJSON itself is only parsed if a caller asks for features.
+"""
+
+import json
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import mapping, shape
+
+from nri_data import load_counties, fresh_store, source_digest, COUNTY_GEOJSON_PATH, digest_memo
+from nri_store import GEOMETRY_FILE, PrebuiltGeometry
+
+
+#simplification tolerances in degrees, 0.0 keeps the source geometry
+TOLERANCES = (0.0, 0.002, 0.005, 0.01, 0.02)
+
+#mapbox renders 512 px tiles, so at zoom z one pixel spans 360 / (512 * 2**z) degrees
+TILE_SIZE = 512
+
+
+def tolerance_for_zoom(zoom):
+    """Coarsest tolerance that stays under half a screen pixel at `zoom`."""
+    half_pixel = 360.0 / (TILE_SIZE * 2 ** zoom) / 2
+    return max(t for t in TOLERANCES if t <= half_pixel)
+
+
+def _round(coords, decimals):
+    if isinstance(coords[0], (int, float)):
+        return [round(coords[0], decimals), round(coords[1], decimals)]
+    return [_round(c, decimals) for c in coords]
+
+
+def _simplify(feature, tolerance):
+    if tolerance == 0.0:
+        return feature
+    geometry = mapping(shape(feature['geometry']).simplify(tolerance, preserve_topology=True))
+    #coordinates finer than a tenth of the tolerance carry no visible detail
+    decimals = max(2, int(math.ceil(-math.log10(tolerance))) + 1)
+    return {'type': 'Feature',
+            'id': feature['id'],
+            'properties': feature.get('properties', {}),
+            'geometry': {'type': geometry['type'], 'coordinates': _round(geometry['coordinates'], decimals)}}
+
+
+def _vertices(geometry):
+    #every ring of a Polygon/MultiPolygon as (n, 2) arrays
+    polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+    return [np.asarray(ring, dtype='float64').reshape(-1, 2) for polygon in polygons for ring in polygon]
+
+
+class GeometryStore:
+    """County features partitioned by state FIPS, with simplified variants per tolerance.
+
+    `counties` is the FeatureCollection, or a function loading it on first
+    use when `prebuilt` (an nri_store.PrebuiltGeometry) already holds the
+    encoded variants and bounds.
+    """
+
+    def __init__(self, counties, digest='', prebuilt=None):
+        self.digest = digest
+        self._counties = counties
+        self._prebuilt = prebuilt
+        self._partition = None
+        self._variants = {}
+        self._encoded = {}
+        self._bounds = prebuilt.bounds if prebuilt is not None else None
+        self._lock = threading.Lock()
+
+    @property
+    def _features(self):
+        if self._partition is None:
+            counties = self._counties() if callable(self._counties) else self._counties
+            partition = defaultdict(list)
+            for feature in counties['features']:
+                partition[int(str(feature['id'])[:2])].append(feature)
+            self._partition = partition
+        return self._partition
+
+    @property
+    def prebuilt(self):
+        """True when the encoded variants come from a geometry store."""
+        return self._prebuilt is not None
+
+    @property
+    def states(self):
+        return self._prebuilt.states if self._prebuilt is not None else sorted(self._features)
+
+    def bounds(self):
+        """Bounding box of every state's counties, a frame indexed by state FIPS.
+
+        Columns are west, south, east, north in degrees. States crossing the
+        antimeridian (Alaska) get a west edge above 180 east, so east - west is
+        always the narrow span. Computed once, in one pass over every vertex.
+        """
+        with self._lock:
+            if self._bounds is None:
+                states = self.states
+                rings = [[r for f in self._features[s] for r in _vertices(f['geometry'])] for s in states]
+                counts = [sum(len(r) for r in state) for state in rings]
+                xy = np.concatenate([r for state in rings for r in state])
+                starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+                #spans in -180..180 and in 0..360, switching only states that wrap around
+                lon, wrapped = xy[:, 0], np.mod(xy[:, 0], 360.0)
+                west, east = np.minimum.reduceat(lon, starts), np.maximum.reduceat(lon, starts)
+                west360, east360 = np.minimum.reduceat(wrapped, starts), np.maximum.reduceat(wrapped, starts)
+                use360 = (east - west > 180) & (east360 - west360 < east - west)
+                self._bounds = pd.DataFrame({'west': np.where(use360, west360, west),
+                                             'south': np.minimum.reduceat(xy[:, 1], starts),
+                                             'east': np.where(use360, east360, east),
+                                             'north': np.maximum.reduceat(xy[:, 1], starts)},
+                                            index=pd.Index(states, name='STATEFIPS'))
+            return self._bounds
+
+    def subset(self, state_fips, tolerance=0.0):
+        """FeatureCollection of one state's counties at one of TOLERANCES."""
+        if tolerance not in TOLERANCES:
+            raise ValueError('tolerance must be one of %s' % (TOLERANCES,))
+        key = (int(state_fips), tolerance)
+        with self._lock:
+            if key not in self._variants:
+                features = [_simplify(f, tolerance) for f in self._features.get(key[0], [])]
+                self._variants[key] = {'type': 'FeatureCollection', 'features': features}
+            return self._variants[key]
+
+    def inherit(self, previous, states):
+        """Takes over the simplified and encoded variants `previous` built for `states` (state FIPS).
+
+        For a new version of the GeoJSON whose other states changed, so only
+        those are simplified again.
+        """
+        states = {int(s) for s in states}
+        with previous._lock:
+            variants = {k: v for k, v in previous._variants.items() if k[0] in states}
+            encoded = {k: v for k, v in previous._encoded.items() if int(k.split('-')[1]) in states}
+        with self._lock:
+            for key, collection in variants.items():
+                self._variants.setdefault(key, collection)
+            for key, blob in encoded.items():
+                self._encoded.setdefault(self.digest[:12] + key[len(previous.digest[:12]):], blob)
+
+    def for_zoom(self, state_fips, zoom):
+        """FeatureCollection of one state's counties simplified for `zoom`."""
+        return self.subset(state_fips, tolerance_for_zoom(zoom))
+
+    def token(self, state_fips, zoom):
+        """Stable id of the variant for_zoom returns, unique across geometry sources."""
+        return '%s-%02d-%g' % (self.digest[:12], int(state_fips), tolerance_for_zoom(zoom))
+
+    def encoded(self, state_fips, zoom):
+        """The for_zoom variant serialized to compact utf-8 JSON, encoded once per variant."""
+        if self._prebuilt is not None:
+            #copied out of the mapped store per send, nothing is kept per process
+            encoded = self._prebuilt.encoded(state_fips, tolerance_for_zoom(zoom))
+            if encoded is not None:
+                return encoded
+        key = self.token(state_fips, zoom)
+        collection = self.for_zoom(state_fips, zoom)
+        with self._lock:
+            if key not in self._encoded:
+                self._encoded[key] = json.dumps(collection, separators=(',', ':')).encode()
+            return self._encoded[key]
+
+
+_stores = digest_memo()
+
+
+def load_geometry(source=None):
+    """Geometry store of a county GeoJSON source, built once per content hash.
+
+    Uses the memory-mapped geometry store next to the source when it is up
+    to date, leaving the GeoJSON unparsed until features are needed.
+    """
+    source = source or COUNTY_GEOJSON_PATH
+    store = fresh_store(source, GEOMETRY_FILE)
+    digest = source_digest(store or source)
+    if store:
+        return _stores.get(digest, lambda: GeometryStore(lambda: load_counties(source), digest, PrebuiltGeometry(store)))
+    return _stores.get(digest, lambda: GeometryStore(load_counties(source), digest))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local spatial hotspots of county loss and risk, across state lines.
+
+The county adjacency graph (queen contiguity: counties touching, with a
+small gap tolerance) is built once per geometry version from the county
+GeoJSON as a sparse matrix. For any *_EALT or score column, Local Moran's
+I and Getis-Ord Gi* then come from one sparse product of the adjacency and
+the county values, and permutation inference from the same product over a
+(counties x batch) matrix of shuffled values, a batch at a time.
+
+Permutations shuffle all counties (total randomization), so a county's own
+value can land among its neighbors with probability degree/n, negligible
+at county counts. Both statistics are monotone in the neighbor sum, so the
+pseudo p-value of one batch of shuffles serves both.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+from shapely.geometry import shape
+from shapely.prepared import prep
+
+from nri_data import COUNTY_GEOJSON_PATH, digest_memo, load_counties, load_nri, source_digest
+
+
+#counties closer than this many degrees (~10 m) are neighbors, the generalized county boundaries
+#do not share vertices along state lines
+SNAP_DEGREES = 1e-4
+
+#permutations of the pseudo p-values, drawn BATCH at a time
+PERMUTATIONS = 999
+BATCH = 111
+
+#significance level of the cluster labels
+ALPHA = 0.05
+
+#cluster labels by (own value above mean, neighbors above mean)
+CLUSTERS = {(True, True): 'Hot Spot', (False, False): 'Cold Spot',
+            (True, False): 'High-Low Outlier', (False, True): 'Low-High Outlier'}
+NOT_SIGNIFICANT = 'Not Significant'
+
+
+def adjacency(counties):
+    """(FIPS array, binary csr adjacency) of every county in a GeoJSON FeatureCollection.
+
+    Candidate pairs are counties whose bounding boxes overlap, found on
+    longitude-sorted boxes; a candidate is a neighbor when the county grown
+    by SNAP_DEGREES intersects it (queen contiguity with a gap tolerance).
+    """
+    features = [f for f in counties['features'] if f.get('geometry')]
+    fips = np.array([int(f['id']) for f in features], dtype='int64')
+    geometries = [shape(f['geometry']) for f in features]
+    west, south, east, north = np.array([g.bounds for g in geometries]).T + \
+        np.array([[-SNAP_DEGREES], [-SNAP_DEGREES], [SNAP_DEGREES], [SNAP_DEGREES]])
+
+    order = np.argsort(west, kind='stable')
+    ends = np.searchsorted(west[order], east[order], side='right')
+    rows, cols = [], []
+    for at, (i, end) in enumerate(zip(order, ends)):
+        j = order[at + 1:end]
+        j = j[(south[j] <= north[i]) & (north[j] >= south[i])]
+        if len(j):
+            grown = prep(geometries[i].buffer(SNAP_DEGREES, 2))
+            j = j[[grown.intersects(geometries[c]) for c in j]]
+            rows.append(np.full(len(j), i))
+            cols.append(j)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    graph = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(features), len(features)))
+    return fips, ((graph + graph.T) > 0).astype('float64')
+
+
+class HotspotIndex:
+    """County adjacency of one NRI dataset, with cached local statistics per column."""
+
+    def __init__(self, NRI, counties, graph):
+        graph_fips, graph = graph
+        pos = pd.Series(np.arange(len(graph_fips)), index=graph_fips)
+        self.NRI = NRI.reset_index(drop=True)
+        self.fips = self.NRI['FIPS'].to_numpy()
+        self.states = self.NRI['STATEABBRV'].astype(str).to_numpy()
+
+        #counties of the dataset, and their links to each other; counties without geometry are islands
+        at = pos.reindex(self.fips).to_numpy()
+        mapped = np.flatnonzero(~np.isnan(at))
+        select = sparse.csr_matrix((np.ones(len(mapped)), (mapped, at[mapped].astype('int64'))),
+                                   shape=(len(self.fips), len(graph_fips)))
+        self.W = (select @ graph @ select.T).tocsr()
+        self.degree = np.asarray(self.W.sum(axis=1)).ravel()
+
+        #marker position of every county
+        features = {int(f['id']): f for f in counties['features'] if f.get('geometry')}
+        points = [shape(features[f]['geometry']).representative_point() if f in features else None
+                  for f in self.fips]
+        self.lat = np.array([p.y if p is not None else np.nan for p in points])
+        self.lon = np.array([p.x if p is not None else np.nan for p in points])
+
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _statistics(self, column, permutations, seed):
+        x = self.NRI[column].to_numpy(dtype='float64')
+        valid = np.isfinite(x)
+        x = np.where(valid, x, np.nanmean(x))
+        n = len(x)
+        z = (x - x.mean()) / (x.std() or 1.0)
+        k = self.degree
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lag = (self.W @ z) / k
+            moran = z * lag
+
+            #Gi* over the county and its neighbors, binary weights including self
+            w = k + 1
+            local = x + self.W @ x
+            s = x.std(ddof=0)
+            gi = (local - x.mean() * w) / (s * np.sqrt((n * w - w ** 2) / (n - 1)))
+
+        #pseudo p-values: shuffled neighbor sums at least as extreme as the observed one
+        rng = np.random.default_rng(seed)
+        observed = self.W @ z
+        larger = np.zeros(n)
+        for start in range(0, permutations, BATCH):
+            size = min(BATCH, permutations - start)
+            shuffled = z[np.argsort(rng.random((size, n)), axis=1)].T
+            larger += ((self.W @ shuffled) >= observed[:, None]).sum(axis=1)
+        larger = np.minimum(larger, permutations - larger)
+        p_sim = (larger + 1) / (permutations + 1)
+
+        island = (k == 0) | ~valid
+        significant = (p_sim < ALPHA) & ~island
+        labels = np.full(n, NOT_SIGNIFICANT, dtype=object)
+        for (high, high_lag), label in CLUSTERS.items():
+            labels[significant & ((z > 0) == high) & ((lag > 0) == high_lag)] = label
+
+        return pd.DataFrame({'FIPS': self.fips, 'STATEABBRV': self.states,
+                             'COUNTY': self.NRI['COUNTY'].to_numpy(),
+                             'moran_i': np.where(island, np.nan, moran),
+                             'gi_z': np.where(island, np.nan, gi),
+                             'gi_p': np.where(island, np.nan, 2 * stats.norm.sf(np.abs(gi))),
+                             'p_sim': np.where(island, np.nan, p_sim),
+                             'cluster': labels,
+                             'lat': self.lat, 'lon': self.lon})
+
+    def statistics(self, column, permutations=PERMUTATIONS, seed=0):
+        """Local Moran's I, Gi* z-score and p-values and cluster label of every county for one column."""
+        key = (column, permutations, seed)
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        result = self._statistics(column, permutations, seed)
+        with self._lock:
+            return self._results.setdefault(key, result)
+
+    def overlay(self, column, state):
+        """Significant counties of one state and their neighbors across its borders, for a map layer."""
+        result = self.statistics(column)
+        in_state = self.states == state
+        #the state's counties plus every county adjacent to one of them
+        near = in_state | (np.asarray(self.W[in_state].sum(axis=0)).ravel() > 0)
+        return result[near & (result['cluster'] != NOT_SIGNIFICANT).to_numpy()]
+
+
+_graphs = digest_memo()
+_indexes = digest_memo()
+
+
+def load_adjacency(source=None):
+    """(FIPS, adjacency) of a county GeoJSON source, built once per content hash."""
+    source = source or COUNTY_GEOJSON_PATH
+    counties = load_counties(source)
+    return _graphs.get(source_digest(source), lambda: adjacency(counties))
+
+
+def load_hotspots(source=None, geojson=None):
+    """Hotspot index of an NRI source on a county GeoJSON source, built once per version pair."""
+    geojson = geojson or COUNTY_GEOJSON_PATH
+    graph = load_adjacency(geojson)
+    NRI, counties = load_nri(source), load_counties(geojson)
+    return _indexes.get((source_digest(source), source_digest(geojson)), lambda: HotspotIndex(NRI, counties, graph))
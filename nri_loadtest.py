@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrent-session load test of the dashboard.
+
+    python nri_loadtest.py [--sessions 1 2 4 8 16] [--interactions 20] [--think 0] [--json]
+    python nri_loadtest.py --server localhost:8501 --pid 1234
+
+Starts the app with streamlit run on a free local port (or attaches to a
+running server), then for each concurrency level opens N sessions on the
+same websocket protocol the browser uses. Each session loads the page and
+then makes random widget interactions: state selectbox changes, peril
+switches and drags of the Map_Range3/4/5/6 sliders, one rerun each, waiting
+for the rerun to finish before the next one.
+
+Per level it reports reruns per second, p50/p95/p99 rerun latency (from
+sending the widget change to the script finishing), the first page load
+latency, script exceptions and the server's peak RSS. Compare runs across
+commits to measure capacity changes.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import psutil
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'NRI_State_Viz.py')
+
+#widgets driven by the sessions, by (label, occurrence of the label on the page)
+SELECTBOXES = {'State_Name1': ('Select State to View', 0),
+               'State_Name2': ('Select State', 0),
+               'variable1': ('Peril to View', 0)}
+SLIDERS = {'Map_Range3': ('Edit Map Range (Map range values are in Dollars)', 0),
+           'Map_Range4': ('Edit Y-Axis', 0),
+           'Map_Range5': ('Edit X-Axis, Expected Loss', 0),
+           'Map_Range6': ('Edit X-Axis, Expected Loss', 1)}
+
+#interaction kinds and the widgets each one picks from
+INTERACTIONS = {'state': ['State_Name1', 'State_Name2'],
+                'peril': ['variable1'],
+                'slider': list(SLIDERS)}
+
+#seconds to wait for the server to come up, and for one rerun
+STARTUP_TIMEOUT = 60
+RERUN_TIMEOUT = 120
+
+#server RSS sampling interval in seconds
+RSS_INTERVAL = 0.05
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    """streamlit run of the dashboard on a local port, returned once it answers its health check."""
+    server = subprocess.Popen([sys.executable, '-m', 'streamlit', 'run', APP_PATH, '--server.headless', 'true',
+                               '--server.port', str(port), '--browser.gatherUsageStats', 'false'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('streamlit exited with code %d' % server.returncode)
+        try:
+            with urllib.request.urlopen('http://localhost:%d/healthz' % port, timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.25)
+    server.terminate()
+    raise RuntimeError('streamlit did not answer on port %d within %d s' % (port, STARTUP_TIMEOUT))
+
+
+class RSSSampler:
+    """Peak resident memory of a process and its children, sampled on a thread."""
+
+    def __init__(self, pid):
+        self.process = psutil.Process(pid) if pid else None
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def rss(self):
+        processes = [self.process] + self.process.children(recursive=True)
+        total = 0
+        for p in processes:
+            try:
+                total += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            self._stop.wait(RSS_INTERVAL)
+
+    def __enter__(self):
+        if self.process is not None:
+            self.peak = self.rss()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+
+
+class Session:
+    """One simulated browser session: a websocket, its current widgets and the values it has set."""
+
+    def __init__(self, url, rng):
+        self.url = url
+        self.rng = rng
+        self.ws = None
+        self.widgets = {}
+        self.values = {}
+        self.exceptions = 0
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, max_message_size=512 * 2 ** 20)
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    async def rerun(self):
+        """Sends the widget values, returns the seconds until the script finishes."""
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.widget_states.widgets.extend(self.values.values())
+        start = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        elements = []
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), RERUN_TIMEOUT)
+            if raw is None:
+                raise ConnectionError('server closed the session')
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                elements.append(forward.delta.new_element)
+            elif kind == 'script_finished':
+                elapsed = time.perf_counter() - start
+                break
+        self._update(elements)
+        return elapsed
+
+    def _update(self, elements):
+        #widget ids hash their arguments, so a slider whose max follows the state gets a new id;
+        #values of widgets no longer on the page are dropped as the browser would
+        seen = {}
+        widgets = {}
+        for element in elements:
+            kind = element.WhichOneof('type')
+            if kind == 'exception':
+                self.exceptions += 1
+            if kind not in ('selectbox', 'slider'):
+                continue
+            widget = getattr(element, kind)
+            occurrence = seen.get(widget.label, 0)
+            seen[widget.label] = occurrence + 1
+            table = SELECTBOXES if kind == 'selectbox' else SLIDERS
+            for name, (label, at) in table.items():
+                if (label, at) == (widget.label, occurrence):
+                    widgets[name] = widget
+        ids = {w.id for w in widgets.values()}
+        self.values = {i: v for i, v in self.values.items() if i in ids}
+        self.widgets = widgets
+
+    def interact(self):
+        """Sets one random widget to a new value, returns the interaction kind or None when none is on the page."""
+        kinds = [k for k, names in INTERACTIONS.items() if any(n in self.widgets for n in names)]
+        if not kinds:
+            return None
+        kind = self.rng.choice(kinds)
+        widget = self.widgets[self.rng.choice([n for n in INTERACTIONS[kind] if n in self.widgets])]
+        state = WidgetState(id=widget.id)
+        if kind == 'slider':
+            #a drag ends on a step of the slider's range
+            steps = int(round((widget.max - widget.min) / widget.step)) if widget.step else 0
+            state.double_array_value.data.append(widget.min + self.rng.randint(0, steps) * widget.step)
+        else:
+            state.int_value = self.rng.randrange(len(widget.options))
+        self.values[widget.id] = state
+        return kind
+
+
+async def run_session(url, interactions, think, seed, loads, latencies):
+    session = Session(url, random.Random(seed))
+    try:
+        await session.connect()
+        loads.append(await session.rerun())
+        for _ in range(interactions):
+            if session.interact() is None:
+                break
+            latencies.append(await session.rerun())
+            if think:
+                await asyncio.sleep(session.rng.uniform(0, 2 * think))
+    finally:
+        session.close()
+    return session.exceptions
+
+
+async def run_level(url, sessions, interactions, think, seed):
+    loads, latencies = [], []
+    start = time.perf_counter()
+    exceptions = await asyncio.gather(*[run_session(url, interactions, think, seed + i, loads, latencies)
+                                        for i in range(sessions)])
+    return time.perf_counter() - start, loads, latencies, sum(exceptions)
+
+
+def load_level(url, pid, sessions, interactions, think, seed):
+    """Result dict of one concurrency level."""
+    with RSSSampler(pid) as sampler:
+        wall, loads, latencies, exceptions = asyncio.run(run_level(url, sessions, interactions, think, seed))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3 if latencies else (np.nan,) * 3
+    return {'sessions': sessions, 'reruns': len(latencies), 'seconds': wall,
+            'reruns_per_s': len(latencies) / wall, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'load_p50_ms': float(np.median(loads)) * 1e3 if loads else np.nan,
+            'exceptions': exceptions, 'peak_rss_mb': sampler.peak / 2 ** 20 if pid else None}
+
+
+HEADER = '%8s %7s %9s %9s %9s %9s %10s %6s %10s' % ('sessions', 'reruns', 'reruns/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                    'load ms', 'errors', 'peak MB')
+
+
+def row(r):
+    """Table line of one level's result."""
+    return '%8d %7d %9.1f %9.0f %9.0f %9.0f %10.0f %6d %10s' % (
+        r['sessions'], r['reruns'], r['reruns_per_s'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['load_p50_ms'],
+        r['exceptions'], '' if r['peak_rss_mb'] is None else '%.0f' % r['peak_rss_mb'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive the dashboard from concurrent simulated sessions.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='concurrency levels')
+    parser.add_argument('--interactions', type=int, default=20, help='widget changes per session')
+    parser.add_argument('--think', type=float, default=0.0, help='mean seconds between a session\'s interactions')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the interaction choices')
+    parser.add_argument('--server', help='host:port of a running dashboard (default: start one locally)')
+    parser.add_argument('--pid', type=int, help='process id of the running dashboard, for its RSS')
+    parser.add_argument('--json', action='store_true', help='print results as json for comparing runs')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.server:
+        address, pid = args.server, args.pid
+    else:
+        port = free_port()
+        server = start_server(port)
+        address, pid = 'localhost:%d' % port, server.pid
+    url = 'ws://%s/stream' % address
+
+    results = []
+    try:
+        #one session first so the data loads and caches are warm before the first level is timed
+        asyncio.run(run_level(url, 1, 0, 0.0, args.seed))
+        if not args.json:
+            print(HEADER)
+        for sessions in args.sessions:
+            results.append(load_level(url, pid, sessions, args.interactions, args.think, args.seed))
+            if not args.json:
+                print(row(results[-1]), flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+
+
+if __name__ == '__main__':
+    main()
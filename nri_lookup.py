@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Point lookup from coordinates to the county risk profile.
+
+County polygons from the county GeoJSON go into a Shapely STRtree once per
+geometry version. A batch of points (a whole portfolio of property
+coordinates) is located in one pass: with shapely 2 a single bulk tree
+query with an intersects predicate, with shapely 1.8 (no bulk query) one
+vectorized point-in-polygon test per county over the points inside its
+bounding box. The located FIPS codes are then joined to the NRI rows.
+"""
+
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+try:
+    from shapely import points as _points
+except ImportError:  #shapely < 2
+    _points = None
+    from shapely.vectorized import contains as contains_xy
+
+from nri_cube import PERIL_NAMES
+from nri_data import COUNTY_GEOJSON_PATH, PERIL_CODES, digest_memo, load_counties, load_nri, source_digest
+
+
+#accepted names of the coordinate columns of an uploaded portfolio, lower case
+LATITUDE_COLUMNS = ('latitude', 'lat', 'y')
+LONGITUDE_COLUMNS = ('longitude', 'lon', 'lng', 'long', 'x')
+
+#county columns added to each located point
+PROFILE_COLUMNS = ['FIPS', 'COUNTY', 'STATEABBRV', 'RISK_SCORE', 'SOVI_SCORE', 'RESL_SCORE', 'EAL_VALT']
+
+#located points with no county get this FIPS
+NO_COUNTY = -1
+
+
+class CountyLocator:
+    """STRtree of county polygons, locating points to county FIPS."""
+
+    def __init__(self, counties, digest=''):
+        self.digest = digest
+        features = [f for f in counties['features'] if f.get('geometry')]
+        self.geometries = [shape(f['geometry']) for f in features]
+        self.fips = np.array([int(f['id']) for f in features], dtype='int64')
+        #shapely 1.8 trees can only be queried one geometry at a time, the per-county path does without
+        self.tree = STRtree(self.geometries) if _points is not None else None
+        self._bounds = np.array([g.bounds for g in self.geometries])
+
+    def _bulk(self, lon, lat):
+        #shapely 2: (point, county) index pairs of every intersection in one query
+        point_idx, county_idx = self.tree.query(_points(lon, lat), predicate='intersects')
+        out = np.full(len(lon), NO_COUNTY, dtype='int64')
+        #a point on a shared boundary matches both counties, keep the first
+        first = np.unique(point_idx, return_index=True)[1]
+        out[point_idx[first]] = self.fips[county_idx[first]]
+        return out
+
+    def _per_county(self, lon, lat):
+        #shapely 1.8: each county tests only the points inside its bounding box, points sorted by lon
+        out = np.full(len(lon), NO_COUNTY, dtype='int64')
+        order = np.argsort(lon, kind='stable')
+        xs = lon[order]
+        for geom, fips, (minx, miny, maxx, maxy) in zip(self.geometries, self.fips, self._bounds):
+            lo, hi = np.searchsorted(xs, minx), np.searchsorted(xs, maxx, side='right')
+            if hi == lo:
+                continue
+            idx = order[lo:hi]
+            idx = idx[(lat[idx] >= miny) & (lat[idx] <= maxy) & (out[idx] == NO_COUNTY)]
+            if len(idx):
+                out[idx[contains_xy(geom, lon[idx], lat[idx])]] = fips
+        return out
+
+    def locate(self, lat, lon):
+        """County FIPS of each (lat, lon) point, NO_COUNTY where no county contains it."""
+        lat = np.atleast_1d(np.asarray(lat, dtype='float64'))
+        lon = np.atleast_1d(np.asarray(lon, dtype='float64'))
+        #counties crossing the antimeridian are stored with longitudes past 180, locate in -180..180
+        lon = np.mod(lon + 180.0, 360.0) - 180.0
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        out = np.full(len(lat), NO_COUNTY, dtype='int64')
+        if valid.any():
+            locate = self._bulk if _points is not None else self._per_county
+            out[valid] = locate(lon[valid], lat[valid])
+        return out
+
+
+class RiskProfiles:
+    """County NRI rows keyed by FIPS, joined to located points."""
+
+    def __init__(self, NRI, locator):
+        self.locator = locator
+        self.table = NRI.set_index('FIPS', drop=False)
+        losses = NRI[[p + '_EALT' for p in PERIL_CODES]].fillna(0).to_numpy(dtype='float64')
+        #leading peril of every county, for the batch table
+        self.top_peril = pd.Series(np.array([PERIL_NAMES[p] for p in PERIL_CODES])[losses.argmax(axis=1)],
+                                   index=self.table.index)
+
+    def profile(self, lat, lon):
+        """(county row, peril loss Series by display name) of one point, or None outside every county."""
+        fips = int(self.locator.locate(lat, lon)[0])
+        if fips not in self.table.index:
+            return None
+        row = self.table.loc[fips]
+        perils = pd.Series({PERIL_NAMES[p]: row[p + '_EALT'] for p in PERIL_CODES}, dtype='float64').fillna(0)
+        return row, perils.sort_values(ascending=False)
+
+    def batch(self, points):
+        """A points frame with its county's risk profile appended, located in one pass.
+
+        Coordinate columns are found by name (LATITUDE_COLUMNS, LONGITUDE_COLUMNS,
+        any case); points outside the mapped counties get empty profile columns.
+        """
+        lat, lon = coordinate_columns(points)
+        fips = self.locator.locate(points[lat].to_numpy(), points[lon].to_numpy())
+        found = self.table.reindex(fips)
+        profile = found[[c for c in PROFILE_COLUMNS if c in found.columns]].copy()
+        #missing unless an NRI row matched, a polygon without a row is not a located property
+        profile['FIPS'] = found['FIPS'].astype('Int64')
+        profile['TOP_PERIL'] = self.top_peril.reindex(fips).to_numpy()
+        profile.index = points.index
+        return pd.concat([points, profile.add_prefix('NRI_')], axis=1)
+
+
+def coordinate_columns(points):
+    """(latitude, longitude) column names of a points frame."""
+    names = {str(c).strip().lower(): c for c in points.columns}
+    lat = next((names[c] for c in LATITUDE_COLUMNS if c in names), None)
+    lon = next((names[c] for c in LONGITUDE_COLUMNS if c in names), None)
+    if lat is None or lon is None:
+        raise ValueError('points need latitude and longitude columns, found %s' % ', '.join(map(str, points.columns)))
+    return lat, lon
+
+
+_locators = digest_memo()
+_profiles = digest_memo()
+
+
+def load_locator(source=None):
+    """County locator of a county GeoJSON source, built once per content hash."""
+    source = source or COUNTY_GEOJSON_PATH
+    counties = load_counties(source)
+    digest = source_digest(source)
+    return _locators.get(digest, lambda: CountyLocator(counties, digest))
+
+
+def load_profiles(source=None, geojson=None):
+    """Risk profiles of an NRI source located with a county GeoJSON source, built once per version pair."""
+    locator = load_locator(geojson)
+    NRI = load_nri(source)
+    return _profiles.get((source_digest(source), locator.digest), lambda: RiskProfiles(NRI, locator))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streamlit chart component sending county geometry once per session.
+
+st.plotly_chart serializes the full figure, polygons included, on every
+rerun and for every map. map_chart splits a choropleth figure into
+  - the state's geometry, sent once per browser session and shared by every
+    map on the page,
+  - the static figure spec (layout, locations, hover), sent once per session
+    while it stays unchanged,
+  - the color vector and color range, sent on every rerun with the colors as
+    raw float32 bytes instead of JSON floats.
+
+figure_chart renders any other plotly figure through the same component: its
+spec is sent once per session and later reruns only send its token, so a
+chart whose inputs did not change costs nothing to re-emit.
+
+The frontend loads plotly.js from mapview_frontend/plotly.min.js, copied
+from the plotly package by python nri_build.py (build_frontend). Without
+that copy it loads the same plotly.js version from the plotly CDN.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import weakref
+
+import numpy as np
+import plotly
+import streamlit as st
+import streamlit.components.v1 as components
+
+import nri_metrics
+
+
+#frontend served by streamlit; build_frontend copies plotly.js in from the plotly package so maps work offline
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mapview_frontend')
+PLOTLY_JS = os.path.join(FRONTEND_DIR, 'plotly.min.js')
+
+#plotly.js version the plotly package ships, loaded from the CDN when there is no local copy
+PLOTLY_JS_VERSION = plotly.offline.get_plotlyjs_version()
+
+
+def build_frontend():
+    """Writes the plotly package's plotly.min.js into the component frontend and returns its path."""
+    with open(PLOTLY_JS, 'w', encoding='utf-8') as fh:
+        fh.write(plotly.offline.get_plotlyjs())
+    return PLOTLY_JS
+
+
+_component = components.declare_component('nri_mapview', path=FRONTEND_DIR)
+
+#session state keys: tokens already sent to this browser session, and handled resend requests
+SENT_KEY = '_nri_mapview_sent'
+HANDLED_KEY = '_nri_mapview_handled'
+
+#plotly's default figure height, used when the figure does not set one
+DEFAULT_HEIGHT = 450
+
+
+def _encode(obj):
+    return json.dumps(obj, cls=plotly.utils.PlotlyJSONEncoder, separators=(',', ':')).encode()
+
+
+def split_figure(fig):
+    """Splits a choropleth mapbox figure into (static spec, color vectors, color range).
+
+    The spec has the geometry, color vectors and color range removed; color
+    vectors are keyed by trace position.
+    """
+    spec = fig.to_dict()
+    colors = {}
+    for i, trace in enumerate(spec['data']):
+        if trace.get('type') == 'choroplethmapbox':
+            trace.pop('geojson', None)
+            colors[i] = np.asarray(trace.pop('z'), dtype='<f4')
+    coloraxis = spec['layout'].get('coloraxis', {})
+    color_range = [coloraxis.pop('cmin', None), coloraxis.pop('cmax', None)]
+    return spec, colors, color_range
+
+
+#encodings of figures still alive (e.g. held by the figure cache), so cache hits skip re-encoding;
+#figures are unhashable, so entries are keyed by id and dropped when the figure is collected
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _memoized(fig, kind, encode):
+    key = (id(fig), kind)
+    with _encodings_lock:
+        if key in _encodings:
+            return _encodings[key]
+    encoded = encode(fig)
+    with _encodings_lock:
+        if key not in _encodings:
+            _encodings[key] = encoded
+            weakref.finalize(fig, _encodings.pop, key, None)
+    return encoded
+
+
+def _encode_split(fig):
+    spec, colors, color_range = split_figure(fig)
+    spec_json = _encode(spec)
+    return (spec_json, hashlib.sha1(spec_json).hexdigest()[:16], spec['layout'].get('height'),
+            {i: z.tobytes() for i, z in colors.items()}, color_range)
+
+
+def _encode_whole(fig):
+    spec = fig.to_dict()
+    spec_json = _encode(spec)
+    return spec_json, hashlib.sha1(spec_json).hexdigest()[:16], spec['layout'].get('height')
+
+
+def _send(key, args, tokens):
+    sent = st.session_state.setdefault(SENT_KEY, set())
+    for token, (name, payload) in tokens.items():
+        if token not in sent:
+            args[name] = payload() if callable(payload) else payload
+
+    if nri_metrics.ENABLED:
+        #bytes args travel as raw buffers, the rest as json
+        raw = {k: v for k, v in args.items() if isinstance(v, bytes)}
+        rest = {k: v for k, v in args.items() if k not in raw}
+        nri_metrics.record_payload(key, sum(map(len, raw.values())) + len(_encode(rest)))
+
+    value = _component(key=key, default=None, plotly_version=PLOTLY_JS_VERSION, **args)
+    sent.update(tokens)
+
+    #the page lost a shared copy (e.g. the frame was remounted), forget it and resend on a fresh run
+    if isinstance(value, dict) and value.get('missing'):
+        handled = st.session_state.setdefault(HANDLED_KEY, set())
+        if (key, value.get('nonce')) not in handled:
+            handled.add((key, value.get('nonce')))
+            sent.discard(value['missing'])
+            st.experimental_rerun()
+
+
+def map_chart(fig, geometry, state_fips, zoom, key):
+    """Renders a choropleth mapbox figure of one state through the component.
+
+    `geometry` is the nri_geo store the figure's geojson came from; the figure's
+    own geojson copy is never serialized.
+    """
+    spec_json, spec_token, height, colors, color_range = _memoized(fig, 'split', _encode_split)
+    geometry_token = geometry.token(state_fips, zoom)
+
+    args = {'spec': spec_token,
+            'geometry': geometry_token,
+            'range': color_range,
+            'height': height or DEFAULT_HEIGHT}
+    for i, z in colors.items():
+        args['z%d' % i] = z
+    _send(key, args, {spec_token: ('spec_json', spec_json),
+                      geometry_token: ('geometry_json', lambda: geometry.encoded(state_fips, zoom))})
+
+
+def figure_chart(fig, key):
+    """Renders any plotly figure through the component, sending its spec once per session."""
+    spec_json, spec_token, height = _memoized(fig, 'whole', _encode_whole)
+    _send(key, {'spec': spec_token, 'height': height or DEFAULT_HEIGHT},
+          {spec_token: ('spec_json', spec_json)})
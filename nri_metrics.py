@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in per-rerun instrumentation of the NRI dashboard.
+
+Records the wall time of every rerun, section and compute stage (data
+loads, section steps, figure builders) and the bytes each chart sends to
+the browser. Off unless NRI_METRICS is set to a comma separated list of
+  - log:        one JSON line per rerun on stderr (logger 'nri.metrics'),
+  - prometheus: histograms served on NRI_METRICS_PORT (default 9464), for
+                p50/p99 by section with histogram_quantile.
+
+When off, timed() and instrument() are no-ops and cost nothing per rerun.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import Histogram, start_http_server
+
+
+MODES = {m.strip() for m in os.environ.get('NRI_METRICS', '').lower().split(',') if m.strip()}
+ENABLED = bool(MODES)
+
+#port of the prometheus text endpoint
+METRICS_PORT = int(os.environ.get('NRI_METRICS_PORT', 9464))
+
+logger = logging.getLogger('nri.metrics')
+
+#latency buckets in seconds and payload buckets in bytes (1 kB to 64 MB)
+SECONDS_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = tuple(2 ** p for p in range(10, 27, 2))
+
+RERUN_SECONDS = Histogram('nri_rerun_seconds', 'Wall time of a dashboard rerun', ['outcome'],
+                          buckets=SECONDS_BUCKETS)
+SECTION_SECONDS = Histogram('nri_section_seconds', 'Wall time of a dashboard section per rerun', ['section'],
+                            buckets=SECONDS_BUCKETS)
+STAGE_SECONDS = Histogram('nri_stage_seconds', 'Wall time of a compute stage call', ['stage'],
+                          buckets=SECONDS_BUCKETS)
+PAYLOAD_BYTES = Histogram('nri_payload_bytes', 'Bytes a chart sends to the browser per rerun', ['chart'],
+                          buckets=BYTES_BUCKETS)
+
+_lock = threading.Lock()
+_server_started = False
+
+#streamlit runs each session's script in its own thread, so the rerun being recorded is per thread
+_current = threading.local()
+
+
+def _start():
+    global _server_started
+    if 'log' in MODES and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    if 'prometheus' in MODES:
+        with _lock:
+            if not _server_started:
+                start_http_server(METRICS_PORT)
+                _server_started = True
+
+
+def _record():
+    return getattr(_current, 'record', None)
+
+
+@contextmanager
+def rerun():
+    """Records one script run, emitting its timings once it finishes or is interrupted."""
+    if not ENABLED:
+        yield
+        return
+    _start()
+    record = _current.record = {'sections': {}, 'stages': {}, 'payload_bytes': {}}
+    outcome = 'error'
+    start = time.perf_counter()
+    try:
+        yield
+        outcome = 'ok'
+    except BaseException as err:
+        #st.experimental_rerun and widget changes stop the script with control flow exceptions
+        if type(err).__name__ in ('RerunException', 'StopException'):
+            outcome = 'interrupted'
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _current.record = None
+        RERUN_SECONDS.labels(outcome).observe(seconds)
+        if 'log' in MODES:
+            record['payload_total'] = sum(record['payload_bytes'].values())
+            logger.info(json.dumps(dict(event='rerun', outcome=outcome, seconds=round(seconds, 6), **record)))
+
+
+@contextmanager
+def _timed(name, kind):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        (SECTION_SECONDS if kind == 'section' else STAGE_SECONDS).labels(name).observe(seconds)
+        record = _record()
+        if record is not None:
+            if kind == 'section':
+                record['sections'][name] = round(seconds, 6)
+            else:
+                #a stage may run several times per rerun, keep (total seconds, calls)
+                total, calls = record['stages'].get(name, (0.0, 0))
+                record['stages'][name] = (round(total + seconds, 6), calls + 1)
+
+
+def timed(name, kind='stage'):
+    """Context manager timing a stage (or, with kind='section', a page section)."""
+    return _timed(name, kind) if ENABLED else nullcontext()
+
+
+def instrument(func=None, name=None, kind='stage'):
+    """Decorator timing every call of `func` under `name` (its __name__ by default)."""
+    if func is None:
+        return functools.partial(instrument, name=name, kind=kind)
+    if not ENABLED:
+        return func
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _timed(name, kind):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def record_payload(chart, nbytes):
+    """Counts bytes a chart sent to the browser in the current rerun."""
+    if not ENABLED:
+        return
+    PAYLOAD_BYTES.labels(chart).observe(nbytes)
+    record = _record()
+    if record is not None:
+        record['payload_bytes'][chart] = record['payload_bytes'].get(chart, 0) + nbytes
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Top-k county rankings across perils, loss types and score columns.
+
+Every rankable column (per-peril loss of each loss type, the all-peril
+totals and the scores) is one column of a county x column matrix. Each
+column's counties are sorted once, descending, grouped by state, so the
+top k counties of any column in any state (or nationally) are a slice of
+that order, and a percentile band is a slice between two positions.
+Queries do no sorting or scanning; the index is built once per dataset
+version.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+from nri_cube import NATIONAL, PERIL_BY_NAME, PERIL_SUFFIXES, TOTAL_COLUMNS
+from nri_data import PERIL_CODES, digest_memo, load_nri, source_digest
+
+
+#score columns ranked alongside the losses
+SCORE_COLUMNS = ['RISK_SCORE', 'SOVI_SCORE', 'RESL_SCORE', 'BUILDVALUE', 'POPULATION', 'AGRIVALUE']
+
+#counties returned by default
+TOP_K = 20
+
+
+def rank_column(peril=None, loss_type='total'):
+    """Ranked column of a peril (code, display name, or None for all perils) and loss type."""
+    if peril is None:
+        return TOTAL_COLUMNS[loss_type]
+    return PERIL_BY_NAME.get(peril, peril) + '_' + PERIL_SUFFIXES[loss_type]
+
+
+class RankIndex:
+    """Per-column descending county orders, grouped by state."""
+
+    def __init__(self, NRI):
+        self.columns = [c for c in ([p + '_' + s for p in PERIL_CODES for s in PERIL_SUFFIXES.values()] +
+                                    list(TOTAL_COLUMNS.values()) + SCORE_COLUMNS) if c in NRI.columns]
+        self._column_pos = {c: j for j, c in enumerate(self.columns)}
+        self.states, state_index = np.unique(NRI['STATEABBRV'].astype(str).to_numpy(), return_inverse=True)
+        self._state_pos = {s: i for i, s in enumerate(self.states)}
+        self.fips = NRI['FIPS'].to_numpy()
+        self.county = NRI['COUNTY'].astype(str).to_numpy()
+        self.state = self.states[state_index]
+
+        values = NRI[self.columns].to_numpy(dtype='float64')
+        valid = np.isfinite(values)
+        self.values = values
+
+        #national order: descending value, missing last
+        self.national = np.argsort(np.where(valid, -values, np.inf), axis=0, kind='stable').astype('int32')
+        #state order: the national order stably regrouped by state, so each state's block stays descending
+        regroup = np.argsort(state_index[self.national], axis=0, kind='stable')
+        self.by_state = np.take_along_axis(self.national, regroup, axis=0)
+
+        #block of each state in by_state, and the valid (ranked) counties at the head of each block
+        self.starts = np.concatenate([[0], np.cumsum(np.bincount(state_index, minlength=len(self.states)))])
+        self.valid_national = valid.sum(axis=0)
+        self.valid_state = np.stack([np.bincount(state_index, weights=valid[:, j], minlength=len(self.states))
+                                     for j in range(len(self.columns))], axis=1).astype('int64')
+
+    def loss_types(self, peril=None):
+        """Loss types with a ranked column for a peril (None for all perils), some perils have no building loss etc."""
+        return [l for l in PERIL_SUFFIXES if rank_column(peril, l) in self._column_pos]
+
+    def _order(self, column, state):
+        #(ranked rows, descending) of a column in one state or nationally
+        j = self._column_pos.get(column)
+        if j is None:
+            raise ValueError('%s is not a ranked column of this dataset' % column)
+        if state is None or state == NATIONAL:
+            return self.national[:self.valid_national[j], j], j
+        g = self._state_pos.get(state)
+        if g is None:
+            return self.national[:0, j], j
+        start = self.starts[g]
+        return self.by_state[start:start + self.valid_state[g, j], j], j
+
+    def _frame(self, rows, ranks, total, j, column):
+        #percentile: share of ranked counties with a lower value
+        return pd.DataFrame({'rank': ranks + 1, 'FIPS': self.fips[rows], 'COUNTY': self.county[rows],
+                             'STATEABBRV': self.state[rows], column: self.values[rows, j],
+                             'percentile': 100.0 * (total - 1 - ranks) / max(total - 1, 1)})
+
+    def top(self, column, k=TOP_K, state=None, ascending=False):
+        """The k highest (or lowest) counties of a column, in one state or nationally."""
+        rows, j = self._order(column, state)
+        total = len(rows)
+        ranks = np.arange(total)[::-1][:k] if ascending else np.arange(min(k, total))
+        return self._frame(rows[ranks], ranks, total, j, column)
+
+    def band(self, column, lo, hi, state=None):
+        """Counties whose percentile in the column lies in [lo, hi], highest first."""
+        rows, j = self._order(column, state)
+        total = len(rows)
+        if not total:
+            return self._frame(rows, rows, total, j, column)
+        #percentile p sits at rank (1 - p/100) * (total - 1)
+        first = int(np.ceil((1 - hi / 100.0) * (total - 1) - 1e-9))
+        last = int(np.floor((1 - lo / 100.0) * (total - 1) + 1e-9))
+        ranks = np.arange(max(first, 0), min(last, total - 1) + 1)
+        return self._frame(rows[ranks], ranks, total, j, column)
+
+
+def ranking_table(ranked, column, label):
+    """Display table of a top() or band() result."""
+    return pd.DataFrame({
+        'Rank': ranked['rank'].to_numpy(),
+        'County': ranked['COUNTY'].to_numpy(),
+        'State': ranked['STATEABBRV'].to_numpy(),
+        label: ranked[column].round(2 if column.endswith('_SCORE') else 0).to_numpy(),
+        'Percentile': ranked['percentile'].round(1).to_numpy(),
+    }).set_index('Rank')
+
+
+_indexes = digest_memo()
+
+
+def load_rankings(source=None):
+    """County ranking index of an NRI source, built once per dataset version."""
+    return _indexes.get(source_digest(source), lambda: RankIndex(load_nri(source)))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server-side rasterized choropleths for census-tract resolution maps.
+
+A state has thousands of tracts, too many polygons for a browser
+choropleth. Each state's tract polygons are instead burned once per zoom
+into a label raster (the tract index owning each pixel, sampled in web
+mercator so it lines up with the basemap). Any variable is then drawn by
+indexing its tract values with the labels, colored and PNG encoded, and
+placed on the map as a single image layer. What the browser receives does
+not depend on how many polygons the state has.
+
+The tract table and tract GeoJSON are not bundled, set NRI_TRACT_DATA_PATH
+and NRI_TRACT_GEOJSON_PATH (see nri_data) to enable the mode.
+"""
+
+import base64
+import io
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+from plotly.colors import sample_colorscale
+from shapely.geometry import shape
+from shapely.ops import transform
+
+try:
+    from shapely import contains_xy
+except ImportError:  #shapely < 2
+    from shapely.vectorized import contains as contains_xy
+
+from nri_data import TRACT_GEOJSON_PATH, digest_memo, load_counties, source_digest
+from nri_geo import TILE_SIZE
+
+
+#rasters are drawn at twice the screen resolution and never wider or taller than this
+OVERSAMPLE = 2
+MAX_SIDE = 2048
+
+#color lookup table entries
+LUT_SIZE = 256
+
+
+def _mercator(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _latitude(y):
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+def tract_id(feature):
+    """11 digit tract FIPS of a feature, from its id or the census GEOID property."""
+    return str(feature.get('id') or feature['properties']['GEOID']).zfill(11)
+
+
+def raster_size(bounds, zoom):
+    """(width, height) in pixels of a raster covering `bounds` at map zoom `zoom`."""
+    west, south, east, north = bounds
+    scale = TILE_SIZE * 2 ** zoom * OVERSAMPLE
+    width = (east - west) * scale / 360.0
+    height = (_mercator(north) - _mercator(south)) * scale / (2 * math.pi)
+    shrink = min(1.0, MAX_SIDE / max(width, height, 1.0))
+    return max(1, int(math.ceil(width * shrink))), max(1, int(math.ceil(height * shrink)))
+
+
+def label_raster(geometries, bounds, width, height):
+    """Index of the geometry covering each pixel center, -1 where there is none.
+
+    Pixels are evenly spaced in longitude and in mercator y. Geometries too
+    small to cover any pixel center still claim the pixel of their
+    representative point, so no tract disappears at low zoom.
+    """
+    west, south, east, north = bounds
+    xs = west + (np.arange(width) + 0.5) * (east - west) / width
+    top, bottom = _mercator(north), _mercator(south)
+    lats = _latitude(top - (np.arange(height) + 0.5) * (top - bottom) / height)
+
+    labels = np.full((height, width), -1, dtype='int32')
+    for i, geom in enumerate(geometries):
+        minx, miny, maxx, maxy = geom.bounds
+        c0, c1 = np.searchsorted(xs, minx), np.searchsorted(xs, maxx, side='right')
+        #latitudes run north to south, so search the negated rows
+        r0, r1 = np.searchsorted(-lats, -maxy), np.searchsorted(-lats, -miny, side='right')
+        if c1 > c0 and r1 > r0:
+            gx, gy = np.meshgrid(xs[c0:c1], lats[r0:r1])
+            inside = contains_xy(geom, gx, gy)
+            if inside.any():
+                labels[r0:r1, c0:c1][inside] = i
+                continue
+        point = geom.representative_point()
+        c = min(max(int((point.x - west) / (east - west) * width), 0), width - 1)
+        r = min(max(int((top - _mercator(point.y)) / (top - bottom) * height), 0), height - 1)
+        labels[r, c] = i
+    return labels
+
+
+def color_lut(colorscale='balance', opacity=0.7):
+    """LUT_SIZE x 4 uint8 RGBA table of a plotly colorscale name."""
+    colors = sample_colorscale(colorscale, np.linspace(0, 1, LUT_SIZE))
+    rgb = np.array([[float(c) for c in color[color.index('(') + 1:-1].split(',')[:3]] for color in colors])
+    alpha = np.full((LUT_SIZE, 1), round(opacity * 255))
+    return np.hstack([rgb, alpha]).round().astype('uint8')
+
+
+def colorize(grid, color_range, lut):
+    """RGBA image of a value grid, NaN pixels transparent."""
+    lo, hi = color_range
+    scaled = (np.nan_to_num(grid, nan=lo) - lo) / ((hi - lo) or 1.0)
+    rgba = lut[np.clip((scaled * (LUT_SIZE - 1)).round(), 0, LUT_SIZE - 1).astype('int32')]
+    rgba[np.isnan(grid)] = 0
+    return rgba
+
+
+def png_data_uri(rgba):
+    """A uint8 RGBA array as a base64 PNG data uri, for a mapbox image layer."""
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+class TractRaster:
+    """Tract polygons partitioned by state FIPS, with label rasters per zoom."""
+
+    def __init__(self, tracts, digest=''):
+        self.digest = digest
+        self._features = defaultdict(list)
+        for feature in tracts['features']:
+            self._features[int(tract_id(feature)[:2])].append(feature)
+        self._rasters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def states(self):
+        return sorted(self._features)
+
+    def _state_raster(self, state_fips, zoom):
+        features = self._features.get(int(state_fips), [])
+        geometries = [shape(f['geometry']) for f in features]
+        ids = np.array([int(tract_id(f)) for f in features], dtype='int64')
+        if not geometries:
+            return ids, (0.0, 0.0, 0.0, 0.0), np.full((1, 1), -1, dtype='int32')
+
+        #states crossing the antimeridian (Alaska) are drawn in 0..360 longitudes
+        minx = min(g.bounds[0] for g in geometries)
+        maxx = max(g.bounds[2] for g in geometries)
+        if maxx - minx > 180:
+            geometries = [transform(lambda x, y: (np.mod(x, 360.0), y), g) for g in geometries]
+
+        bounds = (min(g.bounds[0] for g in geometries), min(g.bounds[1] for g in geometries),
+                  max(g.bounds[2] for g in geometries), max(g.bounds[3] for g in geometries))
+        width, height = raster_size(bounds, zoom)
+        return ids, bounds, label_raster(geometries, bounds, width, height)
+
+    def raster(self, state_fips, zoom):
+        """(tract FIPS per label, (west, south, east, north), label raster) of one state at `zoom`."""
+        key = (int(state_fips), float(zoom))
+        with self._lock:
+            if key not in self._rasters:
+                self._rasters[key] = self._state_raster(*key)
+            return self._rasters[key]
+
+    def image(self, state_fips, zoom, tract_values, color_range, colorscale='balance', opacity=0.7):
+        """PNG data uri and bounds of one state's tracts colored by `tract_values`.
+
+        `tract_values` is a Series indexed by tract FIPS; tracts without a value
+        are left transparent.
+        """
+        ids, bounds, labels = self.raster(state_fips, zoom)
+        values = tract_values.groupby(level=0).first().reindex(ids).to_numpy(dtype='float64')
+        #label -1 picks the trailing NaN
+        grid = np.append(values, np.nan)[labels]
+        return png_data_uri(colorize(grid, color_range, color_lut(colorscale, opacity))), bounds
+
+
+_stores = digest_memo()
+
+
+def load_tract_raster(source=None):
+    """Tract raster store of a tract GeoJSON source, built once per content hash."""
+    source = source or TRACT_GEOJSON_PATH
+    tracts = load_counties(source)
+    digest = source_digest(source)
+    return _stores.get(digest, lambda: TractRaster(tracts, digest))
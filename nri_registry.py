@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registry of dataset releases, for refreshing to a new release incrementally.
+
+    python nri_registry.py OLD.csv NEW.csv      (prints what changed between two releases)
+
+Each release of the NRI table is fingerprinted per state partition: every
+county row is hashed per column together with its FIPS code (STCOFIPS), and
+the row hashes are summed per state, giving a states x columns matrix of
+fingerprints. Comparing two releases' matrices gives the states and columns
+that actually changed (a county added to or dropped from a state changes
+every column of that state).
+
+refresh() is called at the top of every rerun and costs a stat() while the
+data is unchanged. When the source's digest moves on, it diffs the new
+release against the previous one and:
+  - builds the new aggregate cube from the old one, recomputing only the
+    changed states and the national quantiles of the changed columns,
+  - carries figure cache entries and section step results over to the new
+    version, dropping only those whose declared dependencies changed.
+
+Builders and steps declare what they read with @depends: the argument that
+names the state they are scoped to, and the columns they read. Undeclared
+ones are treated as reading every state and column. refresh_geometry() does
+the same for a new county GeoJSON, fingerprinting each state's features
+and carrying the simplified variants of unchanged states over.
+
+Structures over the whole nation (rankings, hotspots, statistics, scenario
+engine, point lookup) are rebuilt on their next use, as before. Once a
+release is superseded, its parsed source and everything memoized for its
+digest are evicted, so memory does not grow with every refresh.
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import nri_sections
+from nri_cube import load_cube, update_cube
+from nri_data import COUNTY_GEOJSON_PATH, NRI_PATH, evict, load_nri, source_digest
+from nri_figcache import figure_cache
+from nri_geo import load_geometry
+
+
+logger = logging.getLogger('nri.registry')
+
+#row key and partition of the fingerprints
+KEY_COLUMN = 'FIPS'
+PARTITION_COLUMN = 'STATEABBRV'
+
+#odd 64 bit multiplier mixing a column hash with its row key (golden ratio)
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def fingerprint(NRI):
+    """uint64 fingerprint of every (state, column) partition of an NRI frame, a states x columns frame."""
+    states, inverse = np.unique(NRI[PARTITION_COLUMN].astype(str).to_numpy(), return_inverse=True)
+    keys = pd.util.hash_array(NRI[KEY_COLUMN].to_numpy())
+    columns = [c for c in NRI.columns if c != PARTITION_COLUMN]
+    sums = np.zeros((len(states), len(columns)), dtype='uint64')
+    for j, column in enumerate(columns):
+        #keyed row hash, so values moving between counties count as changes; sums wrap around
+        mixed = (pd.util.hash_array(NRI[column].to_numpy()) ^ keys) * MIX
+        mixed ^= mixed >> np.uint64(29)
+        np.add.at(sums[:, j], inverse, mixed)
+    return pd.DataFrame(sums, index=pd.Index(states, name=PARTITION_COLUMN), columns=columns)
+
+
+class Change:
+    """States and columns that differ between two releases.
+
+    columns=None means every column (a geometry change, or the first release).
+    """
+
+    def __init__(self, states=(), columns=None):
+        self.states = frozenset(states)
+        self.columns = None if columns is None else frozenset(columns)
+
+    def __bool__(self):
+        return bool(self.states) or bool(self.columns)
+
+    def __repr__(self):
+        columns = 'all' if self.columns is None else sorted(self.columns)
+        return 'Change(states=%s, columns=%s)' % (sorted(self.states), columns)
+
+
+def diff(old, new):
+    """Change between two fingerprint frames; added or dropped states and columns count as changed."""
+    states = old.index.union(new.index)
+    columns = old.columns.union(new.columns)
+    #unequal, or missing on either side; filled with 0 so the uint64 hashes are not cast to float
+    a = old.reindex(index=states, columns=columns, fill_value=0).to_numpy()
+    b = new.reindex(index=states, columns=columns, fill_value=0).to_numpy()
+    present = (states.isin(old.index)[:, None] & columns.isin(old.columns)[None, :] &
+               states.isin(new.index)[:, None] & columns.isin(new.columns)[None, :])
+    changed = (a != b) | ~present
+    return Change(states[changed.any(axis=1)], columns[changed.any(axis=0)])
+
+
+#builder name -> (signature, state argument, columns, arguments that widen it to the nation)
+_dependencies = {}
+
+
+def depends(state=None, columns=None, national=()):
+    """Decorator declaring what a cached figure builder or section step reads.
+
+    state names the argument holding the one state it reads (None: every
+    state), columns the NRI columns it reads (None: all), and national the
+    arguments which, when truthy, make it read every state after all. Apply
+    it under @figure_cache.cached or @section.step.
+    """
+    def declare(func):
+        _dependencies[func.__qualname__] = (inspect.signature(func), state,
+                                            None if columns is None else frozenset(columns), tuple(national))
+        return func
+    return declare
+
+
+def stale(change, key):
+    """True when a figure cache or section key (name, version, args, kwargs) reads something in change."""
+    name, _, args, kwargs = key
+    declared = _dependencies.get(name)
+    if declared is None:
+        return bool(change)
+    signature, state, columns, national = declared
+    if columns is not None and change.columns is not None and not columns & change.columns:
+        return False
+    try:
+        bound = signature.bind(*args, **dict(kwargs))
+    except TypeError:
+        return True
+    bound.apply_defaults()
+    if state is None or any(bound.arguments.get(a) for a in national):
+        return bool(change)
+    return bound.arguments.get(state) in change.states
+
+
+class Release:
+    """One version of a source: its digest, fingerprints and when it was registered."""
+
+    def __init__(self, digest, fingerprints, store=None):
+        self.digest = digest
+        self.fingerprints = fingerprints
+        self.store = store
+        self.loaded = time.time()
+
+
+_lock = threading.Lock()
+#source -> current Release of the NRI table / county GeoJSON
+_releases = {}
+_geometries = {}
+
+
+def refresh(source=None):
+    """Registers the current release of an NRI source, updating derived caches from the previous one.
+
+    Returns the Change from the previous release (empty when nothing changed,
+    None for the first release seen).
+    """
+    source = source or NRI_PATH
+    digest = source_digest(source)
+    with _lock:
+        previous = _releases.get(source)
+        if previous is not None and previous.digest == digest:
+            return Change((), ())
+        release = Release(digest, fingerprint(load_nri(source)))
+        _releases[source] = release
+        if previous is None:
+            return None
+
+        start = time.perf_counter()
+        change = diff(previous.fingerprints, release.fingerprints)
+        update_cube(previous.digest, change.states, change.columns, source)
+
+        def is_stale(key):
+            return stale(change, key)
+
+        figures = figure_cache.migrate(previous.digest, digest, is_stale)
+        steps = nri_sections.migrate(previous.digest, digest, is_stale)
+        evict({previous.digest})
+        logger.info('refreshed %s to %s in %.3f s: %r, figures kept/dropped %s, steps kept/dropped %s',
+                    source, digest[:12], time.perf_counter() - start, change, figures, steps)
+        return change
+
+
+def geometry_fingerprint(geometry):
+    """sha1 of every state's source features in a geometry store, a Series indexed by state FIPS."""
+    return pd.Series({s: hashlib.sha1(json.dumps(geometry.subset(s)['features'], sort_keys=True).encode()).hexdigest()
+                      for s in geometry.states}, dtype=object)
+
+
+def refresh_geometry(source=None, nri_source=None):
+    """Registers the current county GeoJSON, carrying unchanged states' variants and cached results over.
+
+    A geometry store built by nri_build.py --store already holds every
+    variant, so only the cached results are invalidated for it. Returns the
+    Change (states as abbreviations), None for the first version seen.
+    """
+    source = source or COUNTY_GEOJSON_PATH
+    geometry = load_geometry(source)
+    with _lock:
+        previous = _geometries.get(source)
+        if previous is not None and previous.digest == geometry.digest:
+            return Change((), ())
+        #fingerprints need the parsed features, only worth it when there are simplified variants to keep
+        fingerprints = None if geometry.prebuilt else geometry_fingerprint(geometry)
+        _geometries[source] = Release(geometry.digest, fingerprints, geometry)
+        if previous is None:
+            return None
+
+        if previous.fingerprints is None or fingerprints is None:
+            states = set(previous.store.states) | set(geometry.states)
+        else:
+            both = previous.fingerprints.index.intersection(fingerprints.index)
+            same = both[(previous.fingerprints[both] == fingerprints[both]).to_numpy()]
+            states = (set(previous.fingerprints.index) | set(fingerprints.index)) - set(same)
+            geometry.inherit(previous.store, same)
+
+        #cached results key on the NRI version, geometry changes are invalidated in place
+        cube = load_cube(nri_source)
+        change = Change([s for s, f in zip(cube.states, cube.fips) if f in states])
+        figure_cache.invalidate(lambda key: stale(change, key))
+        nri_sections.invalidate(lambda key: stale(change, key))
+        evict({previous.digest})
+        logger.info('refreshed geometry %s to %s: %r', source, geometry.digest[:12], change)
+        return change
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the states and columns that differ between two NRI releases.')
+    parser.add_argument('old', help='previous NRI csv or parquet')
+    parser.add_argument('new', help='new NRI csv or parquet')
+    args = parser.parse_args(argv)
+
+    change = diff(fingerprint(load_nri(args.old)), fingerprint(load_nri(args.new)))
+    print('changed states (%d): %s' % (len(change.states), ' '.join(sorted(change.states))))
+    print('changed columns (%d): %s' % (len(change.columns), ' '.join(sorted(change.columns))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dashboard sections with declared widget dependencies.
+
+Streamlit 1.8 reruns the whole script on every interaction and has no
+partial-rerun API, so a dragged slider at the bottom of the page used to
+recompute everything above it. The dashboard is split into sections, each
+declaring the widgets it depends on. A section's compute steps take only
+those widget values as arguments and are memoized on them (per dataset
+version, shared by all sessions), and its charts are emitted through
+nri_mapview as content tokens. An interaction therefore only recomputes and
+re-sends the sections that depend on the widget that changed; the others
+replay memoized results and unchanged tokens.
+"""
+
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+
+from nri_data import source_digest
+from nri_metrics import instrument
+
+
+#memoized results kept per step
+DEFAULT_MAXSIZE = 128
+
+
+class Section:
+    """A re-executable part of the page and the widgets it depends on."""
+
+    def __init__(self, name, depends_on=(), maxsize=DEFAULT_MAXSIZE):
+        self.name = name
+        self.depends_on = tuple(depends_on)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def step(self, func):
+        """Decorator memoizing a compute step on the widget values it takes.
+
+        Every parameter must be one of the section's declared widgets, so a
+        step cannot silently depend on state outside the section.
+        """
+        undeclared = [p for p in inspect.signature(func).parameters if p not in self.depends_on]
+        if undeclared:
+            raise ValueError('%s step %s depends on undeclared widgets %s'
+                             % (self.name, func.__name__, ', '.join(undeclared)))
+
+        @instrument
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, source_digest(), args, tuple(sorted(kwargs.items())))
+            with self._lock:
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    self.hits += 1
+                    return self._memo[key]
+                self.misses += 1
+            result = func(*args, **kwargs)
+            with self._lock:
+                self._memo[key] = result
+                while len(self._memo) > self.maxsize:
+                    self._memo.popitem(last=False)
+            return result
+        return wrapper
+
+    def render(self, func):
+        """Decorator marking the function that renders the section, timed per rerun."""
+        return instrument(func, name=self.name, kind='section')
+
+    def invalidate(self, predicate=None):
+        """Drops every memoized result, or only the keys for which predicate(key) is true."""
+        with self._lock:
+            for key in [k for k in self._memo if predicate is None or predicate(k)]:
+                del self._memo[key]
+
+    def migrate(self, old_version, new_version, stale):
+        """Carries results of one dataset version over to the next, dropping those stale(key) flags."""
+        kept = dropped = 0
+        with self._lock:
+            for key in [k for k in self._memo if k[1] == old_version]:
+                result = self._memo.pop(key)
+                newkey = (key[0], new_version) + key[2:]
+                #already recomputed for the new version by a session before the refresh
+                if newkey in self._memo or stale(key):
+                    dropped += 1
+                else:
+                    self._memo[newkey] = result
+                    kept += 1
+        return kept, dropped
+
+    def stats(self):
+        with self._lock:
+            return {'section': self.name, 'entries': len(self._memo), 'hits': self.hits, 'misses': self.misses}
+
+
+_lock = threading.Lock()
+_sections = {}
+
+
+def section(name, depends_on=(), maxsize=DEFAULT_MAXSIZE):
+    """The process-wide section called `name`, created on first use.
+
+    Streamlit re-executes the dashboard script on every rerun, so sections
+    are kept here to carry their memos from one rerun to the next.
+    """
+    with _lock:
+        if name not in _sections or _sections[name].depends_on != tuple(depends_on):
+            _sections[name] = Section(name, depends_on, maxsize)
+        return _sections[name]
+
+
+def invalidate(predicate=None):
+    """Invalidates the memos of every section, see Section.invalidate."""
+    with _lock:
+        sections = list(_sections.values())
+    for s in sections:
+        s.invalidate(predicate)
+
+
+def migrate(old_version, new_version, stale):
+    """Migrates the memos of every section, returns the summed (kept, dropped) results."""
+    with _lock:
+        sections = list(_sections.values())
+    counts = [s.migrate(old_version, new_version, stale) for s in sections]
+    return sum(k for k, _ in counts), sum(d for _, d in counts)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Correlation and regression statistics between county loss and its drivers.
+
+For every state and for the nation, computes the Pearson and Spearman
+correlation of EAL_VALT with each exposure and risk metric, and a log-log
+OLS fit (loss elasticity). Confidence intervals come from a bootstrap done
+in one batch: the resamples are a (resamples x counties) matrix of draw
+counts, so every statistic of every resample is a couple of matrix
+products instead of a Python loop. Results are cached per dataset version.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+from nri_cube import NATIONAL
+from nri_data import digest_memo, load_nri, source_digest
+
+
+#loss variable and the metrics it is related to
+TARGET = 'EAL_VALT'
+METRICS = ['BUILDVALUE', 'POPULATION', 'AGRIVALUE', 'RISK_SCORE', 'SOVI_SCORE', 'RESL_SCORE']
+
+#bootstrap resamples and two sided confidence level
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+
+#groups with fewer counties get no statistics
+MIN_COUNTIES = 5
+
+
+def resample_counts(n, resamples, rng):
+    """(resamples x n) float32 matrix of how often each county is drawn in each bootstrap resample."""
+    draws = rng.integers(0, n, size=(resamples, n), dtype='int32') + n * np.arange(resamples, dtype='int32')[:, None]
+    return np.bincount(draws.ravel(), minlength=resamples * n).reshape(resamples, n).astype('float32')
+
+
+def _moment_columns(x, y, mask):
+    #(n, 6m) columns whose weighted sums are the count, sums, sums of squares and cross products
+    #of every metric's valid pairs
+    x, y, mask = np.where(mask, x, 0.0), np.where(mask, y, 0.0), mask.astype('float64')
+    return np.hstack([mask, x, y, x * x, y * y, x * y])
+
+
+def _correlation(s0, sx, sy, sxx, syy, sxy):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (s0 * sxy - sx * sy) / np.sqrt((s0 * sxx - sx * sx) * (s0 * syy - sy * sy))
+
+
+def _slope(s0, sx, sy, sxx, syy, sxy):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (s0 * sxy - sx * sy) / (s0 * sxx - sx * sx)
+
+
+def _centered(values, mask):
+    #subtracting the valid mean keeps the weighted sums of squares from cancelling
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(np.where(mask, values, np.nan), axis=0)
+    return values - np.nan_to_num(mean)
+
+
+def _ranks(values, mask):
+    #average ranks within each metric's valid pairs, invalid entries left as nan
+    return pd.DataFrame(np.where(mask, values, np.nan)).rank().to_numpy()
+
+
+def group_statistics(x, y, resamples=RESAMPLES, confidence=CONFIDENCE, rng=None):
+    """Statistics of loss `y` (n) against every column of `x` (n, m) for one group of counties.
+
+    Returns a dict of (m,) arrays: n, pearson, spearman, slope, intercept, r2,
+    and a _lo/_hi interval bound for pearson, spearman and slope. Spearman
+    intervals reuse the full sample ranks in each resample.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    n, m = x.shape
+    y = np.repeat(y[:, None], m, axis=1)
+    valid = np.isfinite(x) & np.isfinite(y)
+    positive = valid & (x > 0) & (y > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lx, ly = np.log(np.where(positive, x, 1.0)), np.log(np.where(positive, y, 1.0))
+
+    pairs = {'pearson': (_centered(x, valid), _centered(y, valid), valid),
+             'spearman': (_ranks(x, valid), _ranks(y, valid), valid)}
+    logs = (_centered(lx, positive), _centered(ly, positive), positive)
+
+    #every moment of the three families in one (n, 18m) matrix, so each weight matrix is read once
+    families = [pairs['pearson'], pairs['spearman'], logs]
+    columns = np.hstack([_moment_columns(np.nan_to_num(a), np.nan_to_num(b), mask) for a, b, mask in families])
+
+    def moments(weights, columns):
+        #(rows, family, moment, metric)
+        return (weights @ columns).astype('float64').reshape(len(weights), 3, 6, m).transpose(1, 2, 0, 3)
+
+    #the resamples run in float32, which moves interval bounds by ~1e-6 and halves the matmul
+    point = moments(np.ones((1, n)), columns)
+    boot = moments(resample_counts(n, resamples, rng), columns.astype('float32'))
+    tail = (1 - confidence) / 2 * 100
+
+    out = {'n': valid.sum(axis=0)}
+    for i, name in enumerate(['pearson', 'spearman']):
+        out[name] = _correlation(*point[i])[0]
+        out[name + '_lo'], out[name + '_hi'] = np.nanpercentile(_correlation(*boot[i]), [tail, 100 - tail], axis=0)
+
+    out['slope'] = _slope(*point[2])[0]
+    out['slope_lo'], out['slope_hi'] = np.nanpercentile(_slope(*boot[2]), [tail, 100 - tail], axis=0)
+    #intercept on the uncentered logs
+    s0, sx, sy = (np.where(positive, v, 0.0).sum(axis=0) for v in (np.ones_like(lx), lx, ly))
+    out['intercept'] = (sy - out['slope'] * sx) / s0
+    out['r2'] = _correlation(*point[2])[0] ** 2
+    return out
+
+
+def loss_statistics(NRI, resamples=RESAMPLES, confidence=CONFIDENCE, seed=0):
+    """Statistics of every state and the nation, a frame indexed by (state, metric)."""
+    rng = np.random.default_rng(seed)
+    states = NRI['STATEABBRV'].astype(str).to_numpy()
+    x = NRI[METRICS].to_numpy(dtype='float64')
+    y = NRI[TARGET].to_numpy(dtype='float64')
+
+    frames = []
+    for state in list(np.unique(states)) + [NATIONAL]:
+        rows = slice(None) if state == NATIONAL else states == state
+        if len(y[rows]) < MIN_COUNTIES:
+            continue
+        stats = group_statistics(x[rows], y[rows], resamples, confidence, rng)
+        frame = pd.DataFrame(stats, index=pd.Index(METRICS, name='metric'))
+        frames.append(pd.concat({state: frame}, names=['state']))
+    return pd.concat(frames)
+
+
+def correlation_table(stats, metric, label=None):
+    """Display table of one metric's statistics, a row per state and the nation."""
+    rows = stats.xs(metric, level='metric')
+    label = label or metric
+    return pd.DataFrame({
+        'Counties': rows['n'].astype(int),
+        'Pearson r': rows['pearson'].round(2),
+        'Pearson 95% CI': ['%.2f to %.2f' % b for b in zip(rows['pearson_lo'], rows['pearson_hi'])],
+        'Spearman rho': rows['spearman'].round(2),
+        'Loss elasticity': rows['slope'].round(2),
+        'Elasticity 95% CI': ['%.2f to %.2f' % b for b in zip(rows['slope_lo'], rows['slope_hi'])],
+        'Log-log R2': rows['r2'].round(2),
+    }).rename_axis('State').rename(index={NATIONAL: 'All states'}).rename_axis(columns=label)
+
+
+_stats = digest_memo()
+
+
+def load_statistics(source=None, resamples=RESAMPLES):
+    """Loss statistics of an NRI source, computed once per dataset version."""
+    key = (source_digest(source), resamples)
+    return _stats.get(key, lambda: loss_statistics(load_nri(source), resamples))
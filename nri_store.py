@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped read-only stores of the NRI table and the map geometry.
+
+A store is a directory next to its source (NRI_State_Dat.store/ next to
+NRI_State_Dat.csv), written by nri_build.py --store:
+
+  table store     floats.npy     every float32 column as one (columns x rows)
+                                 block, one contiguous row per column
+                  doubles.npy    the same for the float64 columns
+                  columns.arrow  Arrow IPC file with the other columns
+                                 (categoricals, integers, strings) and the
+                                 column order, source digest and the
+                                 projection it was built from as metadata
+  geometry store  geometry.arrow Arrow IPC file with one row per (state,
+                                 tolerance): the pre-serialized GeoJSON
+                                 bytes nri_mapview sends, and the state's
+                                 bounds
+
+Both are opened with memory maps, so the float block and the geometry
+bytes live once in the OS page cache and are shared zero-copy by every
+session in a process and by every server process on the host; a process
+only pays for the small non-float columns and its own figures.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+STORE_SUFFIX = '.store'
+FLOATS_FILE = 'floats.npy'
+DOUBLES_FILE = 'doubles.npy'
+COLUMNS_FILE = 'columns.arrow'
+GEOMETRY_FILE = 'geometry.arrow'
+
+#schema metadata keys
+DIGEST_KEY = b'nri_source_sha256'
+ORDER_KEY = b'nri_columns'
+FLOAT_KEY = b'nri_float_columns'
+DOUBLE_KEY = b'nri_double_columns'
+PROJECTION_KEY = b'nri_projection'
+
+
+def store_path(source):
+    """Store directory of a local source file."""
+    return os.path.splitext(source)[0] + STORE_SUFFIX
+
+
+def is_store(source):
+    return source.endswith(STORE_SUFFIX)
+
+
+def _metadata(path, name):
+    with pa.memory_map(os.path.join(path, name)) as source:
+        return pa.ipc.open_file(source).schema.metadata or {}
+
+
+def store_digest(path):
+    """Source digest recorded in a table or geometry store."""
+    name = COLUMNS_FILE if os.path.exists(os.path.join(path, COLUMNS_FILE)) else GEOMETRY_FILE
+    return _metadata(path, name)[DIGEST_KEY].decode()
+
+
+def _write_ipc(table, path):
+    #uncompressed, so readers map the buffers instead of decoding them
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def write_table_store(NRI, path, digest, projection=None):
+    """Writes a typed NRI frame as a table store and returns its path.
+
+    projection is the column list the frame was read with (None: every
+    column of the source), so readers know which projections it can serve.
+    """
+    os.makedirs(path, exist_ok=True)
+    floats = [c for c in NRI.columns if NRI[c].dtype == np.float32]
+    doubles = [c for c in NRI.columns if NRI[c].dtype == np.float64]
+    others = [c for c in NRI.columns if c not in floats and c not in doubles]
+    for name, block, dtype in ((FLOATS_FILE, floats, 'float32'), (DOUBLES_FILE, doubles, 'float64')):
+        np.save(os.path.join(path, name), np.ascontiguousarray(NRI[block].to_numpy(dtype=dtype).T))
+
+    table = pa.Table.from_pandas(NRI[others], preserve_index=False)
+    table = table.replace_schema_metadata({DIGEST_KEY: digest.encode(),
+                                           ORDER_KEY: json.dumps(list(NRI.columns)).encode(),
+                                           FLOAT_KEY: json.dumps(floats).encode(),
+                                           DOUBLE_KEY: json.dumps(doubles).encode(),
+                                           PROJECTION_KEY: json.dumps(None if projection is None
+                                                                      else sorted(projection)).encode()})
+    _write_ipc(table, os.path.join(path, COLUMNS_FILE))
+    return path
+
+
+def store_covers(path, columns):
+    """True when a table store holds every column of a projection (None: every column of the source)."""
+    metadata = _metadata(path, COLUMNS_FILE)
+    if PROJECTION_KEY not in metadata or DOUBLE_KEY not in metadata:
+        #written by an older build: what it left out is unknown, and its dollar columns are float32
+        return False
+    projection = json.loads(metadata[PROJECTION_KEY])
+    return projection is None or (columns is not None and set(columns) <= set(projection))
+
+
+def read_table_store(path, columns=None):
+    """NRI frame of a table store, its float columns read-only views of the mapped blocks.
+
+    Float32 then float64 columns come first, then the others in their stored
+    order; columns None reads every stored column. When `columns` leaves out
+    some columns of a block, the kept ones are copied out of it; the
+    dashboard's projection reads whole blocks and copies nothing.
+    """
+    with pa.memory_map(os.path.join(path, COLUMNS_FILE)) as source:
+        table = pa.ipc.open_file(source).read_all()
+    metadata = table.schema.metadata
+    wanted = set(json.loads(metadata[ORDER_KEY]) if columns is None else columns)
+
+    frames = []
+    for name, key in ((FLOATS_FILE, FLOAT_KEY), (DOUBLES_FILE, DOUBLE_KEY)):
+        names = json.loads(metadata[key])
+        block = np.load(os.path.join(path, name), mmap_mode='r')
+        keep = [i for i, c in enumerate(names) if c in wanted]
+        if len(keep) < len(names):
+            block = block[keep]
+        frames.append(pd.DataFrame(block.T, columns=[names[i] for i in keep], copy=False))
+    NRI = pd.concat(frames, axis=1, copy=False)
+
+    for name in table.column_names:
+        if name in wanted:
+            NRI[name] = table.column(name).to_pandas()
+    return NRI
+
+
+class PrebuiltGeometry:
+    """Pre-serialized geometry variants and state bounds of a geometry store."""
+
+    def __init__(self, path):
+        with pa.memory_map(os.path.join(path, GEOMETRY_FILE)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        self.digest = table.schema.metadata[DIGEST_KEY].decode()
+        states = table.column('state_fips').to_numpy()
+        tolerances = table.column('tolerance').to_numpy()
+        blobs = table.column('geometry').combine_chunks()
+        #buffers slice the mapped file, nothing is copied until a blob is sent
+        self._blobs = {(int(s), float(t)): blobs[i].as_buffer() for i, (s, t) in enumerate(zip(states, tolerances))}
+        first = ~pd.Series(states).duplicated().to_numpy()
+        self.bounds = pd.DataFrame({c: table.column(c).to_numpy()[first] for c in ('west', 'south', 'east', 'north')},
+                                   index=pd.Index(states[first].astype('int64'), name='STATEFIPS'))
+        self.states = sorted(self.bounds.index)
+
+    def encoded(self, state_fips, tolerance):
+        """GeoJSON bytes of one variant, or None when the store does not hold it."""
+        blob = self._blobs.get((int(state_fips), float(tolerance)))
+        return None if blob is None else blob.to_pybytes()
+
+
+def write_geometry_store(geometry, tolerances, path, digest):
+    """Writes every state x tolerance variant of an nri_geo store as a geometry store."""
+    os.makedirs(path, exist_ok=True)
+    bounds = geometry.bounds()
+    rows = [(s, t) for s in geometry.states for t in tolerances]
+    blobs = [json.dumps(geometry.subset(s, t), separators=(',', ':')).encode() for s, t in rows]
+    table = pa.table({'state_fips': pa.array([s for s, _ in rows], pa.int16()),
+                      'tolerance': pa.array([t for _, t in rows], pa.float64()),
+                      'geometry': pa.array(blobs, pa.large_binary()),
+                      **{c: pa.array([bounds.loc[s, c] for s, _ in rows], pa.float64())
+                         for c in ('west', 'south', 'east', 'north')}})
+    table = table.replace_schema_metadata({DIGEST_KEY: digest.encode()})
+    _write_ipc(table, os.path.join(path, GEOMETRY_FILE))
+    return path
@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from nri_api import encode, make_app
+
+
+def test_json_serves_stored_values():
+    frame = pd.DataFrame({'FIPS': pd.array([48201, None], dtype='Int64'),
+                          'STATEABBRV': pd.Categorical(['TX', 'TX']),
+                          'RISK_SCORE': np.array([80.61854, np.nan], dtype='float32'),
+                          'EAL_VALT': np.array([1181227049.0, 557755.94], dtype='float64')})
+    body, _ = encode(frame, 'json')
+    assert b'"RISK_SCORE":80.61854,' in body and b'"EAL_VALT":557755.94}' in body
+    assert json.loads(body) == [{'FIPS': 48201, 'STATEABBRV': 'TX', 'RISK_SCORE': 80.61854, 'EAL_VALT': 1181227049.0},
+                                {'FIPS': None, 'STATEABBRV': 'TX', 'RISK_SCORE': None, 'EAL_VALT': 557755.94}]
+
+
+def test_record_is_one_object():
+    frame = pd.DataFrame({'HRCN_EALT': np.array([0.1], dtype='float32')})
+    body, _ = encode(frame, 'json', record=True)
+    assert json.loads(body) == {'HRCN_EALT': 0.1}
+
+
+def fetch(*paths):
+    #(status, parsed body) of each path, from a server on an unused local port
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(make_app())
+        server.add_sockets([sock])
+        client = AsyncHTTPClient()
+        try:
+            return [await client.fetch('http://127.0.0.1:%d%s' % (port, path), raise_error=False) for path in paths]
+        finally:
+            server.stop()
+    return [(r.code, json.loads(r.body)) for r in asyncio.run(run())]
+
+
+def test_limit_must_be_a_positive_integer():
+    limits = ['-1', '0', '1.5', 'ten']
+    responses = fetch(*['/counties?limit=' + limit for limit in limits], '/counties?state=TX&limit=2')
+    for limit, (code, body) in zip(limits, responses):
+        assert code == 400 and body == {'error': 'bad limit: ' + limit}
+    code, body = responses[-1]
+    assert code == 200 and len(body) == 2
@@ -0,0 +1,23 @@
+from nri_figcache import FigureCache
+
+
+def cache():
+    return FigureCache(100, sizeof=len, version=lambda: 'v1')
+
+
+def test_migrate_keeps_entries_rebuilt_for_the_new_version():
+    figures = cache()
+    figures.put(('map', 'v1', ('TX',), ()), 'old figure')
+    figures.put(('map', 'v2', ('TX',), ()), 'rebuilt')
+    assert figures.migrate('v1', 'v2', lambda key: False) == (0, 1)
+    assert figures.get(('map', 'v2', ('TX',), ())) == 'rebuilt'
+    assert figures.bytes == len('rebuilt')
+
+
+def test_migrate_drops_stale_entries():
+    figures = cache()
+    figures.put(('map', 'v1', ('TX',), ()), 'texas')
+    figures.put(('map', 'v1', ('CA',), ()), 'california')
+    assert figures.migrate('v1', 'v2', lambda key: key[2] == ('TX',)) == (1, 1)
+    assert figures.get(('map', 'v2', ('CA',), ())) == 'california'
+    assert figures.bytes == len('california')
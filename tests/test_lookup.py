@@ -0,0 +1,29 @@
+import pandas as pd
+
+from nri_lookup import CountyLocator, RiskProfiles, PROFILE_COLUMNS, PERIL_CODES
+
+
+def square(fips, x):
+    ring = [[x, 0], [x + 1, 0], [x + 1, 1], [x, 1], [x, 0]]
+    return {'type': 'Feature', 'id': fips, 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+
+
+def profiles():
+    #two county polygons, only the first has an NRI row
+    counties = {'type': 'FeatureCollection', 'features': [square('48001', 0.0), square('48003', 2.0)]}
+    NRI = pd.DataFrame({c: [1.0] for c in PROFILE_COLUMNS + [p + '_EALT' for p in PERIL_CODES]})
+    NRI['FIPS'], NRI['COUNTY'], NRI['STATEABBRV'] = 48001, 'A', 'TX'
+    return RiskProfiles(NRI, CountyLocator(counties))
+
+
+def test_batch_leaves_fips_missing_for_polygon_without_nri_row():
+    points = pd.DataFrame({'lat': [0.5, 0.5, 5.0], 'lon': [0.5, 2.5, 5.0]})
+    table = profiles().batch(points)
+    assert str(table['NRI_FIPS'].dtype) == 'Int64'
+    assert table['NRI_FIPS'].tolist()[0] == 48001
+    assert table['NRI_FIPS'].isna().tolist() == [False, True, True]
+    assert table['NRI_FIPS'].notna().sum() == 1
+
+
+def test_profile_of_polygon_without_nri_row_is_none():
+    assert profiles().profile(0.5, 2.5) is None
@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+from nri_rank import RankIndex, rank_column
+
+
+def counties():
+    #drought has agriculture and total loss columns only, like the NRI table
+    return pd.DataFrame({'FIPS': [48001, 48003, 6001], 'COUNTY': ['A', 'B', 'C'],
+                         'STATEABBRV': ['TX', 'TX', 'CA'],
+                         'DRGT_EALA': [1.0, 3.0, 2.0], 'DRGT_EALT': [1.0, 3.0, 2.0],
+                         'EAL_VALT': [5.0, 1.0, 9.0]})
+
+
+def test_loss_types_only_lists_existing_columns():
+    index = RankIndex(counties())
+    assert index.loss_types('Drought') == ['agriculture', 'total']
+
+
+def test_top_of_missing_peril_loss_pair_raises_value_error():
+    index = RankIndex(counties())
+    with pytest.raises(ValueError):
+        index.top(rank_column('Drought', 'building'))
+
+
+def test_top_ranks_within_state():
+    top = RankIndex(counties()).top(rank_column('Drought', 'agriculture'), state='TX')
+    assert top['COUNTY'].tolist() == ['B', 'A']
@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+
+from nri_core import SCATTER_FRAME_COLUMNS
+from nri_cube import _cubes, load_cube
+from nri_data import source_digest
+from nri_registry import Change, depends, diff, fingerprint, refresh, stale
+
+
+def counties():
+    return pd.DataFrame({'FIPS': [48001, 48003, 6001], 'COUNTY': ['A', 'B', 'C'],
+                         'STATEABBRV': ['TX', 'TX', 'CA'], 'BUILDVALUE': [1.0, 2.0, 3.0],
+                         'POPULATION': [1.0, 2.0, 3.0], 'AGRIVALUE': [1.0, 2.0, 3.0],
+                         'RISK_SCORE': [1.0, 2.0, 3.0], 'SOVI_SCORE': [1.0, 2.0, 3.0],
+                         'RESL_SCORE': [1.0, 2.0, 3.0], 'EAL_VALT': [1.0, 2.0, 3.0],
+                         'HRCN_EALT': [1.0, 2.0, 3.0]})
+
+
+@depends(columns=SCATTER_FRAME_COLUMNS)
+def scatter(y_value):
+    pass
+
+
+@depends(state='state', columns=['HRCN_EALT'])
+def peril_map(state):
+    pass
+
+
+def key(func, *args):
+    return (func.__qualname__, 'digest', args, ())
+
+
+def test_diff_finds_changed_state_and_column():
+    new = counties()
+    new.loc[0, 'HRCN_EALT'] = 5.0
+    change = diff(fingerprint(counties()), fingerprint(new))
+    assert change.states == {'TX'} and change.columns == {'HRCN_EALT'}
+
+
+def test_renamed_county_invalidates_scatter():
+    new = counties()
+    new.loc[2, 'COUNTY'] = 'Renamed'
+    change = diff(fingerprint(counties()), fingerprint(new))
+    assert change.columns == {'COUNTY'}
+    assert stale(change, key(scatter, 'Population'))
+    assert not stale(change, key(peril_map, 'CA'))
+
+
+def test_state_scoped_entry_only_stale_for_its_state():
+    change = Change(['TX'], ['HRCN_EALT'])
+    assert stale(change, key(peril_map, 'TX'))
+    assert not stale(change, key(peril_map, 'CA'))
+    assert not stale(change, key(scatter, 'Population'))
+
+
+def test_refresh_evicts_superseded_release(tmp_path):
+    source = str(tmp_path / 'nri.csv')
+    frame = counties().rename(columns={'FIPS': 'STCOFIPS'}).assign(STATEFIPS=[48, 48, 6])
+    frame.to_csv(source, index=False)
+    assert refresh(source) is None
+    old = source_digest(source)
+    load_cube(source)
+    assert _cubes.peek(old) is not None
+
+    frame.loc[0, 'HRCN_EALT'] = 5.0
+    frame.to_csv(source, index=False)
+    os.utime(source, (1, 1))
+    assert refresh(source).states == {'TX'}
+    assert _cubes.peek(old) is None
+    assert _cubes.peek(source_digest(source)).loss('TX', 'HRCN') == 7.0
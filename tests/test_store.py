@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from nri_data import apply_schema, load_nri
+from nri_store import read_table_store, store_covers, store_path, write_table_store
+
+
+def counties():
+    return pd.DataFrame({'STATEABBRV': ['TX', 'CA'], 'COUNTY': ['Harris', 'Alameda'], 'STCOFIPS': [48201, 6001],
+                         'RISK_SCORE': [80.5, 40.25], 'SOVI_SCORE': [38.9, 20.1]})
+
+
+def test_store_reads_every_column_without_projection(tmp_path):
+    path = write_table_store(apply_schema(counties()), str(tmp_path / 'nri.store'), 'digest')
+    NRI = read_table_store(path)
+    assert set(NRI.columns) == set(counties().columns)
+    assert NRI['COUNTY'].tolist() == ['Harris', 'Alameda']
+
+
+def test_store_covers_only_its_projection(tmp_path):
+    projection = ['STATEABBRV', 'STCOFIPS', 'RISK_SCORE']
+    path = write_table_store(apply_schema(counties()[projection]), str(tmp_path / 'nri.store'), 'digest', projection)
+    assert store_covers(path, ['STCOFIPS', 'RISK_SCORE'])
+    assert not store_covers(path, ['STCOFIPS', 'SOVI_SCORE'])
+    assert not store_covers(path, None)
+
+
+def test_load_falls_back_to_csv_for_columns_outside_the_store(tmp_path):
+    source = str(tmp_path / 'nri.csv')
+    counties().to_csv(source, index=False)
+    projection = ['STATEABBRV', 'STCOFIPS', 'RISK_SCORE']
+    write_table_store(apply_schema(counties()[projection]), store_path(source), 'digest', projection)
+    os.utime(source, (1, 1))
+
+    assert load_nri(source, columns=projection).shape == (2, 3)
+    NRI = load_nri(source, columns=None)
+    assert set(NRI.columns) == {'STATEABBRV', 'COUNTY', 'FIPS', 'RISK_SCORE', 'SOVI_SCORE'}
+    assert np.allclose(NRI['SOVI_SCORE'], [38.9, 20.1])
+
+
+def test_dollar_columns_round_trip_exactly(tmp_path):
+    frame = counties().assign(EAL_VALT=[1181227049.0, 1433565530.0], BUILDVALUE=[447922000123.0, 1.0])
+    path = write_table_store(apply_schema(frame), str(tmp_path / 'nri.store'), 'digest')
+    NRI = read_table_store(path)
+    assert NRI['EAL_VALT'].dtype == 'float64' and NRI['RISK_SCORE'].dtype == 'float32'
+    assert NRI['EAL_VALT'].tolist() == [1181227049.0, 1433565530.0]
+    assert NRI['BUILDVALUE'].tolist() == [447922000123.0, 1.0]